@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import froc
+from utils.froc import evaluate_froc
+
+
+def _reference_case():
+    """
+    4 escaneos, 2 nódulos. Probabilidades empatadas (0.8) mezclan un TP y un
+    FP, así que la curva tiene un tramo diagonal:
+
+        umbral   FPs/escaneo   sensibilidad
+        -        0.00          0.0
+        0.9      0.25          0.0
+        0.8      0.50          0.5
+        0.6      0.75          0.5
+        0.3      0.75          1.0
+    """
+    annotations = pd.DataFrame({
+        'seriesuid': ['A', 'B'],
+        'coordX': [0.0, 0.0], 'coordY': [0.0, 0.0], 'coordZ': [0.0, 0.0],
+        'diameter_mm': [10.0, 10.0],
+    })
+    predictions = pd.DataFrame({
+        'seriesuid': ['A', 'A', 'B', 'B', 'C'],
+        'coordX': [0.0, 40.0, 1.0, 40.0, 0.0],
+        'coordY': [0.0, 0.0, 1.0, 0.0, 0.0],
+        'coordZ': [0.0, 0.0, 1.0, 0.0, 0.0],
+        'probability': [0.8, 0.8, 0.3, 0.6, 0.9],
+    })
+    return predictions, annotations, ['A', 'B', 'C', 'D']
+
+
+def test_sensitivity_is_interpolated_on_the_froc_curve():
+    predictions, annotations, seriesuids = _reference_case()
+    result = evaluate_froc(predictions, annotations, seriesuids=seriesuids,
+                           fp_rates=(0.125, 0.25, 0.375, 0.5, 0.625, 1.0), n_bootstrap=0)
+
+    np.testing.assert_allclose(result['fps_curve'], [0, 0.25, 0.5, 0.75, 0.75])
+    np.testing.assert_allclose(result['sensitivity_curve'], [0, 0, 0.5, 0.5, 1.0])
+    np.testing.assert_allclose(result['sensitivity'], [0, 0, 0.25, 0.5, 0.5, 1.0])
+    np.testing.assert_allclose(
+        result['sensitivity'],
+        np.interp(result['fp_rates'], result['fps_curve'], result['sensitivity_curve']))
+
+
+def test_cpm_matches_hand_computed_reference():
+    predictions, annotations, seriesuids = _reference_case()
+    result = evaluate_froc(predictions, annotations, seriesuids=seriesuids, n_bootstrap=0)
+
+    np.testing.assert_allclose(result['sensitivity'], [0, 0, 0.5, 1, 1, 1, 1])
+    assert result['cpm'] == pytest.approx(4.5 / 7)
+    assert result['n_scans'] == 4
+    assert result['n_detected'] == 2
+    assert result['n_false_positives'] == 3
+
+
+def test_inferred_seriesuids_warns_and_drops_empty_scans():
+    predictions, annotations, _ = _reference_case()
+    with pytest.warns(UserWarning, match='seriesuids'):
+        result = evaluate_froc(predictions, annotations, n_bootstrap=0)
+    assert result['n_scans'] == 3
+
+
+def test_bootstrap_batches_stay_within_element_budget(monkeypatch):
+    # El escaneo 0 concentra los FPs de mayor probabilidad: las muestras que
+    # no lo incluyen obligan a ampliar el corte de la estimación puntual
+    rng = np.random.default_rng(0)
+    n_scans = 20
+    uids = np.concatenate([np.zeros(100, int), np.repeat(np.arange(1, n_scans), 15)])
+    probabilities = np.where(uids == 0, 0.9, 0.0) + rng.uniform(0, 0.1, len(uids))
+    predictions = pd.DataFrame({
+        'seriesuid': uids.astype(str),
+        'coordX': rng.uniform(50, 100, len(uids)),
+        'coordY': np.zeros(len(uids)), 'coordZ': np.zeros(len(uids)),
+        'probability': probabilities,
+    })
+    annotations = pd.DataFrame({
+        'seriesuid': ['0', '1'], 'coordX': [0.0, 0.0], 'coordY': [0.0, 0.0],
+        'coordZ': [0.0, 0.0], 'diameter_mm': [10.0, 10.0],
+    })
+
+    budget = 2000
+    shapes = []
+    froc_points = froc._froc_points
+
+    def recording(weights, scan, *args):
+        shapes.append((len(weights), len(scan)))
+        return froc_points(weights, scan, *args)
+
+    monkeypatch.setattr(froc, 'BOOTSTRAP_BATCH_ELEMENTS', budget)
+    monkeypatch.setattr(froc, '_froc_points', recording)
+    result = evaluate_froc(predictions, annotations, seriesuids=[str(i) for i in range(n_scans)],
+                           fp_rates=(0.25, 0.5, 1.0), n_bootstrap=200)
+
+    bootstrap = shapes[1:]
+    assert max(limit for _, limit in bootstrap) > min(limit for _, limit in bootstrap)
+    assert all(rows * min(limit, len(uids)) <= budget for rows, limit in bootstrap)
+    assert np.all(result['ci_low'] <= result['ci_high'])
@@ -0,0 +1,41 @@
+import pytest
+import torch
+
+from utils.metrics import DiceFocalLoss, DiceLoss, FocalLoss, benchmark_losses
+
+
+def _inputs(shape=(2, 3, 4, 5, 6), seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    logits = (torch.randn(shape, generator=generator, dtype=torch.float64) * 3).requires_grad_(True)
+    targets = (torch.rand(shape, generator=generator, dtype=torch.float64) > 0.7).double()
+    ignore_mask = torch.rand(shape[:1] + (1,) + shape[2:], generator=generator) > 0.8
+    return logits, targets, ignore_mask
+
+
+@pytest.mark.parametrize('loss_cls', [DiceLoss, FocalLoss, DiceFocalLoss])
+@pytest.mark.parametrize('per_sample', [False, True])
+@pytest.mark.parametrize('per_class', [False, True])
+@pytest.mark.parametrize('use_ignore_mask', [False, True])
+def test_fused_loss_gradcheck(loss_cls, per_sample, per_class, use_ignore_mask):
+    logits, targets, ignore_mask = _inputs()
+    criterion = loss_cls(per_sample=per_sample, per_class=per_class)
+    mask = ignore_mask if use_ignore_mask else None
+
+    assert torch.autograd.gradcheck(lambda x: criterion(x, targets, ignore_mask=mask), (logits,))
+
+
+@pytest.mark.parametrize('gamma', [0.5, 1.0, 3.0])
+def test_focal_gradcheck_for_other_gammas(gamma):
+    logits, targets, ignore_mask = _inputs()
+    criterion = FocalLoss(gamma=gamma, per_sample=True, per_class=True)
+
+    assert torch.autograd.gradcheck(lambda x: criterion(x, targets, ignore_mask=ignore_mask), (logits,))
+
+
+def test_benchmark_reports_peak_memory():
+    results = benchmark_losses(shape=(1, 1, 8, 32, 32), n_steps=1)
+
+    for name in ('reference', 'fused'):
+        assert results[name]['peak_mb'] > 0
+        assert results[name]['peak_mb'] >= results[name]['saved_for_backward_mb']
+    assert results['abs_diff'] < 1e-4
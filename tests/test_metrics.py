@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from utils.metrics import MetricAccumulator, SegmentationMetrics
+
+
+def _product_metrics(y_true, y_pred, smooth=1e-7):
+    """Fórmulas originales con productos (máscaras suaves)"""
+    t = y_true.astype(np.float64).ravel()
+    p = y_pred.astype(np.float64).ravel()
+    intersection = (t * p).sum()
+    return {
+        'dice': (2 * intersection + smooth) / (t.sum() + p.sum() + smooth),
+        'iou': (intersection + smooth) / (t.sum() + p.sum() - intersection + smooth),
+        'sensitivity': (intersection + smooth) / (t.sum() + smooth),
+        'specificity': (((1 - t) * (1 - p)).sum() + smooth) / ((1 - t).sum() + smooth),
+    }
+
+
+def test_soft_predictions_use_products():
+    rng = np.random.default_rng(0)
+    y_true = (rng.random((12, 16, 20)) > 0.7).astype(np.uint8)
+    y_pred = rng.random((12, 16, 20)).astype(np.float32)
+
+    result = SegmentationMetrics.compute_all_metrics(y_true, y_pred)
+    expected = _product_metrics(y_true, y_pred)
+    for name, value in expected.items():
+        assert result[name] == pytest.approx(value)
+
+    accumulator = MetricAccumulator()
+    for z in range(0, 12, 5):
+        accumulator.update(y_true[z:z + 5], y_pred[z:z + 5])
+    assert accumulator.compute()['dice'] == pytest.approx(expected['dice'])
+
+
+def test_binary_masks_count_nonzero_voxels():
+    y_true = np.zeros((4, 5, 6), dtype=np.uint8)
+    y_pred = np.zeros((4, 5, 6), dtype=bool)
+    y_true[1:3, 1:3, 1:3] = 1
+    y_pred[2:4, 1:3, 1:3] = True
+
+    counts = SegmentationMetrics.confusion_counts(y_true, y_pred)
+    assert counts == {'tp': 4, 'fp': 4, 'fn': 4, 'tn': 108}
+    assert all(isinstance(value, int) for value in counts.values())
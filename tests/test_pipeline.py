@@ -0,0 +1,25 @@
+import pytest
+
+from utils.pipeline import PreprocessingPipeline, Stage
+
+
+def _tag(name):
+    def func(item):
+        item.setdefault('path', []).append(name)
+        return item
+    return func
+
+
+def test_duplicate_stage_names_are_rejected():
+    with pytest.raises(ValueError, match='x'):
+        PreprocessingPipeline([Stage('x', _tag('a')), Stage('x', _tag('b'))])
+
+
+def test_stages_run_in_order_and_are_timed_separately():
+    pipeline = PreprocessingPipeline([Stage('a', _tag('a'), workers=2), Stage('b', _tag('b'), workers=3)])
+    items = list(pipeline.run(['s1', 's2', 's3', 's4']))
+
+    assert [item['seriesuid'] for item in items] == ['s1', 's2', 's3', 's4']
+    assert all(item['path'] == ['a', 'b'] for item in items)
+    assert pipeline.timings['a']['items'] == 4
+    assert pipeline.timings['b']['items'] == 4
@@ -3,23 +3,28 @@ Utilities para procesamiento de imágenes médicas CT - LUNA16
 
 Módulos disponibles:
 - data_loader: Carga de datos LUNA16
+- catalog: Catálogo de escaneos a partir de cabeceras .mhd
 - preprocessor: Preprocesamiento de imágenes CT
 - visualizer: Visualización de imágenes y resultados
 - metrics: Métricas de evaluación
 - download_luna16: Descarga y configuración del dataset
 """
 
-from .data_loader import LUNA16DataLoader
+from .data_loader import LUNA16DataLoader, read_mhd_header
+from .catalog import LUNA16Catalog
 from .preprocessor import LungPreprocessor
 from .visualizer import LungVisualizer
-from .metrics import SegmentationMetrics, DiceLoss
+from .metrics import SegmentationMetrics, MetricAccumulator, DiceLoss
 from .download_luna16 import download_luna16
 
 __all__ = [
     'LUNA16DataLoader',
+    'read_mhd_header',
+    'LUNA16Catalog',
     'LungPreprocessor',
     'LungVisualizer',
     'SegmentationMetrics',
+    'MetricAccumulator',
     'DiceLoss',
     'download_luna16',
 ]
@@ -0,0 +1,270 @@
+"""
+Índice de anotaciones/candidatos LUNA16 agrupado por seriesuid
+
+Este módulo proporciona:
+- Lectura de annotations.csv / candidates.csv con dtypes explícitos
+- Un índice pre-agrupado (filas contiguas por seriesuid) con acceso O(1)
+- Conversión vectorizada de todas las coordenadas de un escaneo a voxel
+- Caché binaria (.npz) para no re-parsear el CSV en cada proceso
+"""
+
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+from .coordinates import VoxelTransform
+
+
+# Dtypes explícitos de los CSV de LUNA16 (evita la inferencia de pandas)
+ANNOTATION_DTYPES = {
+    'seriesuid': str,
+    'coordX': np.float64,
+    'coordY': np.float64,
+    'coordZ': np.float64,
+    'diameter_mm': np.float64,
+}
+
+CANDIDATE_DTYPES = {
+    'seriesuid': str,
+    'coordX': np.float64,
+    'coordY': np.float64,
+    'coordZ': np.float64,
+    'class': np.int8,
+}
+
+
+def _source_signature(csv_path):
+    """Ruta absoluta, tamaño y mtime (ns) de un CSV, para validar su caché"""
+    stat = os.stat(csv_path)
+    return np.array([os.path.abspath(csv_path), str(stat.st_size), str(stat.st_mtime_ns)])
+
+
+class AnnotationIndex:
+    """
+    Tabla de anotaciones o candidatos agrupada por seriesuid
+
+    Las filas se ordenan por seriesuid y se guardan como arrays numpy
+    contiguos; cada escaneo ocupa el rango [start, stop) de esos arrays.
+    Obtener las filas de un escaneo es un lookup en diccionario + slicing
+    (vistas, sin copia), en lugar de un filtrado booleano O(N) del DataFrame.
+
+    Columnas:
+    - world (N, 3): coordenadas mundo en mm, orden (z, y, x)
+    - row (N,): posición de la fila en el CSV original
+    - el resto de columnas numéricas del CSV (diameter_mm, class, ...)
+
+    Usage:
+        candidates = AnnotationIndex.from_csv('LUNA16/candidates.csv',
+                                              cache_path='LUNA16/candidates.npz')
+        rows = candidates.get(seriesuid)
+        voxels = candidates.to_voxel(seriesuid, origin, spacing)
+    """
+
+    def __init__(self, seriesuids, offsets, columns):
+        """
+        Args:
+            seriesuids (np.ndarray): seriesuids únicos en orden
+            offsets (np.ndarray): Límites de cada grupo, len(seriesuids) + 1
+            columns (dict): {nombre: np.ndarray} ordenados por seriesuid
+        """
+        self.seriesuids = seriesuids
+        self.offsets = offsets
+        self.columns = columns
+        self._ranges = {
+            uid: (int(offsets[i]), int(offsets[i + 1]))
+            for i, uid in enumerate(seriesuids.tolist())
+        }
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Construye el índice desde un DataFrame con formato LUNA16
+
+        Args:
+            df (pd.DataFrame): Con columnas seriesuid, coordX, coordY, coordZ, ...
+
+        Returns:
+            AnnotationIndex
+        """
+        uids = df['seriesuid'].to_numpy(dtype=str)
+        order = np.argsort(uids, kind='stable')
+        sorted_uids = uids[order]
+
+        unique_uids, starts = np.unique(sorted_uids, return_index=True)
+        offsets = np.append(starts, len(sorted_uids)).astype(np.int64)
+
+        world = df[['coordZ', 'coordY', 'coordX']].to_numpy(dtype=np.float64)
+        columns = {
+            'world': np.ascontiguousarray(world[order]),
+            'row': order.astype(np.int64),
+        }
+        for name in df.columns:
+            if name in ('seriesuid', 'coordX', 'coordY', 'coordZ'):
+                continue
+            columns[name] = np.ascontiguousarray(df[name].to_numpy()[order])
+
+        return cls(unique_uids, offsets, columns)
+
+    @classmethod
+    def from_csv(cls, csv_path, dtypes=None, cache_path=None):
+        """
+        Carga un CSV de LUNA16, usando una caché binaria si está disponible
+
+        Args:
+            csv_path (str): Ruta a annotations.csv o candidates.csv
+            dtypes (dict, optional): Dtypes por columna. Por defecto se elige
+                                     CANDIDATE_DTYPES si el CSV tiene 'class'
+            cache_path (str, optional): Ruta del .npz de caché. Se reutiliza solo
+                                        si se generó desde este mismo CSV (ruta
+                                        absoluta, tamaño y mtime); si no, se regenera
+
+        Returns:
+            AnnotationIndex
+        """
+        source = _source_signature(csv_path)
+        if cache_path and os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as data:
+                cached_source = data['source'] if 'source' in data.files else None
+            if cached_source is not None and np.array_equal(cached_source, source):
+                return cls.load(cache_path)
+
+        if dtypes is None:
+            header = pd.read_csv(csv_path, nrows=0).columns
+            dtypes = CANDIDATE_DTYPES if 'class' in header else ANNOTATION_DTYPES
+
+        df = pd.read_csv(csv_path, dtype=dtypes)
+        index = cls.from_dataframe(df)
+
+        if cache_path:
+            index.save(cache_path, source=source)
+        return index
+
+    def save(self, path, source=None):
+        """
+        Guarda el índice como .npz (escritura atómica)
+
+        Args:
+            path (str): Ruta del archivo .npz
+            source (np.ndarray, optional): Firma del CSV de origen (from_csv la
+                                           usa para invalidar la caché)
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        arrays = {f'col_{name}': col for name, col in self.columns.items()}
+        if source is not None:
+            arrays['source'] = source
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, seriesuids=self.seriesuids, offsets=self.offsets, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Carga un índice guardado con save()
+
+        Args:
+            path (str): Ruta del archivo .npz
+
+        Returns:
+            AnnotationIndex
+        """
+        with np.load(path, allow_pickle=False) as data:
+            columns = {key[len('col_'):]: data[key] for key in data.files if key.startswith('col_')}
+            return cls(data['seriesuids'], data['offsets'], columns)
+
+    def __len__(self):
+        return len(self.columns['row'])
+
+    def __contains__(self, seriesuid):
+        return seriesuid in self._ranges
+
+    def slice_for(self, seriesuid):
+        """
+        Rango de filas de un escaneo
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+
+        Returns:
+            slice: Rango [start, stop) (vacío si el escaneo no tiene filas)
+        """
+        start, stop = self._ranges.get(seriesuid, (0, 0))
+        return slice(start, stop)
+
+    def get(self, seriesuid):
+        """
+        Todas las filas de un escaneo en O(1)
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+
+        Returns:
+            dict: {columna: np.ndarray} con vistas sobre los arrays del índice
+        """
+        rows = self.slice_for(seriesuid)
+        return {name: col[rows] for name, col in self.columns.items()}
+
+    def world_coords(self, seriesuid):
+        """
+        Args:
+            seriesuid (str): Identificador del escaneo
+
+        Returns:
+            np.ndarray: Coordenadas mundo (N, 3) en mm, orden (z, y, x)
+        """
+        return self.columns['world'][self.slice_for(seriesuid)]
+
+    def to_voxel(self, seriesuid, origin, spacing, round_coords=True, direction=None):
+        """
+        Convierte todas las coordenadas de un escaneo a voxel en una operación
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            origin (array-like): Origen del volumen en mm (z, y, x)
+            spacing (array-like): Espaciado de voxels en mm (z, y, x)
+            round_coords (bool): Si True, redondea a índices enteros
+            direction (array-like, optional): Matriz de dirección 3x3 (z, y, x)
+
+        Returns:
+            np.ndarray: Coordenadas voxel (N, 3) en orden (z, y, x)
+        """
+        transform = VoxelTransform(origin, spacing, direction)
+        return transform.world_to_voxel(self.world_coords(seriesuid), round_coords=round_coords)
+
+    def to_dataframe(self, seriesuid=None):
+        """
+        Reconstruye un DataFrame con formato LUNA16
+
+        Args:
+            seriesuid (str, optional): Si se indica, solo las filas de ese escaneo
+
+        Returns:
+            pd.DataFrame: Columnas seriesuid, coordX, coordY, coordZ, ...
+        """
+        if seriesuid is None:
+            rows = slice(None)
+            uids = np.repeat(self.seriesuids, np.diff(self.offsets))
+        else:
+            rows = self.slice_for(seriesuid)
+            uids = np.full(rows.stop - rows.start, seriesuid)
+
+        world = self.columns['world'][rows]
+        data = {
+            'seriesuid': uids,
+            'coordX': world[:, 2],
+            'coordY': world[:, 1],
+            'coordZ': world[:, 0],
+        }
+        for name, col in self.columns.items():
+            if name not in ('world', 'row'):
+                data[name] = col[rows]
+
+        return pd.DataFrame(data, index=self.columns['row'][rows])
@@ -0,0 +1,221 @@
+"""
+Módulo de caché persistente en disco para volúmenes CT
+
+Este módulo proporciona:
+- Almacenamiento de arrays (HU, normalizados, máscaras) en formato .npy
+- Claves por seriesuid + tipo de transformación + parámetros
+- Presupuesto de bytes en disco con desalojo LRU
+- Escrituras atómicas (seguras con varios procesos compartiendo la caché)
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+
+class VolumeCache:
+    """
+    Caché en disco de volúmenes procesados, indexada por seriesuid
+
+    Cada entrada es un archivo .npy en <cache_dir>/<seriesuid>/<kind>-<hash>.npy,
+    donde hash identifica los parámetros de la transformación (ej: ventana HU).
+    Los aciertos se leen con np.load(mmap_mode='r'), sin decodificar nada.
+
+    Política de desalojo:
+    - Cada lectura actualiza el mtime del archivo (reloj LRU)
+    - Tras cada escritura, si el total supera max_bytes, se eliminan
+      las entradas con mtime más antiguo
+
+    Attributes:
+        cache_dir (str): Directorio raíz de la caché
+        max_bytes (int): Presupuesto máximo en disco (None = sin límite)
+    """
+
+    EXTENSION = '.npy'
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024**3):
+        """
+        Inicializa la caché
+
+        Args:
+            cache_dir (str): Directorio raíz (se crea si no existe)
+            max_bytes (int, optional): Presupuesto en bytes (default: 50 GB)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def params_hash(params=None):
+        """
+        Calcula un hash estable para los parámetros de una transformación
+
+        Args:
+            params (dict, optional): Parámetros serializables a JSON
+
+        Returns:
+            str: 12 caracteres hexadecimales
+        """
+        payload = json.dumps(params or {}, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+    def path_for(self, seriesuid, kind, params=None):
+        """
+        Ruta del archivo de caché para (seriesuid, kind, params)
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            kind (str): Tipo de dato (ej: 'hu', 'normalized', 'lung_mask')
+            params (dict, optional): Parámetros de la transformación
+
+        Returns:
+            str: Ruta al archivo .npy
+        """
+        filename = f"{kind}-{self.params_hash(params)}{self.EXTENSION}"
+        return os.path.join(self.cache_dir, seriesuid, filename)
+
+    def get(self, seriesuid, kind, params=None, mmap_mode='r'):
+        """
+        Obtiene un array de la caché
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            kind (str): Tipo de dato
+            params (dict, optional): Parámetros de la transformación
+            mmap_mode (str, optional): Modo de np.load (default: 'r', sin copia)
+
+        Returns:
+            np.ndarray: Array cacheado, o None si no existe
+        """
+        path = self.path_for(seriesuid, kind, params)
+        try:
+            array = np.load(path, mmap_mode=mmap_mode)
+        except (FileNotFoundError, ValueError, OSError):
+            # Ausente, o eliminado por otro proceso entre medias
+            return None
+
+        try:
+            os.utime(path)  # Marca de uso para LRU
+        except OSError:
+            pass
+
+        return array
+
+    def put(self, seriesuid, kind, array, params=None):
+        """
+        Guarda un array en la caché con escritura atómica
+
+        Escribe primero a un archivo temporal en el mismo directorio y luego
+        lo renombra con os.replace, de modo que otros procesos nunca ven
+        un archivo a medio escribir.
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            kind (str): Tipo de dato
+            array (np.ndarray): Array a guardar
+            params (dict, optional): Parámetros de la transformación
+
+        Returns:
+            str: Ruta del archivo escrito
+        """
+        path = self.path_for(seriesuid, kind, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+        return path
+
+    def get_or_compute(self, seriesuid, kind, compute, params=None):
+        """
+        Devuelve el array cacheado o lo calcula, guarda y devuelve
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            kind (str): Tipo de dato
+            compute (callable): Función sin argumentos que genera el array
+            params (dict, optional): Parámetros de la transformación
+
+        Returns:
+            np.ndarray: Array (memmap de solo lectura si viene de la caché)
+        """
+        cached = self.get(seriesuid, kind, params)
+        if cached is not None:
+            return cached
+
+        array = compute()
+        self.put(seriesuid, kind, array, params)
+        return array
+
+    def _entries(self):
+        """Lista (mtime, size, path) de todas las entradas de la caché"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.EXTENSION):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size_bytes(self):
+        """
+        Returns:
+            int: Bytes ocupados actualmente por la caché
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Elimina las entradas menos usadas hasta respetar max_bytes
+
+        Returns:
+            int: Número de entradas eliminadas
+        """
+        if self.max_bytes is None:
+            return 0
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Ya eliminado por otro proceso, o en uso (Windows)
+                continue
+            total -= size
+            removed += 1
+
+        return removed
+
+    def clear(self, seriesuid=None):
+        """
+        Vacía la caché completa o solo las entradas de un escaneo
+
+        Args:
+            seriesuid (str, optional): Si se indica, solo borra ese escaneo
+        """
+        for _, _, path in self._entries():
+            if seriesuid is None or os.path.basename(os.path.dirname(path)) == seriesuid:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
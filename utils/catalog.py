@@ -0,0 +1,289 @@
+"""
+Catálogo de escaneos LUNA16 construido solo a partir de cabeceras .mhd
+
+Este módulo proporciona:
+- Lectura en paralelo de las cabeceras de todos los subsets (sin decodificar voxels)
+- Un índice columnar (.npz) con seriesuid, subset, shape, spacing, origin,
+  direction, dtype y tamaño del .raw de cada escaneo
+- Filtros rápidos en memoria (ej: escaneos con slice thickness <= 1.25 mm)
+"""
+
+import os
+import re
+import glob
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from .data_loader import read_mhd_header
+
+
+class LUNA16Catalog:
+    """
+    Índice columnar de los escaneos LUNA16 disponibles en disco
+
+    Cada columna es un array numpy con una fila por escaneo:
+    - seriesuid (str), subset (int, -1 si no está en una carpeta subsetN)
+    - path (str): ruta al .mhd relativa a la raíz del dataset
+    - shape (N, 3), spacing (N, 3), origin (N, 3): en orden (z, y, x)
+    - direction (N, 3, 3), dtype (str), raw_bytes (int)
+
+    Usage:
+        catalog = LUNA16Catalog.load_or_build('LUNA16', 'LUNA16/catalog.npz')
+        finos = catalog.filter(max_slice_thickness=1.25)
+        print(len(finos), finos.seriesuids[:5])
+
+    Attributes:
+        root (str): Directorio raíz del dataset LUNA16
+        columns (dict): Diccionario {nombre_columna: np.ndarray}
+    """
+
+    COLUMNS = ['seriesuid', 'subset', 'path', 'shape', 'spacing', 'origin',
+               'direction', 'dtype', 'raw_bytes']
+
+    def __init__(self, root, columns):
+        """
+        Args:
+            root (str): Directorio raíz del dataset LUNA16
+            columns (dict): Columnas del catálogo (ver COLUMNS)
+        """
+        self.root = root
+        self.columns = columns
+        self._row_by_uid = {uid: i for i, uid in enumerate(columns['seriesuid'])}
+
+    @staticmethod
+    def _read_entry(root, mhd_path):
+        """Lee la cabecera de un .mhd y devuelve la fila del catálogo"""
+        header = read_mhd_header(mhd_path)
+        match = re.search(r'subset(\d+)', os.path.basename(os.path.dirname(mhd_path)))
+        return {
+            'seriesuid': os.path.splitext(os.path.basename(mhd_path))[0],
+            'subset': int(match.group(1)) if match else -1,
+            'path': os.path.relpath(mhd_path, root),
+            'shape': header['shape'],
+            'spacing': header['spacing'],
+            'origin': header['origin'],
+            'direction': header['direction'],
+            'dtype': header['dtype'].str,
+            'raw_bytes': os.path.getsize(header['data_file']),
+        }
+
+    @classmethod
+    def _try_read_entry(cls, root, mhd_path, skip_errors):
+        """_read_entry que, con skip_errors, informa del error y devuelve None"""
+        try:
+            return cls._read_entry(root, mhd_path)
+        except Exception as e:
+            if not skip_errors:
+                raise
+            print(f"[ERROR] {os.path.relpath(mhd_path, root)}: {e}")
+            return None
+
+    @classmethod
+    def build(cls, root, workers=8, output_path=None, skip_errors=True):
+        """
+        Construye el catálogo leyendo en paralelo las cabeceras .mhd
+
+        Args:
+            root (str): Raíz LUNA16 (con carpetas subset*/) o un subset concreto
+            workers (int): Número de hilos de lectura (default: 8)
+            output_path (str, optional): Si se indica, guarda el catálogo en .npz
+            skip_errors (bool): Si True, informa y salta las cabeceras ilegibles o
+                                truncadas en lugar de abortar (default: True)
+
+        Returns:
+            LUNA16Catalog: Catálogo con una fila por escaneo leído
+        """
+        mhd_files = sorted(glob.glob(os.path.join(root, '*.mhd')))
+        mhd_files += sorted(glob.glob(os.path.join(root, 'subset*', '*.mhd')))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(lambda path: cls._try_read_entry(root, path, skip_errors), mhd_files))
+        rows = [r for r in rows if r is not None]
+
+        columns = {
+            'seriesuid': np.array([r['seriesuid'] for r in rows], dtype=str),
+            'subset': np.array([r['subset'] for r in rows], dtype=np.int16),
+            'path': np.array([r['path'] for r in rows], dtype=str),
+            'shape': np.array([r['shape'] for r in rows], dtype=np.int32).reshape(-1, 3),
+            'spacing': np.array([r['spacing'] for r in rows], dtype=np.float64).reshape(-1, 3),
+            'origin': np.array([r['origin'] for r in rows], dtype=np.float64).reshape(-1, 3),
+            'direction': np.array([r['direction'] for r in rows], dtype=np.float64).reshape(-1, 3, 3),
+            'dtype': np.array([r['dtype'] for r in rows], dtype=str),
+            'raw_bytes': np.array([r['raw_bytes'] for r in rows], dtype=np.int64),
+        }
+
+        catalog = cls(root, columns)
+        if output_path:
+            catalog.save(output_path)
+        return catalog
+
+    def save(self, path):
+        """
+        Guarda el catálogo como .npz sin comprimir (escritura atómica)
+
+        Args:
+            path (str): Ruta del archivo .npz
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, root=np.array(self.root), **self.columns)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, root=None):
+        """
+        Carga un catálogo guardado con save()
+
+        Args:
+            path (str): Ruta al archivo .npz
+            root (str, optional): Raíz del dataset (por defecto, la guardada)
+
+        Returns:
+            LUNA16Catalog
+        """
+        with np.load(path, allow_pickle=False) as data:
+            columns = {name: data[name] for name in cls.COLUMNS}
+            saved_root = str(data['root'])
+        return cls(root or saved_root, columns)
+
+    @classmethod
+    def load_or_build(cls, root, catalog_path, workers=8, refresh=False, skip_errors=True):
+        """
+        Carga el catálogo si existe; si no (o refresh=True), lo construye y guarda
+
+        Args:
+            root (str): Raíz del dataset LUNA16
+            catalog_path (str): Ruta del .npz
+            workers (int): Hilos para construir el catálogo
+            refresh (bool): Fuerza la reconstrucción (ej: tras descargar subsets)
+            skip_errors (bool): Ver build()
+
+        Returns:
+            LUNA16Catalog
+        """
+        if not refresh and os.path.exists(catalog_path):
+            return cls.load(catalog_path, root=root)
+        return cls.build(root, workers=workers, output_path=catalog_path, skip_errors=skip_errors)
+
+    def __len__(self):
+        return len(self.columns['seriesuid'])
+
+    def __contains__(self, seriesuid):
+        return seriesuid in self._row_by_uid
+
+    @property
+    def seriesuids(self):
+        """
+        Returns:
+            list: seriesuids del catálogo
+        """
+        return self.columns['seriesuid'].tolist()
+
+    def take(self, rows):
+        """
+        Sub-catálogo con las filas indicadas
+
+        Args:
+            rows (np.ndarray): Índices enteros o máscara booleana
+
+        Returns:
+            LUNA16Catalog
+        """
+        return LUNA16Catalog(self.root, {name: col[rows] for name, col in self.columns.items()})
+
+    def filter(self, subsets=None, seriesuids=None, max_slice_thickness=None,
+               min_slice_thickness=None, min_slices=None, max_slices=None):
+        """
+        Filtra el catálogo con condiciones vectorizadas
+
+        Args:
+            subsets (int | list, optional): Subset(s) a incluir
+            seriesuids (list, optional): Restringe a estos seriesuids
+            max_slice_thickness (float, optional): Spacing z máximo en mm
+            min_slice_thickness (float, optional): Spacing z mínimo en mm
+            min_slices (int, optional): Número mínimo de slices
+            max_slices (int, optional): Número máximo de slices
+
+        Returns:
+            LUNA16Catalog: Catálogo filtrado
+
+        Ejemplo:
+            >>> catalog.filter(subsets=[0, 1], max_slice_thickness=1.25)
+        """
+        keep = np.ones(len(self), dtype=bool)
+        spacing_z = self.columns['spacing'][:, 0]
+        n_slices = self.columns['shape'][:, 0]
+
+        if subsets is not None:
+            keep &= np.isin(self.columns['subset'], np.atleast_1d(subsets))
+        if seriesuids is not None:
+            keep &= np.isin(self.columns['seriesuid'], list(seriesuids))
+        if max_slice_thickness is not None:
+            keep &= spacing_z <= max_slice_thickness
+        if min_slice_thickness is not None:
+            keep &= spacing_z >= min_slice_thickness
+        if min_slices is not None:
+            keep &= n_slices >= min_slices
+        if max_slices is not None:
+            keep &= n_slices <= max_slices
+
+        return self.take(keep)
+
+    def get(self, seriesuid):
+        """
+        Fila del catálogo para un escaneo
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+
+        Returns:
+            dict: {columna: valor}, o None si no está en el catálogo
+        """
+        row = self._row_by_uid.get(seriesuid)
+        if row is None:
+            return None
+        return {name: col[row] for name, col in self.columns.items()}
+
+    def get_path(self, seriesuid):
+        """
+        Ruta absoluta al .mhd de un escaneo
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+
+        Returns:
+            str: Ruta al .mhd, o None si no está en el catálogo
+        """
+        row = self._row_by_uid.get(seriesuid)
+        if row is None:
+            return None
+        return os.path.join(self.root, self.columns['path'][row])
+
+    def to_dataframe(self):
+        """
+        Convierte el catálogo a DataFrame (columnas vectoriales expandidas)
+
+        Returns:
+            pd.DataFrame: Una fila por escaneo
+        """
+        df = pd.DataFrame({
+            'seriesuid': self.columns['seriesuid'],
+            'subset': self.columns['subset'],
+            'path': self.columns['path'],
+            'dtype': self.columns['dtype'],
+            'raw_bytes': self.columns['raw_bytes'],
+        })
+        for name in ['shape', 'spacing', 'origin']:
+            for axis, label in enumerate('zyx'):
+                df[f'{name}_{label}'] = self.columns[name][:, axis]
+        return df
@@ -0,0 +1,138 @@
+"""
+Transformaciones vectorizadas entre coordenadas mundo (mm) y voxel
+
+Este módulo proporciona:
+- VoxelTransform: se construye una vez por escaneo (origin, spacing, direction)
+- Conversión de lotes de puntos (N, 3) en ambos sentidos
+- Comprobación de límites vectorizada
+
+Convención: todos los vectores en orden (z, y, x), igual que LUNA16DataLoader.
+"""
+
+import numpy as np
+
+
+class VoxelTransform:
+    """
+    Transformación afín voxel <-> mundo de un volumen CT
+
+    Formula:
+        world = origin + D · (spacing * voxel)
+        voxel = (D⁻¹ · (world - origin)) / spacing
+
+    donde D es la matriz de dirección (identidad en casi todo LUNA16).
+    Con dirección identidad se evita el producto matricial.
+
+    Usage:
+        transform = VoxelTransform.from_header(read_mhd_header(path))
+        voxels = transform.world_to_voxel(candidates_world)      # (N, 3) int
+        valid = transform.in_bounds(voxels)                       # (N,) bool
+
+    Attributes:
+        origin (np.ndarray): Origen en mm (z, y, x)
+        spacing (np.ndarray): Espaciado en mm (z, y, x)
+        direction (np.ndarray): Matriz de dirección 3x3 en orden (z, y, x)
+        shape (tuple): Dimensiones del volumen (opcional, para in_bounds)
+    """
+
+    def __init__(self, origin, spacing, direction=None, shape=None):
+        """
+        Args:
+            origin (array-like): Origen del volumen en mm (z, y, x)
+            spacing (array-like): Espaciado de voxels en mm (z, y, x)
+            direction (array-like, optional): Matriz 3x3 (z, y, x); None = identidad
+            shape (tuple, optional): Dimensiones del volumen (slices, height, width)
+        """
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+        self.direction = np.eye(3) if direction is None else np.asarray(direction, dtype=np.float64).reshape(3, 3)
+        self.shape = tuple(shape) if shape is not None else None
+
+        self._identity = np.allclose(self.direction, np.eye(3))
+        self._inverse = None if self._identity else np.linalg.inv(self.direction)
+
+    @classmethod
+    def from_header(cls, header):
+        """
+        Construye la transformación desde la salida de read_mhd_header
+
+        Args:
+            header (dict): Cabecera con origin, spacing, direction y shape
+
+        Returns:
+            VoxelTransform
+        """
+        return cls(header['origin'], header['spacing'], header['direction'], header['shape'])
+
+    def world_to_voxel(self, world_coords, round_coords=True):
+        """
+        Convierte coordenadas mundo (mm) a voxel
+
+        Args:
+            world_coords (array-like): Punto (3,) o lote (N, 3) en mm (z, y, x)
+            round_coords (bool): Si True, redondea a índices enteros
+
+        Returns:
+            np.ndarray: Coordenadas voxel con la misma forma que la entrada
+        """
+        offset = np.asarray(world_coords, dtype=np.float64) - self.origin
+        if not self._identity:
+            offset = offset @ self._inverse.T
+        voxel = offset / self.spacing
+
+        if round_coords:
+            return np.rint(voxel).astype(int)
+        return voxel
+
+    def voxel_to_world(self, voxel_coords):
+        """
+        Convierte coordenadas voxel a mundo (mm)
+
+        Args:
+            voxel_coords (array-like): Punto (3,) o lote (N, 3) en orden (z, y, x)
+
+        Returns:
+            np.ndarray: Coordenadas en mm con la misma forma que la entrada
+        """
+        scaled = np.asarray(voxel_coords, dtype=np.float64) * self.spacing
+        if not self._identity:
+            scaled = scaled @ self.direction.T
+        return scaled + self.origin
+
+    def z_to_index(self, z_mm, round_coords=True):
+        """
+        Convierte posiciones z (mm) a índices de slice
+
+        Útil para contornos LIDC, que solo aportan image_z_position.
+        Asume que el eje z del volumen está alineado con el eje z mundo
+        (cierto en LUNA16, donde D es diagonal).
+
+        Args:
+            z_mm (array-like): Posiciones z en mm, escalar o (N,)
+            round_coords (bool): Si True, redondea a índices enteros
+
+        Returns:
+            np.ndarray: Índices z
+        """
+        index = (np.asarray(z_mm, dtype=np.float64) - self.origin[0]) / (self.spacing[0] * self.direction[0, 0])
+        if round_coords:
+            return np.rint(index).astype(int)
+        return index
+
+    def in_bounds(self, voxel_coords, shape=None):
+        """
+        Comprueba qué voxels caen dentro del volumen
+
+        Args:
+            voxel_coords (array-like): Lote (N, 3) de coordenadas voxel
+            shape (tuple, optional): Dimensiones del volumen (default: self.shape)
+
+        Returns:
+            np.ndarray: Máscara booleana (N,)
+        """
+        shape = self.shape if shape is None else shape
+        if shape is None:
+            raise ValueError("Se requiere shape para comprobar límites")
+
+        voxels = np.rint(np.atleast_2d(voxel_coords))
+        return np.all((voxels >= 0) & (voxels < np.asarray(shape)), axis=-1)
@@ -0,0 +1,211 @@
+"""
+Recorte del volumen CT a la bounding box pulmonar
+
+Este módulo proporciona:
+- lung_bbox: bounding box 3D de la máscara pulmonar con margen en mm
+- LungCrop: aplica el recorte a volúmenes y máscaras y traduce coordenadas
+  voxel/mundo entre el volumen original y el recortado
+
+Entre el 40 y el 60% de cada volumen es aire, camilla y pared torácica;
+recortar una vez por escaneo reduce el trabajo de todas las etapas
+posteriores (normalización, denoising, exportación, patches).
+"""
+
+import numpy as np
+
+from .coordinates import VoxelTransform
+
+
+def lung_bbox(mask, spacing=None, margin_mm=10.0, margin_voxels=None):
+    """
+    Bounding box 3D de una máscara con margen
+
+    Args:
+        mask (np.ndarray): Máscara 3D (slices, height, width)
+        spacing (array-like, optional): Spacing (z, y, x) en mm, necesario para margin_mm
+        margin_mm (float): Margen en mm por cada lado (default: 10 mm)
+        margin_voxels (int | tuple, optional): Margen en voxels (prevalece sobre margin_mm)
+
+    Returns:
+        np.ndarray: Bounding box (3, 2) [start, stop) en (z, y, x), recortada
+                    al volumen. Si la máscara está vacía, el volumen completo
+    """
+    shape = np.asarray(mask.shape)
+    if margin_voxels is not None:
+        margin = np.broadcast_to(np.asarray(margin_voxels, dtype=int), (3,))
+    elif spacing is not None:
+        margin = np.ceil(margin_mm / np.asarray(spacing, dtype=np.float64)).astype(int)
+    else:
+        raise ValueError("Se requiere spacing (para margin_mm) o margin_voxels")
+
+    bbox = np.zeros((3, 2), dtype=np.int64)
+    bbox[:, 1] = shape
+
+    # Proyecciones por eje: un recorrido de la máscara por eje, sin np.where 3D
+    for axis in range(3):
+        other = tuple(a for a in range(3) if a != axis)
+        present = np.flatnonzero(np.any(mask, axis=other))
+        if len(present) == 0:
+            return bbox
+        bbox[axis] = present[0], present[-1] + 1
+
+    bbox[:, 0] = np.maximum(bbox[:, 0] - margin, 0)
+    bbox[:, 1] = np.minimum(bbox[:, 1] + margin, shape)
+    return bbox
+
+
+class LungCrop:
+    """
+    Recorte de un escaneo a su bounding box pulmonar
+
+    Guarda el desplazamiento (offset) del recorte para que cualquier
+    coordenada calculada sobre el volumen recortado se pueda llevar de
+    vuelta al volumen original, en voxel o en mundo.
+
+    Usage:
+        crop = loader.get_lung_crop(seriesuid)
+        ct_crop = crop.apply(ct_scan)
+        nodule_mask_crop = crop.apply(nodule_mask)
+        voxels_originales = crop.to_original(voxels_en_crop)
+        transform = crop.transform            # origin del volumen recortado
+
+    Attributes:
+        bbox (np.ndarray): (3, 2) [start, stop) en el volumen original (z, y, x)
+        original_shape (tuple): Dimensiones del volumen original
+        origin (np.ndarray): Origen del volumen original en mm (z, y, x)
+        spacing (np.ndarray): Spacing en mm (z, y, x)
+        direction (np.ndarray): Matriz de dirección 3x3 (z, y, x)
+    """
+
+    def __init__(self, bbox, original_shape, origin, spacing, direction=None):
+        """
+        Args:
+            bbox (array-like): (3, 2) [start, stop) en voxels (z, y, x)
+            original_shape (tuple): Dimensiones del volumen original
+            origin (array-like): Origen del volumen original en mm (z, y, x)
+            spacing (array-like): Spacing en mm (z, y, x)
+            direction (array-like, optional): Matriz de dirección 3x3 (z, y, x)
+        """
+        self.bbox = np.asarray(bbox, dtype=np.int64).reshape(3, 2)
+        self.original_shape = tuple(int(n) for n in original_shape)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+        self.direction = np.eye(3) if direction is None else np.asarray(direction, dtype=np.float64)
+
+    @classmethod
+    def from_mask(cls, mask, origin, spacing, direction=None, margin_mm=10.0):
+        """
+        Calcula el recorte desde una máscara pulmonar
+
+        Args:
+            mask (np.ndarray): Máscara pulmonar 3D (ej: load_lung_mask)
+            origin (array-like): Origen del volumen en mm (z, y, x)
+            spacing (array-like): Spacing en mm (z, y, x)
+            direction (array-like, optional): Matriz de dirección 3x3
+            margin_mm (float): Margen alrededor de los pulmones (default: 10 mm)
+
+        Returns:
+            LungCrop
+        """
+        bbox = lung_bbox(mask, spacing=spacing, margin_mm=margin_mm)
+        return cls(bbox, mask.shape, origin, spacing, direction)
+
+    @property
+    def offset(self):
+        """np.ndarray: Voxel del volumen original donde empieza el recorte (z, y, x)"""
+        return self.bbox[:, 0].copy()
+
+    @property
+    def shape(self):
+        """tuple: Dimensiones del volumen recortado"""
+        return tuple(int(n) for n in self.bbox[:, 1] - self.bbox[:, 0])
+
+    @property
+    def slices(self):
+        """tuple: Slices (z, y, x) para indexar el volumen original"""
+        return tuple(slice(int(start), int(stop)) for start, stop in self.bbox)
+
+    @property
+    def cropped_origin(self):
+        """np.ndarray: Origen en mm (z, y, x) del volumen recortado"""
+        return VoxelTransform(self.origin, self.spacing, self.direction).voxel_to_world(self.offset)
+
+    @property
+    def transform(self):
+        """VoxelTransform: Transformación voxel <-> mundo del volumen recortado"""
+        return VoxelTransform(self.cropped_origin, self.spacing, self.direction, self.shape)
+
+    def fraction(self):
+        """
+        Returns:
+            float: Fracción de voxels del volumen original que conserva el recorte
+        """
+        return float(np.prod(self.shape)) / float(np.prod(self.original_shape))
+
+    def apply(self, volume):
+        """
+        Recorta un volumen o máscara alineado con el escaneo original
+
+        Args:
+            volume (np.ndarray): Array (slices, height, width) o con canales
+                                 delante (C, slices, height, width)
+
+        Returns:
+            np.ndarray: Vista recortada (sin copia para np.ndarray / np.memmap)
+        """
+        if tuple(volume.shape[-3:]) != self.original_shape:
+            raise ValueError(f"volume debe terminar en {self.original_shape}, recibido {volume.shape}")
+        return volume[(Ellipsis,) + self.slices]
+
+    def restore(self, cropped, fill_value=0, out=None):
+        """
+        Devuelve un resultado calculado sobre el recorte al tamaño original
+
+        Args:
+            cropped (np.ndarray): Array con shape (..., *self.shape)
+            fill_value: Valor fuera del recorte (default: 0)
+            out (np.ndarray, optional): Buffer (..., *original_shape)
+
+        Returns:
+            np.ndarray: Array con las dimensiones del volumen original
+        """
+        shape = tuple(cropped.shape[:-3]) + self.original_shape
+        if out is None:
+            out = np.full(shape, fill_value, dtype=cropped.dtype)
+        elif out.shape != shape:
+            raise ValueError(f"out debe tener shape {shape}, recibido {out.shape}")
+        else:
+            out[...] = fill_value
+        out[(Ellipsis,) + self.slices] = cropped
+        return out
+
+    def to_original(self, voxel_coords):
+        """
+        Coordenadas voxel del recorte -> voxel del volumen original
+
+        Args:
+            voxel_coords (array-like): Punto (3,) o lote (N, 3) en (z, y, x)
+
+        Returns:
+            np.ndarray: Coordenadas en el volumen original
+        """
+        return np.asarray(voxel_coords) + self.offset
+
+    def from_original(self, voxel_coords):
+        """
+        Coordenadas voxel del volumen original -> voxel del recorte
+
+        Args:
+            voxel_coords (array-like): Punto (3,) o lote (N, 3) en (z, y, x)
+
+        Returns:
+            np.ndarray: Coordenadas en el recorte (pueden caer fuera de él)
+        """
+        return np.asarray(voxel_coords) - self.offset
+
+    def to_array(self):
+        """
+        Returns:
+            np.ndarray: bbox (3, 2) int64, formato de la caché de LUNA16DataLoader
+        """
+        return self.bbox.copy()
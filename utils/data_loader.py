@@ -2,17 +2,137 @@
 Módulo de carga de datos para el dataset LUNA16
 
 Este módulo proporciona herramientas para:
-- Cargar imágenes CT en formato .mhd/.raw
+- Cargar imágenes CT en formato .mhd/.raw (completo o lazy vía np.memmap)
+  o desde el espejo HDF5 comprimido (utils.hdf5_store)
 - Convertir entre coordenadas mundo (mm) y voxel (píxeles)
-- Normalizar valores Hounsfield Units (HU)
+- Normalizar valores Hounsfield Units (HU), con una o varias ventanas
 - Gestionar anotaciones de nódulos
+- Cachear en disco volúmenes decodificados/preprocesados por seriesuid
 """
 
 import os
+import glob
+from contextlib import contextmanager
 import numpy as np
 import pandas as pd
 import SimpleITK as sitk
 
+from .annotations import AnnotationIndex, ANNOTATION_DTYPES
+from .cache import VolumeCache
+from .coordinates import VoxelTransform
+from .cropping import LungCrop, lung_bbox
+from .hdf5_store import close_hdf5_volume, load_hdf5_image, read_hdf5_header
+from .normalization import normalize_hu, normalize_hu_windows
+from .patches import extract_patches
+from .prefetch import ScanPrefetcher
+from .resampling import resample_volume
+from .preprocessor import LungPreprocessor
+
+
+# Mapeo de ElementType (MetaImage) a dtypes numpy
+METAIMAGE_DTYPES = {
+    'MET_CHAR': np.int8,
+    'MET_UCHAR': np.uint8,
+    'MET_SHORT': np.int16,
+    'MET_USHORT': np.uint16,
+    'MET_INT': np.int32,
+    'MET_UINT': np.uint32,
+    'MET_LONG': np.int64,
+    'MET_ULONG': np.uint64,
+    'MET_LONG_LONG': np.int64,
+    'MET_ULONG_LONG': np.uint64,
+    'MET_FLOAT': np.float32,
+    'MET_DOUBLE': np.float64,
+}
+
+
+def read_mhd_header(filename):
+    """
+    Lee la cabecera de un archivo MetaImage (.mhd) sin decodificar los voxels
+
+    Args:
+        filename (str): Ruta al archivo .mhd
+
+    Returns:
+        dict: Metadatos de la imagen, todos en orden (z, y, x):
+            - shape (tuple): Dimensiones (slices, height, width)
+            - spacing (np.ndarray): Espaciado entre voxels en mm
+            - origin (np.ndarray): Coordenadas de origen en mm
+            - direction (np.ndarray): Matriz de dirección 3x3
+            - dtype (np.dtype): Tipo de dato con el byte order del archivo
+            - data_file (str): Ruta absoluta al archivo de datos (.raw)
+            - data_offset (int): Byte donde empiezan los voxels en data_file
+            - compressed (bool): True si los datos están comprimidos (zlib)
+
+    Notes:
+        - MetaImage guarda DimSize/ElementSpacing/Offset en orden (X, Y, Z)
+          y TransformMatrix en column-major; aquí todo se invierte a (Z, Y, X)
+        - ElementDataFile = LOCAL indica datos embebidos tras la cabecera
+    """
+    fields = {}
+    header_bytes = 0
+    with open(filename, 'rb') as f:
+        for raw_line in f:
+            header_bytes += len(raw_line)
+            line = raw_line.decode('latin-1').strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            fields[key.strip()] = value.strip()
+            # ElementDataFile siempre es el último campo de la cabecera
+            if key.strip() == 'ElementDataFile':
+                break
+
+    ndims = int(fields.get('NDims', 3))
+    if ndims != 3:
+        raise ValueError(f"Solo se soportan volúmenes 3D (NDims={ndims}): {filename}")
+
+    element_type = fields.get('ElementType')
+    if element_type not in METAIMAGE_DTYPES:
+        raise ValueError(f"ElementType no soportado: {element_type}")
+    if int(fields.get('ElementNumberOfChannels', 1)) != 1:
+        raise ValueError(f"Solo se soportan imágenes de un canal: {filename}")
+
+    msb = fields.get('BinaryDataByteOrderMSB', fields.get('ElementByteOrderMSB', 'False'))
+    byteorder = '>' if msb.lower() == 'true' else '<'
+    dtype = np.dtype(METAIMAGE_DTYPES[element_type]).newbyteorder(byteorder)
+
+    def _floats(key, default):
+        if key not in fields:
+            return np.array(default, dtype=np.float64)
+        return np.array([float(v) for v in fields[key].split()], dtype=np.float64)
+
+    shape_xyz = [int(v) for v in fields['DimSize'].split()]
+    spacing_xyz = _floats('ElementSpacing', _floats('ElementSize', [1.0, 1.0, 1.0]))
+    origin_xyz = _floats('Offset', _floats('Origin', _floats('Position', [0.0, 0.0, 0.0])))
+    matrix = _floats('TransformMatrix', _floats('Rotation', _floats('Orientation', np.eye(3).ravel())))
+    direction_xyz = matrix.reshape(3, 3).T  # column-major -> filas = ejes mundo
+
+    data_file = fields['ElementDataFile']
+    compressed = fields.get('CompressedData', 'False').lower() == 'true'
+    nbytes = int(np.prod(shape_xyz)) * dtype.itemsize
+
+    if data_file == 'LOCAL':
+        data_file = os.path.abspath(filename)
+        data_offset = header_bytes
+    else:
+        data_file = os.path.join(os.path.dirname(os.path.abspath(filename)), data_file)
+        data_offset = int(fields.get('HeaderSize', 0))
+        if data_offset == -1:
+            # HeaderSize = -1: los datos ocupan los últimos bytes del archivo
+            data_offset = os.path.getsize(data_file) - nbytes
+
+    return {
+        'shape': tuple(reversed(shape_xyz)),
+        'spacing': spacing_xyz[::-1].copy(),
+        'origin': origin_xyz[::-1].copy(),
+        'direction': direction_xyz[::-1, ::-1].copy(),
+        'dtype': dtype,
+        'data_file': data_file,
+        'data_offset': data_offset,
+        'compressed': compressed,
+    }
+
 
 class LUNA16DataLoader:
     """
@@ -26,29 +146,73 @@ class LUNA16DataLoader:
     Attributes:
         data_path (str): Ruta al directorio con archivos .mhd/.raw
         annotations (pd.DataFrame): DataFrame con anotaciones de nódulos
+        annotation_index (AnnotationIndex): Anotaciones agrupadas por seriesuid
+        candidates (AnnotationIndex): Candidatos agrupados por seriesuid, o None
+        cache (VolumeCache): Caché en disco de volúmenes, o None si está desactivada
+        catalog (LUNA16Catalog): Índice de cabeceras para localizar escaneos, o None
+        backend (str): 'mhd' (.mhd/.raw) o 'hdf5' (espejo .h5 de utils.hdf5_store)
     """
 
-    def __init__(self, data_path, annotations_path=None):
+    BACKEND_EXTENSIONS = {'mhd': '.mhd', 'hdf5': '.h5'}
+
+    def __init__(self, data_path, annotations_path=None, cache_dir=None,
+                 cache_max_bytes=50 * 1024**3, catalog=None, candidates_path=None,
+                 backend='mhd'):
         """
         Inicializa el cargador de datos
 
         Args:
             data_path (str): Ruta al directorio con archivos .mhd/.raw
+                             (un subset, o la raíz LUNA16 con carpetas subset*/)
             annotations_path (str, optional): Ruta al archivo annotations.csv
+            cache_dir (str, optional): Directorio de caché persistente. Si se indica,
+                                       load_scan/load_normalized/load_lung_mask
+                                       reutilizan resultados entre ejecuciones
+            cache_max_bytes (int, optional): Presupuesto de disco de la caché
+                                             (default: 50 GB, desalojo LRU)
+            catalog (LUNA16Catalog, optional): Catálogo de cabeceras (utils.catalog);
+                                               evita buscar los .mhd en disco
+            candidates_path (str, optional): Ruta al archivo candidates.csv. Con caché,
+                                             el índice se guarda en binario y no se
+                                             vuelve a parsear el CSV
+            backend (str): 'mhd' (default) o 'hdf5'. Con 'hdf5', data_path apunta
+                           al directorio generado por convert_luna16_to_hdf5
         """
+        if backend not in self.BACKEND_EXTENSIONS:
+            raise ValueError(f"backend debe ser uno de {list(self.BACKEND_EXTENSIONS)}")
+
+        self.backend = backend
         self.data_path = data_path
         self.annotations = None
+        self.annotation_index = None
+        self.candidates = None
+        self.cache = VolumeCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.catalog = catalog
 
         if annotations_path and os.path.exists(annotations_path):
-            self.annotations = pd.read_csv(annotations_path)
+            self.annotations = pd.read_csv(annotations_path, dtype=ANNOTATION_DTYPES)
+            self.annotation_index = AnnotationIndex.from_dataframe(self.annotations)
             print(f"Anotaciones cargadas: {len(self.annotations)} nódulos")
 
-    def load_itk_image(self, filename):
+        if candidates_path and os.path.exists(candidates_path):
+            index_path = None
+            if self.cache is not None:
+                index_path = os.path.join(self.cache.cache_dir, 'candidates_index.npz')
+            self.candidates = AnnotationIndex.from_csv(candidates_path, cache_path=index_path)
+            print(f"Candidatos cargados: {len(self.candidates)}")
+
+    def load_itk_image(self, filename, lazy=False):
         """
-        Carga una imagen CT en formato MetaImage (.mhd)
+        Carga una imagen CT en formato MetaImage (.mhd) o HDF5 (.h5)
 
         Args:
-            filename (str): Ruta al archivo .mhd
+            filename (str): Ruta al archivo .mhd (o .h5 del espejo HDF5)
+            lazy (bool): Si True, no decodifica el volumen: devuelve un np.memmap
+                         (solo lectura) sobre el .raw. Indexar un slice o un ROI
+                         lee únicamente los bytes correspondientes del disco.
+                         Con .h5 devuelve el h5py.Dataset (lectura por chunks),
+                         que mantiene el archivo abierto: cerrarlo con
+                         close_hdf5_volume(ct_scan) al terminar
 
         Returns:
             tuple: (ct_scan, origin, spacing)
@@ -59,7 +223,15 @@ class LUNA16DataLoader:
         Notes:
             - SimpleITK usa convención (X, Y, Z), este método invierte a (Z, Y, X)
             - Los valores están en Unidades Hounsfield (HU)
+            - En modo lazy, usar np.asarray(ct_scan[a:b]) para materializar solo
+              la región necesaria (ej: ct_scan[shape[0] // 2] lee un único slice)
         """
+        if filename.endswith('.h5'):
+            return load_hdf5_image(filename, lazy=lazy)
+
+        if lazy:
+            return self._load_mhd_memmap(filename)
+
         itkimage = sitk.ReadImage(filename)
         ct_scan = sitk.GetArrayFromImage(itkimage)  # Reconfigura a Shape: [slices, height, width]
         origin = np.array(list(reversed(itkimage.GetOrigin())))
@@ -67,32 +239,395 @@ class LUNA16DataLoader:
 
         return ct_scan, origin, spacing
 
-    def world_to_voxel(self, world_coords, origin, spacing):
+    def _load_mhd_memmap(self, filename):
+        """
+        Mapea en memoria el .raw de una imagen MetaImage sin decodificarlo
+
+        Args:
+            filename (str): Ruta al archivo .mhd
+
+        Returns:
+            tuple: (ct_scan, origin, spacing) con ct_scan como np.memmap (z, y, x)
+        """
+        header = read_mhd_header(filename)
+        if header['compressed']:
+            raise ValueError(
+                f"{os.path.basename(filename)} tiene CompressedData = True; "
+                "no se puede mapear en memoria (usar lazy=False)"
+            )
+
+        ct_scan = np.memmap(header['data_file'], dtype=header['dtype'], mode='r',
+                            offset=header['data_offset'], shape=header['shape'])
+
+        return ct_scan, header['origin'], header['spacing']
+
+    def find_scan(self, seriesuid):
+        """
+        Busca el archivo de un escaneo (.mhd, o .h5 con backend='hdf5')
+
+        Args:
+            seriesuid (str): Identificador único del escaneo (UID DICOM)
+
+        Returns:
+            str: Ruta al archivo .mhd / .h5
+
+        Notes:
+            Consulta primero el catálogo (si hay); si no, busca en data_path
+            y en data_path/subset*/
+        """
+        if self.backend == 'mhd' and self.catalog is not None and seriesuid in self.catalog:
+            return self.catalog.get_path(seriesuid)
+
+        filename = f"{seriesuid}{self.BACKEND_EXTENSIONS[self.backend]}"
+        candidates = [os.path.join(self.data_path, filename)]
+        candidates += sorted(glob.glob(os.path.join(self.data_path, 'subset*', filename)))
+
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+
+        raise FileNotFoundError(f"No se encontró {filename} en {self.data_path}")
+
+    def list_scans(self):
+        """
+        Lista los seriesuids disponibles
+
+        Returns:
+            list: seriesuids del catálogo, o de los archivos en data_path y data_path/subset*/
+        """
+        if self.backend == 'mhd' and self.catalog is not None:
+            return self.catalog.seriesuids
+
+        pattern = '*' + self.BACKEND_EXTENSIONS[self.backend]
+        scan_files = sorted(glob.glob(os.path.join(self.data_path, pattern)))
+        scan_files += sorted(glob.glob(os.path.join(self.data_path, 'subset*', pattern)))
+        return [os.path.splitext(os.path.basename(f))[0] for f in scan_files]
+
+    def get_scan_header(self, seriesuid):
+        """
+        Lee solo la cabecera de un escaneo (ver read_mhd_header)
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+
+        Returns:
+            dict: shape, spacing, origin, direction, dtype, ... en orden (z, y, x)
+        """
+        return self._read_header(self.find_scan(seriesuid))
+
+    def _read_header(self, path):
+        """Cabecera de un .mhd o .h5 según la extensión"""
+        if path.endswith('.h5'):
+            return read_hdf5_header(path)
+        return read_mhd_header(path)
+
+    @contextmanager
+    def _open_volume(self, path):
+        """Abre un volumen sin decodificarlo si el formato lo permite (cierra el .h5 al salir)"""
+        lazy = not self._read_header(path)['compressed']
+        volume = self.load_itk_image(path, lazy=lazy)[0]
+        try:
+            yield volume
+        finally:
+            close_hdf5_volume(volume)
+
+    def iter_scans(self, seriesuids=None, prefetch=4, workers=2, max_bytes=2 * 1024**3,
+                   ordered=True, lazy=False, skip_errors=False):
+        """
+        Recorre escaneos leyendo los siguientes en segundo plano
+
+        Args:
+            seriesuids (list, optional): Escaneos a recorrer (default: list_scans())
+            prefetch (int): Máximo de escaneos leídos por adelantado
+            workers (int): Hilos de lectura
+            max_bytes (int): Presupuesto de memoria de la cola de lectura
+            ordered (bool): Si False, produce los escaneos según terminan de leerse
+            lazy (bool): Pasa lazy a load_scan (con backend='hdf5', cerrar cada
+                         ct_scan con close_hdf5_volume al terminar con él)
+            skip_errors (bool): Si True, informa y salta escaneos que fallan
+
+        Returns:
+            ScanPrefetcher: Iterador de (seriesuid, ct_scan, origin, spacing)
+
+        Ejemplo:
+            >>> with loader.iter_scans(prefetch=4) as scans:
+            ...     for seriesuid, ct_scan, origin, spacing in scans:
+            ...         lung_mask = preprocesar(ct_scan)
+        """
+        if seriesuids is None:
+            seriesuids = self.list_scans()
+
+        return ScanPrefetcher(self, seriesuids, prefetch=prefetch, workers=workers,
+                              max_bytes=max_bytes, ordered=ordered, lazy=lazy,
+                              skip_errors=skip_errors)
+
+    def load_scan(self, seriesuid, lazy=False):
+        """
+        Carga un escaneo por seriesuid, usando la caché si está configurada
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            lazy (bool): Si True, devuelve un np.memmap sobre el .raw, o un
+                         h5py.Dataset abierto con backend='hdf5' (ver load_itk_image)
+
+        Returns:
+            tuple: (ct_scan, origin, spacing) igual que load_itk_image
+
+        Notes:
+            Con caché, el volumen HU se devuelve como memmap de solo lectura
+            (np.load con mmap_mode='r'); usar .copy() antes de modificarlo.
+        """
+        path = self.find_scan(seriesuid)
+        if self.cache is None or lazy:
+            return self.load_itk_image(path, lazy=lazy)
+
+        header = self._read_header(path)
+        ct_scan = self.cache.get_or_compute(
+            seriesuid, 'hu', lambda: self.load_itk_image(path)[0]
+        )
+        return ct_scan, header['origin'], header['spacing']
+
+    def load_normalized(self, seriesuid, min_hu=-1000, max_hu=400):
+        """
+        Carga un escaneo normalizado a [0, 1] (cacheado por ventana HU)
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            min_hu (int): Valor HU mínimo de la ventana
+            max_hu (int): Valor HU máximo de la ventana
+
+        Returns:
+            tuple: (ct_normalized, origin, spacing)
+        """
+        path = self.find_scan(seriesuid)
+        header = self._read_header(path)
+
+        def compute():
+            with self._open_volume(path) as ct_scan:
+                return self.normalize_hu(ct_scan, min_hu=min_hu, max_hu=max_hu)
+
+        if self.cache is None:
+            return compute(), header['origin'], header['spacing']
+
+        params = {'min_hu': min_hu, 'max_hu': max_hu}
+        normalized = self.cache.get_or_compute(seriesuid, 'normalized', compute, params)
+        return normalized, header['origin'], header['spacing']
+
+    def load_lung_mask(self, seriesuid, threshold=-320, workers=4):
+        """
+        Calcula (o recupera de la caché) la máscara pulmonar de un escaneo
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            threshold (int): Umbral HU de LungPreprocessor.segment_lung_mask
+            workers (int): Hilos de segment_lung_mask_batch (no afecta al resultado)
+
+        Returns:
+            np.ndarray: Máscara 3D uint8 (slices, height, width)
+        """
+        path = self.find_scan(seriesuid)
+
+        def compute():
+            with self._open_volume(path) as ct_scan:
+                return LungPreprocessor.segment_lung_mask_batch(ct_scan, threshold=threshold,
+                                                                workers=workers)
+
+        if self.cache is None:
+            return compute()
+
+        return self.cache.get_or_compute(seriesuid, 'lung_mask', compute, {'threshold': threshold})
+
+    def get_lung_crop(self, seriesuid, margin_mm=10.0, threshold=-320, workers=4):
+        """
+        Bounding box pulmonar de un escaneo (cacheada por escaneo)
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            margin_mm (float): Margen alrededor de los pulmones (default: 10 mm)
+            threshold (int): Umbral HU de la máscara pulmonar (ver load_lung_mask)
+            workers (int): Hilos para segmentar la máscara si no está en caché
+
+        Returns:
+            LungCrop: Recorte con offset y origin del volumen recortado
+        """
+        header = self.get_scan_header(seriesuid)
+
+        def compute():
+            mask = self.load_lung_mask(seriesuid, threshold=threshold, workers=workers)
+            return lung_bbox(mask, spacing=header['spacing'], margin_mm=margin_mm)
+
+        params = {'margin_mm': margin_mm, 'threshold': threshold}
+        if self.cache is None:
+            bbox = compute()
+        else:
+            bbox = self.cache.get_or_compute(seriesuid, 'lung_crop', compute, params)
+
+        return LungCrop(np.asarray(bbox), header['shape'], header['origin'],
+                        header['spacing'], header['direction'])
+
+    def load_cropped(self, seriesuid, margin_mm=10.0, threshold=-320, lazy=False, workers=4):
+        """
+        Carga un escaneo recortado a su bounding box pulmonar
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            margin_mm (float): Margen alrededor de los pulmones (default: 10 mm)
+            threshold (int): Umbral HU de la máscara pulmonar
+            lazy (bool): Si True, el recorte es una vista sobre el memmap (con
+                         h5py se leen solo los chunks del recorte)
+            workers (int): Hilos para segmentar la máscara pulmonar si no está en caché
+
+        Returns:
+            tuple: (ct_crop, crop)
+                - ct_crop (np.ndarray): Volumen recortado en HU
+                - crop (LungCrop): Recorte; crop.apply() recorta cualquier máscara
+                  del escaneo y crop.cropped_origin es el nuevo origin
+        """
+        crop = self.get_lung_crop(seriesuid, margin_mm=margin_mm, threshold=threshold, workers=workers)
+        ct_scan = self.load_scan(seriesuid, lazy=lazy)[0]
+        # Indexar un h5py.Dataset ya devuelve un array: el archivo se puede cerrar
+        ct_crop = crop.apply(ct_scan)
+        close_hdf5_volume(ct_scan)
+        return ct_crop, crop
+
+    def load_nodule_mask(self, seriesuid, mode='label'):
+        """
+        Rasteriza todas las anotaciones de un escaneo en un único volumen
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            mode (str): 'label' (una etiqueta por nódulo, en el orden del CSV)
+                        o 'union' (máscara binaria)
+
+        Returns:
+            np.ndarray: Volumen (slices, height, width) (ver create_nodule_masks),
+                        todo ceros si el escaneo no tiene anotaciones
+        """
+        header = self.get_scan_header(seriesuid)
+        annotations = self.get_voxel_annotations(seriesuid, header['origin'], header['spacing'],
+                                                 direction=header['direction'])
+        if annotations is None:
+            centers, diameters = np.empty((0, 3)), np.empty(0)
+        else:
+            centers, diameters = annotations
+
+        return LungPreprocessor.create_nodule_masks(header['shape'], centers, diameters,
+                                                    header['spacing'], mode=mode)
+
+    def load_resampled(self, seriesuid, new_spacing=(1.0, 1.0, 1.0), source='hu',
+                       workers=4, lung_threshold=-320):
+        """
+        Carga un escaneo (o su máscara pulmonar) remuestreado a new_spacing
+
+        Con caché configurada, el resultado se guarda por (seriesuid, spacing,
+        source), de modo que un dataset isotrópico se construye una sola vez.
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            new_spacing (array-like): Spacing objetivo en mm (z, y, x)
+            source (str): 'hu' (interpolación lineal) o 'lung_mask' (vecino más cercano)
+            workers (int): Hilos de remuestreo (y de segmentación si source='lung_mask')
+            lung_threshold (int): Umbral HU si source='lung_mask'
+
+        Returns:
+            tuple: (volume, origin, new_spacing); el origin no cambia
+        """
+        if source not in ('hu', 'lung_mask'):
+            raise ValueError("source debe ser 'hu' o 'lung_mask'")
+
+        header = self.get_scan_header(seriesuid)
+        new_spacing = np.asarray(new_spacing, dtype=np.float64)
+
+        def compute():
+            if source == 'lung_mask':
+                volume = self.load_lung_mask(seriesuid, threshold=lung_threshold, workers=workers)
+                return resample_volume(volume, header['spacing'], new_spacing,
+                                       order='nearest', workers=workers)
+            with self._open_volume(self.find_scan(seriesuid)) as volume:
+                return resample_volume(volume, header['spacing'], new_spacing,
+                                       order='linear', workers=workers)
+
+        if self.cache is None:
+            return compute(), header['origin'], new_spacing
+
+        params = {'spacing': new_spacing.tolist()}
+        if source == 'lung_mask':
+            params['threshold'] = lung_threshold
+        resampled = self.cache.get_or_compute(seriesuid, f'resampled_{source}', compute, params)
+        return resampled, header['origin'], new_spacing
+
+    def extract_patches(self, seriesuid, centers, patch_size=32, coords='world', pad_value=-1000):
+        """
+        Extrae patches 3D de un escaneo sin decodificar el volumen completo
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            centers (array-like): Centros (N, 3) en orden (z, y, x)
+            patch_size (int | tuple): Cubo o (D, H, W) en voxels (default: 32)
+            coords (str): 'world' (mm, ej: annotations.csv) o 'voxel' (índices)
+            pad_value (float): HU para regiones fuera del volumen (default: -1000)
+
+        Returns:
+            np.ndarray: Patches (N, D, H, W) en HU, en el orden de centers
+
+        Ejemplo:
+            >>> rows = loader.get_candidates_for_scan(seriesuid)
+            >>> patches = loader.extract_patches(seriesuid, rows['world'], patch_size=(16, 64, 64))
+        """
+        if coords not in ('world', 'voxel'):
+            raise ValueError("coords debe ser 'world' o 'voxel'")
+
+        path = self.find_scan(seriesuid)
+        header = self._read_header(path)
+        if coords == 'world':
+            centers = VoxelTransform.from_header(header).world_to_voxel(np.atleast_2d(centers))
+
+        with self._open_volume(path) as volume:
+            return extract_patches(volume, centers, patch_size=patch_size, pad_value=pad_value)
+
+    def get_transform(self, seriesuid):
+        """
+        Construye la transformación voxel <-> mundo de un escaneo (solo cabecera)
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+
+        Returns:
+            VoxelTransform: Transformación con origin, spacing, direction y shape
+        """
+        return VoxelTransform.from_header(self.get_scan_header(seriesuid))
+
+    def world_to_voxel(self, world_coords, origin, spacing, direction=None):
         """
         Convierte coordenadas mundo (mm) a coordenadas voxel (índices)
 
         Args:
-            world_coords (array-like): Coordenadas en mm (z, y, x)
+            world_coords (array-like): Coordenadas en mm (z, y, x), punto (3,) o lote (N, 3)
             origin (array-like): Origen del volumen en mm (z, y, x)
             spacing (array-like): Espaciado de voxels en mm (z, y, x)
+            direction (array-like, optional): Matriz de dirección 3x3 (z, y, x)
 
         Returns:
             np.ndarray: Coordenadas voxel (z, y, x) como enteros
 
         Formula:
             voxel = round((world - origin) / spacing)
+
+        Notes:
+            Para muchos puntos del mismo escaneo, construir un VoxelTransform
+            una sola vez (get_transform) y reutilizarlo.
         """
-        voxel_coords = np.rint((world_coords - origin) / spacing).astype(int)
-        return voxel_coords
+        return VoxelTransform(origin, spacing, direction).world_to_voxel(world_coords)
 
-    def voxel_to_world(self, voxel_coords, origin, spacing):
+    def voxel_to_world(self, voxel_coords, origin, spacing, direction=None):
         """
         Convierte coordenadas voxel (índices) a coordenadas mundo (mm)
 
         Args:
-            voxel_coords (array-like): Coordenadas voxel (z, y, x)
+            voxel_coords (array-like): Coordenadas voxel (z, y, x), punto (3,) o lote (N, 3)
             origin (array-like): Origen del volumen en mm (z, y, x)
             spacing (array-like): Espaciado de voxels en mm (z, y, x)
+            direction (array-like, optional): Matriz de dirección 3x3 (z, y, x)
 
         Returns:
             np.ndarray: Coordenadas en mm (z, y, x)
@@ -100,10 +635,9 @@ class LUNA16DataLoader:
         Formula:
             world = spacing * voxel + origin
         """
-        world_coords = spacing * voxel_coords + origin
-        return world_coords
+        return VoxelTransform(origin, spacing, direction).voxel_to_world(voxel_coords)
 
-    def normalize_hu(self, image, min_hu=-1000, max_hu=400):
+    def normalize_hu(self, image, min_hu=-1000, max_hu=400, out=None, dtype=np.float32):
         """
         Normaliza valores Hounsfield Units a rango [0, 1]
 
@@ -111,6 +645,8 @@ class LUNA16DataLoader:
             image (np.ndarray): Imagen en HU
             min_hu (int): Valor HU mínimo (default: -1000 para aire)
             max_hu (int): Valor HU máximo (default: 400 para hueso)
+            out (np.ndarray, optional): Buffer de salida (puede ser image si es float)
+            dtype (np.dtype): float32 (default), float16 o uint8 (rango [0, 255])
 
         Returns:
             np.ndarray: Imagen normalizada en rango [0, 1]
@@ -119,10 +655,26 @@ class LUNA16DataLoader:
             Ventana pulmonar típica: [-1000, 400] HU
             - Valores < min_hu se clips a 0
             - Valores > max_hu se clips a 1
+            - Con entrada int16 se usa una LUT precalculada (ver utils.normalization)
+        """
+        return normalize_hu(image, min_hu=min_hu, max_hu=max_hu, out=out, dtype=dtype)
+
+    def normalize_hu_windows(self, image, windows=('lung', 'mediastinum', 'ggo'),
+                             out=None, dtype=np.float32):
+        """
+        Normaliza con varias ventanas HU en una sola pasada
+
+        Args:
+            image (np.ndarray): Imagen o volumen en HU
+            windows (list): Nombres de ventana ('lung', 'mediastinum', 'ggo')
+                            o tuplas (min_hu, max_hu)
+            out (np.ndarray, optional): Buffer (C, *image.shape)
+            dtype (np.dtype): float32 (default), float16 o uint8
+
+        Returns:
+            np.ndarray: Array (C, *image.shape), un canal por ventana
         """
-        image = np.clip(image, min_hu, max_hu)
-        image = (image - min_hu) / (max_hu - min_hu)
-        return image.astype(np.float32)
+        return normalize_hu_windows(image, windows=windows, out=out, dtype=dtype)
 
     def get_annotations_for_scan(self, seriesuid):
         """
@@ -141,5 +693,47 @@ class LUNA16DataLoader:
         if self.annotations is None:
             return None
 
-        scan_annotations = self.annotations[self.annotations['seriesuid'] == seriesuid]
+        # Lookup O(1) en el índice agrupado en lugar de filtrar todo el DataFrame
+        rows = self.annotation_index.get(seriesuid)['row']
+        scan_annotations = self.annotations.iloc[rows]
         return scan_annotations
+
+    def get_candidates_for_scan(self, seriesuid):
+        """
+        Obtiene los candidatos (candidates.csv) de un escaneo en O(1)
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+
+        Returns:
+            dict: Arrays contiguos del escaneo, o None si no hay candidatos cargados
+                - world (N, 3): Coordenadas en mm (z, y, x)
+                - class (N,): 1 = nódulo, 0 = falso positivo
+                - row (N,): Fila en el CSV original
+        """
+        if self.candidates is None:
+            return None
+
+        return self.candidates.get(seriesuid)
+
+    def get_voxel_annotations(self, seriesuid, origin, spacing, direction=None):
+        """
+        Convierte todas las anotaciones de un escaneo a voxel en una sola operación
+
+        Args:
+            seriesuid (str): Identificador único del escaneo
+            origin (array-like): Origen del volumen en mm (z, y, x)
+            spacing (array-like): Espaciado de voxels en mm (z, y, x)
+            direction (array-like, optional): Matriz de dirección 3x3 (z, y, x)
+
+        Returns:
+            tuple: (voxel_coords, diameters), o None si no hay anotaciones
+                - voxel_coords (np.ndarray): Índices (N, 3) en orden (z, y, x)
+                - diameters (np.ndarray): Diámetros (N,) en mm
+        """
+        if self.annotation_index is None:
+            return None
+
+        voxel_coords = self.annotation_index.to_voxel(seriesuid, origin, spacing, direction=direction)
+        diameters = self.annotation_index.get(seriesuid)['diameter_mm']
+        return voxel_coords, diameters
@@ -0,0 +1,192 @@
+"""
+Evaluación por lotes de segmentaciones (muchos casos en paralelo)
+
+Este módulo proporciona:
+- evaluate_cases: métricas por caso en un pool de procesos a partir de
+  pares (predicción, ground truth) como rutas (NIfTI, .mhd, ... vía
+  SimpleITK) o arrays numpy
+- Lectura en streaming: cada proceso carga solo su caso y el número de
+  casos en vuelo está acotado
+- Resumen del dataset: media, desviación, mediana e intervalo de confianza
+  bootstrap de cada métrica
+- Opcionalmente HD95/ASSD en mm (recortadas a la bounding box de cada caso)
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+
+from .metrics import SegmentationMetrics
+
+
+# Métricas resumidas por defecto en el informe
+SUMMARY_METRICS = ('dice', 'iou', 'sensitivity', 'specificity')
+
+# Centinela de next() al emparejar casos e identificadores
+_MISSING = object()
+
+
+def _read_mask(source):
+    """Array (z, y, x) y spacing (z, y, x) desde una ruta o un array"""
+    if isinstance(source, (str, os.PathLike)):
+        image = sitk.ReadImage(str(source))
+        return sitk.GetArrayFromImage(image), np.array(image.GetSpacing()[::-1])
+    return np.asarray(source), None
+
+
+def _select(mask, label):
+    """Máscara binaria de una etiqueta (None = cualquier valor distinto de 0)"""
+    if label is None:
+        return mask if mask.dtype == bool else mask != 0
+    return mask == label
+
+
+def _evaluate_case(job):
+    """Métricas de un caso (se ejecuta en un proceso del pool)"""
+    case_id, prediction, ground_truth, label, surface = job
+    try:
+        pred, spacing = _read_mask(prediction)
+        true, true_spacing = _read_mask(ground_truth)
+        if spacing is None:
+            spacing = true_spacing
+        if pred.shape != true.shape:
+            raise ValueError(f"Formas distintas: predicción {pred.shape}, ground truth {true.shape}")
+
+        counts = SegmentationMetrics.confusion_counts(_select(true, label), _select(pred, label))
+        row = {'case_id': case_id, **counts, **SegmentationMetrics.metrics_from_counts(counts)}
+
+        voxel_volume = float(np.prod(spacing)) if spacing is not None else 1.0
+        row['true_volume'] = (counts['tp'] + counts['fn']) * voxel_volume
+        row['pred_volume'] = (counts['tp'] + counts['fp']) * voxel_volume
+
+        if surface:
+            row.update(SegmentationMetrics.surface_metrics(_select(true, label), _select(pred, label),
+                                                           spacing=spacing))
+        return row
+    except Exception as e:
+        return {'case_id': case_id, 'error': str(e)}
+
+
+def summarize(values, confidence=0.95, n_bootstrap=2000, seed=0):
+    """
+    Estadísticos de una métrica sobre todos los casos
+
+    Args:
+        values (array-like): Valor por caso (se ignoran NaN)
+        confidence (float): Nivel del intervalo de confianza (default: 0.95)
+        n_bootstrap (int): Remuestreos bootstrap de casos (default: 2000)
+        seed (int): Semilla del bootstrap
+
+    Returns:
+        dict: n, mean, std, median, ci_low, ci_high (IC percentil de la media)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n == 0:
+        return {'n': 0, 'mean': np.nan, 'std': np.nan, 'median': np.nan,
+                'ci_low': np.nan, 'ci_high': np.nan}
+
+    # Bootstrap vectorizado: (n_bootstrap, n) índices de casos de una vez
+    rng = np.random.default_rng(seed)
+    means = values[rng.integers(0, n, size=(n_bootstrap, n))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+
+    return {
+        'n': n,
+        'mean': float(values.mean()),
+        'std': float(values.std(ddof=1)) if n > 1 else 0.0,
+        'median': float(np.median(values)),
+        'ci_low': float(np.quantile(means, alpha)),
+        'ci_high': float(np.quantile(means, 1 - alpha)),
+    }
+
+
+def _with_case_ids(cases, case_ids):
+    """
+    Pares (case_id, caso) con tantos identificadores como casos
+
+    Con generadores la longitud solo se conoce al recorrerlos: la
+    diferencia se detecta (ValueError) al llegar al final del más corto
+    """
+    if case_ids is None:
+        yield from enumerate(cases)
+        return
+
+    ids = iter(case_ids)
+    n_cases = 0
+    for case in cases:
+        case_id = next(ids, _MISSING)
+        if case_id is _MISSING:
+            raise ValueError(f"case_ids tiene {n_cases} elementos y cases al menos {n_cases + 1}")
+        n_cases += 1
+        yield case_id, case
+    if next(ids, _MISSING) is not _MISSING:
+        raise ValueError(f"case_ids tiene más de {n_cases} elementos y cases {n_cases}")
+
+
+def evaluate_cases(cases, case_ids=None, label=None, workers=4, max_in_flight=None,
+                   surface=False, metrics=None, confidence=0.95, n_bootstrap=2000, seed=0):
+    """
+    Evalúa muchos casos en paralelo y resume el dataset
+
+    Args:
+        cases (iterable): Pares (predicción, ground_truth); cada elemento es
+                          una ruta legible por SimpleITK o un np.ndarray
+        case_ids (list, optional): Identificador de cada caso (default: índice);
+                                   misma longitud que cases (si no, ValueError)
+        label (int, optional): Etiqueta a evaluar (default: todo valor != 0)
+        workers (int): Procesos (default: 4)
+        max_in_flight (int, optional): Casos enviados al pool a la vez
+                                       (default: 2 * workers); acota la memoria
+        surface (bool): Si True, añade hd95 y assd en mm (spacing de las rutas)
+        metrics (tuple, optional): Columnas a resumir (default: SUMMARY_METRICS,
+                                   más hd95/assd si surface=True)
+        confidence (float): Nivel del intervalo de confianza bootstrap
+        n_bootstrap (int): Remuestreos bootstrap
+        seed (int): Semilla del bootstrap
+
+    Returns:
+        tuple: (per_case, summary)
+            - per_case (pd.DataFrame): Una fila por caso (case_id, tp, fp, fn,
+              tn, métricas, volúmenes en mm³ si hay spacing, error si falla)
+            - summary (pd.DataFrame): Una fila por métrica con n, mean, std,
+              median, ci_low, ci_high
+
+    Ejemplo:
+        >>> pairs = [(f'pred/{c}.nii.gz', f'labelsTs/{c}.nii.gz') for c in ids]
+        >>> per_case, summary = evaluate_cases(pairs, case_ids=ids, workers=16)
+    """
+    max_in_flight = max_in_flight or 2 * max(1, workers)
+    if metrics is None:
+        metrics = SUMMARY_METRICS + (('hd95', 'assd') if surface else ())
+    # Con longitudes conocidas, el error salta antes de enviar nada al pool
+    if (case_ids is not None and hasattr(cases, '__len__') and hasattr(case_ids, '__len__')
+            and len(cases) != len(case_ids)):
+        raise ValueError(f"case_ids tiene {len(case_ids)} elementos y cases {len(cases)}")
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = deque()
+        for case_id, (prediction, ground_truth) in _with_case_ids(cases, case_ids):
+            pending.append(executor.submit(_evaluate_case, (case_id, prediction, ground_truth, label, surface)))
+            if len(pending) >= max_in_flight:
+                rows.append(pending.popleft().result())
+        while pending:
+            rows.append(pending.popleft().result())
+
+    for row in rows:
+        if 'error' in row:
+            print(f"[ERROR] {row['case_id']}: {row['error']}")
+
+    per_case = pd.DataFrame(rows)
+    summary = pd.DataFrame({
+        name: summarize(per_case[name] if name in per_case else [], confidence, n_bootstrap, seed)
+        for name in metrics
+    }).T
+
+    return per_case, summary
@@ -0,0 +1,271 @@
+"""
+Evaluación FROC de detección de nódulos (protocolo LUNA16)
+
+Este módulo proporciona:
+- match_candidates: asigna candidatos (coordenadas mundo + probabilidad) a
+  las esferas de annotations.csv, escaneo a escaneo sobre índices agrupados
+- evaluate_froc: sensibilidad a 1/8, 1/4, 1/2, 1, 2, 4 y 8 FPs por escaneo,
+  CPM (media de las 7) e intervalos de confianza bootstrap por escaneos
+
+Reglas del protocolo oficial (noduleCADEvaluationLUNA16):
+- Un candidato acierta un nódulo si su distancia al centro es menor que el radio
+- Por nódulo solo cuenta el candidato de mayor probabilidad; el resto se ignora
+- Los candidatos que caen en anotaciones excluidas (annotations_excluded.csv)
+  se ignoran: ni TP ni FP. Diámetros negativos se tratan como 10 mm
+- Los FPs por escaneo se dividen entre todos los escaneos evaluados
+- La sensibilidad en cada punto de operación se interpola linealmente sobre
+  la curva FROC (np.interp sobre FPs por escaneo), como el script oficial
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+
+from .annotations import AnnotationIndex, ANNOTATION_DTYPES
+
+
+# Puntos de operación de la FROC de LUNA16 (FPs por escaneo)
+FROC_FP_RATES = (0.125, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0)
+
+# Diámetro asignado a anotaciones sin diámetro (diameter_mm < 0)
+DEFAULT_DIAMETER_MM = 10.0
+
+# Elementos (bootstraps x candidatos) por lote en el bootstrap vectorizado
+BOOTSTRAP_BATCH_ELEMENTS = 1 << 24
+
+
+def _as_index(table, dtypes=None):
+    """AnnotationIndex desde un índice, un DataFrame o la ruta a un CSV"""
+    if table is None or isinstance(table, AnnotationIndex):
+        return table
+    if isinstance(table, pd.DataFrame):
+        return AnnotationIndex.from_dataframe(table)
+    return AnnotationIndex.from_csv(table, dtypes=dtypes)
+
+
+def _radius_squared(index, seriesuid):
+    diameters = np.asarray(index.get(seriesuid)['diameter_mm'], dtype=np.float64)
+    diameters = np.where(diameters < 0, DEFAULT_DIAMETER_MM, diameters)
+    return (diameters / 2) ** 2
+
+
+def match_candidates(predictions, annotations, excluded=None, seriesuids=None):
+    """
+    Clasifica cada candidato como TP de un nódulo, FP o ignorado
+
+    Args:
+        predictions: DataFrame / CSV / AnnotationIndex con seriesuid, coordX,
+                     coordY, coordZ y probability
+        annotations: annotations.csv (DataFrame, ruta o AnnotationIndex)
+        excluded (optional): annotations_excluded.csv, mismo formato
+        seriesuids (list, optional): Escaneos evaluados, ej: loader.list_scans().
+                                     Si no se indica se usan los escaneos con
+                                     predicciones o anotaciones y se avisa: los
+                                     escaneos sin ninguna de las dos quedan
+                                     fuera del denominador de FPs por escaneo
+
+    Returns:
+        dict: Arrays para evaluate_froc
+            - seriesuids (S,): escaneos evaluados
+            - nodules_per_scan (S,): nódulos incluidos por escaneo
+            - scores (K,), scan (K,), is_tp (K,): un elemento por FP y uno
+              por nódulo detectado (su mejor probabilidad)
+            - nodule_scores (N,): mejor probabilidad por nódulo, NaN si no se detecta
+            - nodule_scan (N,): escaneo de cada nódulo
+    """
+    predictions = _as_index(predictions, dtypes={'seriesuid': str, 'probability': np.float64})
+    annotations = _as_index(annotations, dtypes=ANNOTATION_DTYPES)
+    excluded = _as_index(excluded, dtypes=ANNOTATION_DTYPES)
+
+    if seriesuids is None:
+        warnings.warn('seriesuids no indicado: se evalúan solo los escaneos con predicciones '
+                      'o anotaciones; los escaneos vacíos no cuentan en los FPs por escaneo. '
+                      'Pase la lista completa (ej: loader.list_scans())', stacklevel=2)
+        seriesuids = sorted(set(predictions.seriesuids.tolist()) | set(annotations.seriesuids.tolist()))
+    seriesuids = np.asarray(seriesuids, dtype=str)
+
+    scores, scans, is_tp = [], [], []
+    nodule_scores, nodule_scan = [], []
+    nodules_per_scan = np.zeros(len(seriesuids), dtype=np.int64)
+
+    for s, seriesuid in enumerate(seriesuids.tolist()):
+        candidates = predictions.world_coords(seriesuid)
+        probabilities = np.asarray(predictions.get(seriesuid)['probability'], dtype=np.float64)
+
+        nodules = annotations.world_coords(seriesuid)
+        nodules_per_scan[s] = len(nodules)
+
+        # (candidatos, nódulos): las anotaciones por escaneo son pocas
+        hits = (((candidates[:, None, :] - nodules[None, :, :]) ** 2).sum(axis=-1)
+                < _radius_squared(annotations, seriesuid)[None, :])
+        ignored = hits.any(axis=1)
+        if excluded is not None and seriesuid in excluded:
+            excluded_nodules = excluded.world_coords(seriesuid)
+            ignored |= (((candidates[:, None, :] - excluded_nodules[None, :, :]) ** 2).sum(axis=-1)
+                        < _radius_squared(excluded, seriesuid)[None, :]).any(axis=1)
+
+        false_positives = probabilities[~ignored]
+        scores.append(false_positives)
+        scans.append(np.full(len(false_positives), s))
+        is_tp.append(np.zeros(len(false_positives), dtype=bool))
+
+        best = np.where(hits, probabilities[:, None], -np.inf).max(axis=0, initial=-np.inf)
+        detected = np.isfinite(best)
+        scores.append(best[detected])
+        scans.append(np.full(int(detected.sum()), s))
+        is_tp.append(np.ones(int(detected.sum()), dtype=bool))
+
+        nodule_scores.append(np.where(detected, best, np.nan))
+        nodule_scan.append(np.full(len(nodules), s))
+
+    return {
+        'seriesuids': seriesuids,
+        'nodules_per_scan': nodules_per_scan,
+        'scores': np.concatenate(scores) if scores else np.empty(0),
+        'scan': np.concatenate(scans).astype(np.int64) if scans else np.empty(0, np.int64),
+        'is_tp': np.concatenate(is_tp) if is_tp else np.empty(0, bool),
+        'nodule_scores': np.concatenate(nodule_scores) if nodule_scores else np.empty(0),
+        'nodule_scan': np.concatenate(nodule_scan).astype(np.int64) if nodule_scan else np.empty(0, np.int64),
+    }
+
+
+def _froc_points(weights, scan, is_tp, group_ends, nodules_per_scan):
+    """
+    FP/escaneo y sensibilidad acumulados en cada umbral, para cada fila de pesos
+
+    Args:
+        weights (np.ndarray): (B, S) veces que aparece cada escaneo en cada muestra
+        scan, is_tp (np.ndarray): Elementos ordenados por probabilidad descendente
+        group_ends (np.ndarray): Último elemento de cada grupo de probabilidades iguales
+
+    Returns:
+        tuple: (fps, sensitivity), cada uno (B, len(group_ends) + 1)
+    """
+    w = weights[:, scan]
+    tp_cum = np.cumsum(np.where(is_tp, w, 0), axis=1)[:, group_ends]
+    fp_cum = np.cumsum(np.where(is_tp, 0, w), axis=1)[:, group_ends]
+
+    zeros = np.zeros((len(weights), 1))
+    n_scans = weights.sum(axis=1, keepdims=True)
+    n_nodules = np.maximum(weights @ nodules_per_scan, 1)[:, None]
+    fps = np.hstack([zeros, fp_cum]) / n_scans
+    sensitivity = np.hstack([zeros, tp_cum]) / n_nodules
+    return fps, sensitivity
+
+
+def _sensitivity_at(fps, sensitivity, fp_rates):
+    """
+    Sensibilidad interpolada en cada FPs/escaneo, fila a fila
+
+    Equivale a np.interp(fp_rates, fps[b], sensitivity[b]) para cada fila b
+    (fps es no decreciente): se interpola entre el último punto con
+    fps <= rate y el siguiente, y a la derecha de la curva se mantiene el
+    último valor
+    """
+    rows = np.arange(len(fps))
+    last = fps.shape[1] - 1
+    points = []
+    for rate in fp_rates:
+        left = (fps <= rate).sum(axis=1) - 1
+        right = np.minimum(left + 1, last)
+        x0, x1 = fps[rows, left], fps[rows, right]
+        y0, y1 = sensitivity[rows, left], sensitivity[rows, right]
+        span = x1 - x0
+        t = np.divide(rate - x0, span, out=np.zeros_like(span), where=span > 0)
+        points.append(y0 + t * (y1 - y0))
+    return np.stack(points, axis=1)
+
+
+def evaluate_froc(predictions, annotations, excluded=None, seriesuids=None,
+                  fp_rates=FROC_FP_RATES, n_bootstrap=1000, confidence=0.95, seed=0):
+    """
+    FROC de LUNA16 con intervalos de confianza bootstrap
+
+    Args:
+        predictions: Candidatos con seriesuid, coordX, coordY, coordZ, probability
+                     (DataFrame, ruta CSV o AnnotationIndex)
+        annotations: annotations.csv (DataFrame, ruta o AnnotationIndex)
+        excluded (optional): annotations_excluded.csv
+        seriesuids (list, optional): Escaneos evaluados (ej: los 888 de LUNA16)
+        fp_rates (tuple): FPs por escaneo de la curva (default: FROC_FP_RATES)
+        n_bootstrap (int): Remuestreos de escaneos (0 = sin intervalos)
+        confidence (float): Nivel de los intervalos (default: 0.95)
+        seed (int): Semilla del bootstrap
+
+    Returns:
+        dict:
+            - fp_rates (R,), sensitivity (R,), cpm (media de sensitivity)
+            - ci_low (R,), ci_high (R,), cpm_ci (low, high) si n_bootstrap > 0
+            - fps_curve, sensitivity_curve: curva FROC completa
+            - n_scans, n_nodules, n_detected, n_false_positives
+            - nodule_scores: mejor probabilidad por nódulo (NaN si no detectado)
+
+    Notes:
+        - La sensibilidad en cada punto se interpola linealmente sobre la
+          curva FROC (un punto por umbral de probabilidad), como hace
+          noduleCADEvaluationLUNA16 con np.interp
+        - Bootstrap por escaneos: cada muestra es un vector de pesos
+          multinomial (S,); todos los umbrales de un lote de muestras se
+          resuelven con sumas acumuladas matriciales, sin bucles por candidato
+    """
+    matched = match_candidates(predictions, annotations, excluded, seriesuids)
+    fp_rates = np.asarray(fp_rates, dtype=np.float64)
+    n_scans = len(matched['seriesuids'])
+    nodules_per_scan = matched['nodules_per_scan'].astype(np.float64)
+
+    order = np.argsort(-matched['scores'], kind='stable')
+    scores = matched['scores'][order]
+    scan = matched['scan'][order]
+    is_tp = matched['is_tp'][order]
+    # Un umbral por valor distinto de probabilidad (los empates entran juntos)
+    group_ends = np.flatnonzero(np.append(scores[1:] != scores[:-1], True)) if len(scores) else np.empty(0, int)
+
+    fps, sensitivity = _froc_points(np.ones((1, n_scans)), scan, is_tp, group_ends, nodules_per_scan)
+    point = _sensitivity_at(fps, sensitivity, fp_rates)[0]
+
+    result = {
+        'fp_rates': fp_rates,
+        'sensitivity': point,
+        'cpm': float(point.mean()),
+        'fps_curve': fps[0],
+        'sensitivity_curve': sensitivity[0],
+        'n_scans': n_scans,
+        'n_nodules': int(nodules_per_scan.sum()),
+        'n_detected': int(is_tp.sum()),
+        'n_false_positives': int((~is_tp).sum()),
+        'nodule_scores': matched['nodule_scores'],
+    }
+
+    if n_bootstrap > 0 and n_scans > 0:
+        rng = np.random.default_rng(seed)
+        # Solo importan los umbrales hasta superar max(fp_rates) FPs/escaneo:
+        # se parte del doble del corte de la estimación puntual
+        max_fps = fp_rates.max() * n_scans
+        limit = 2 * int(np.searchsorted(np.cumsum(~is_tp), max_fps, side='right')) + 1
+        samples = []
+        start = 0
+        while start < n_bootstrap:
+            size = min(max(1, BOOTSTRAP_BATCH_ELEMENTS // min(limit, max(len(scores), 1))),
+                       n_bootstrap - start)
+            weights = rng.multinomial(n_scans, np.full(n_scans, 1.0 / n_scans), size=size).astype(np.float64)
+            while True:
+                fps, sensitivity = _froc_points(weights, scan[:limit], is_tp[:limit],
+                                                group_ends[group_ends < limit], nodules_per_scan)
+                # Si alguna muestra no supera max(fp_rates) dentro del corte, se amplía
+                if limit >= len(scores) or (fps[:, -1] > fp_rates.max()).all():
+                    break
+                limit *= 2
+                # El lote se reduce para que (size, limit) siga dentro del presupuesto
+                size = min(size, max(1, BOOTSTRAP_BATCH_ELEMENTS // min(limit, len(scores))))
+                weights = weights[:size]
+            samples.append(_sensitivity_at(fps, sensitivity, fp_rates))
+            start += size
+        samples = np.concatenate(samples)
+
+        alpha = (1 - confidence) / 2
+        cpm_samples = samples.mean(axis=1)
+        result['ci_low'] = np.quantile(samples, alpha, axis=0)
+        result['ci_high'] = np.quantile(samples, 1 - alpha, axis=0)
+        result['cpm_ci'] = (float(np.quantile(cpm_samples, alpha)), float(np.quantile(cpm_samples, 1 - alpha)))
+
+    return result
@@ -0,0 +1,298 @@
+"""
+Espejo HDF5 comprimido y por chunks del dataset LUNA16
+
+Este módulo proporciona:
+- Conversión en paralelo de .mhd/.raw a un archivo .h5 por escaneo
+  (misma estructura de carpetas subset*/), con dataset int16 chunked y comprimido
+- Atributos origin/spacing/direction y anotaciones de annotations.csv
+- Lectura completa o lazy (h5py.Dataset) para LUNA16DataLoader(backend='hdf5');
+  los volúmenes lazy se cierran con close_hdf5_volume
+- Benchmark de throughput de lectura .raw vs HDF5
+
+Layout de cada archivo:
+    /ct                       dataset (slices, height, width) int16
+    /ct.attrs['origin']       (z, y, x) mm
+    /ct.attrs['spacing']      (z, y, x) mm
+    /ct.attrs['direction']    3x3 (z, y, x)
+    /attrs['seriesuid']
+    /attrs['annotations_world']        (N, 3) mm (z, y, x)
+    /attrs['annotations_diameter_mm']  (N,)
+"""
+
+import os
+import glob
+import time
+import tempfile
+import numpy as np
+import h5py
+import SimpleITK as sitk
+from concurrent.futures import ProcessPoolExecutor
+
+from .annotations import AnnotationIndex
+
+
+# Presets de chunking
+CHUNK_PRESETS = {
+    'slice': lambda shape: (1, shape[1], shape[2]),
+    'cube': lambda shape: tuple(min(32, n) for n in shape),
+}
+
+# Caché de chunks de h5py al leer (por archivo abierto)
+READ_CHUNK_CACHE_BYTES = 64 * 1024**2
+
+
+def _resolve_chunks(chunks, shape):
+    if isinstance(chunks, str):
+        return CHUNK_PRESETS[chunks](shape)
+    return tuple(min(c, n) for c, n in zip(chunks, shape))
+
+
+def convert_scan_to_hdf5(mhd_path, h5_path, chunks='slice', compression='gzip',
+                         compression_opts=1, annotations=None):
+    """
+    Convierte un escaneo .mhd/.raw a HDF5
+
+    Args:
+        mhd_path (str): Ruta al archivo .mhd
+        h5_path (str): Ruta del .h5 de salida
+        chunks (str | tuple): 'slice' (1, H, W), 'cube' (32³) o tupla explícita
+        compression (str): 'gzip' (default) o 'lzf' (más rápido, menos compresión)
+        compression_opts (int): Nivel gzip (default: 1)
+        annotations (dict, optional): {'world': (N, 3), 'diameter_mm': (N,)}
+
+    Returns:
+        dict: {'seriesuid', 'raw_bytes', 'h5_bytes'}
+    """
+    seriesuid = os.path.splitext(os.path.basename(mhd_path))[0]
+    itkimage = sitk.ReadImage(mhd_path)
+    ct_scan = sitk.GetArrayFromImage(itkimage)
+
+    direction = np.array(itkimage.GetDirection()).reshape(3, 3)[::-1, ::-1]
+
+    directory = os.path.dirname(os.path.abspath(h5_path))
+    os.makedirs(directory, exist_ok=True)
+
+    # Escritura atómica: un fallo a mitad no deja ni el .h5 ni el temporal
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        with h5py.File(tmp_path, 'w') as f:
+            dataset = f.create_dataset(
+                'ct', data=ct_scan,
+                chunks=_resolve_chunks(chunks, ct_scan.shape),
+                compression=compression,
+                compression_opts=compression_opts if compression == 'gzip' else None,
+                shuffle=True,
+            )
+            dataset.attrs['origin'] = np.array(list(reversed(itkimage.GetOrigin())))
+            dataset.attrs['spacing'] = np.array(list(reversed(itkimage.GetSpacing())))
+            dataset.attrs['direction'] = direction
+            f.attrs['seriesuid'] = seriesuid
+
+            if annotations is not None:
+                f.attrs['annotations_world'] = np.asarray(annotations['world'], dtype=np.float64).reshape(-1, 3)
+                f.attrs['annotations_diameter_mm'] = np.asarray(annotations['diameter_mm'], dtype=np.float64)
+        os.replace(tmp_path, h5_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    raw_bytes = sum(os.path.getsize(p) for p in glob.glob(os.path.splitext(mhd_path)[0] + '.*')
+                    if not p.endswith('.mhd'))
+    return {'seriesuid': seriesuid, 'raw_bytes': raw_bytes, 'h5_bytes': os.path.getsize(h5_path)}
+
+
+def _convert_job(args):
+    """Envoltorio para ProcessPoolExecutor (captura errores por escaneo)"""
+    mhd_path, h5_path, kwargs = args
+    try:
+        return convert_scan_to_hdf5(mhd_path, h5_path, **kwargs)
+    except Exception as e:
+        return {'seriesuid': os.path.splitext(os.path.basename(mhd_path))[0], 'error': str(e)}
+
+
+def convert_luna16_to_hdf5(luna16_path, output_dir, annotations_path=None, workers=4,
+                           chunks='slice', compression='gzip', compression_opts=1,
+                           overwrite=False):
+    """
+    Convierte en paralelo todos los escaneos LUNA16 a HDF5
+
+    Args:
+        luna16_path (str): Raíz LUNA16 (con subset*/) o un subset concreto
+        output_dir (str): Directorio espejo de salida (misma estructura de carpetas)
+        annotations_path (str, optional): annotations.csv para guardar como atributos
+        workers (int): Procesos de conversión (default: 4)
+        chunks (str | tuple): Ver convert_scan_to_hdf5
+        compression (str): 'gzip' o 'lzf'
+        compression_opts (int): Nivel gzip
+        overwrite (bool): Si False, salta escaneos ya convertidos
+
+    Returns:
+        list: Un diccionario por escaneo (ver convert_scan_to_hdf5, o 'error')
+    """
+    mhd_files = sorted(glob.glob(os.path.join(luna16_path, '*.mhd')))
+    mhd_files += sorted(glob.glob(os.path.join(luna16_path, 'subset*', '*.mhd')))
+
+    index = None
+    if annotations_path and os.path.exists(annotations_path):
+        index = AnnotationIndex.from_csv(annotations_path)
+
+    jobs = []
+    for mhd_path in mhd_files:
+        relative = os.path.relpath(os.path.splitext(mhd_path)[0] + '.h5', luna16_path)
+        h5_path = os.path.join(output_dir, relative)
+        if not overwrite and os.path.exists(h5_path):
+            continue
+
+        kwargs = {'chunks': chunks, 'compression': compression, 'compression_opts': compression_opts}
+        if index is not None:
+            rows = index.get(os.path.splitext(os.path.basename(mhd_path))[0])
+            kwargs['annotations'] = {'world': rows['world'], 'diameter_mm': rows['diameter_mm']}
+        jobs.append((mhd_path, h5_path, kwargs))
+
+    print(f"[INFO] Convirtiendo {len(jobs)} escaneos a HDF5 ({len(mhd_files) - len(jobs)} ya existen)")
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(_convert_job, jobs))
+
+    errors = [r for r in results if 'error' in r]
+    for r in errors:
+        print(f"[ERROR] {r['seriesuid']}: {r['error']}")
+
+    converted = [r for r in results if 'error' not in r]
+    if converted:
+        raw_total = sum(r['raw_bytes'] for r in converted)
+        h5_total = sum(r['h5_bytes'] for r in converted)
+        print(f"[OK] {len(converted)} escaneos: {raw_total / 1024**3:.2f} GB -> "
+              f"{h5_total / 1024**3:.2f} GB ({h5_total / max(raw_total, 1):.0%})")
+
+    return results
+
+
+def read_hdf5_header(h5_path):
+    """
+    Lee los metadatos de un escaneo HDF5 (mismo formato que read_mhd_header)
+
+    Args:
+        h5_path (str): Ruta al archivo .h5
+
+    Returns:
+        dict: shape, spacing, origin, direction, dtype, data_file, compressed
+    """
+    with h5py.File(h5_path, 'r') as f:
+        dataset = f['ct']
+        return {
+            'shape': dataset.shape,
+            'spacing': np.array(dataset.attrs['spacing']),
+            'origin': np.array(dataset.attrs['origin']),
+            'direction': np.array(dataset.attrs['direction']),
+            'dtype': dataset.dtype,
+            'data_file': os.path.abspath(h5_path),
+            'data_offset': None,
+            # Los chunks HDF5 se leen bajo demanda: el modo lazy siempre es posible
+            'compressed': False,
+        }
+
+
+def load_hdf5_image(h5_path, lazy=False):
+    """
+    Carga un escaneo HDF5
+
+    Args:
+        h5_path (str): Ruta al archivo .h5
+        lazy (bool): Si True, devuelve el h5py.Dataset abierto (solo se
+                     descomprimen los chunks que se indexan)
+
+    Returns:
+        tuple: (ct_scan, origin, spacing) en orden (z, y, x)
+
+    Notes:
+        Con lazy=True el archivo (y su caché de chunks de
+        READ_CHUNK_CACHE_BYTES) queda abierto hasta cerrarlo con
+        close_hdf5_volume(ct_scan) o ct_scan.file.close()
+    """
+    if not lazy:
+        with h5py.File(h5_path, 'r') as f:
+            dataset = f['ct']
+            return dataset[()], np.array(dataset.attrs['origin']), np.array(dataset.attrs['spacing'])
+
+    # Solo el modo lazy deja el archivo abierto, y solo si todo se ha leído bien
+    f = h5py.File(h5_path, 'r', rdcc_nbytes=READ_CHUNK_CACHE_BYTES)
+    try:
+        dataset = f['ct']
+        origin = np.array(dataset.attrs['origin'])
+        spacing = np.array(dataset.attrs['spacing'])
+    except BaseException:
+        f.close()
+        raise
+    return dataset, origin, spacing
+
+
+def close_hdf5_volume(volume):
+    """
+    Cierra el archivo de un volumen abierto con load_hdf5_image(lazy=True)
+
+    No hace nada con np.ndarray / np.memmap, así que se puede llamar sobre
+    cualquier volumen devuelto por una lectura lazy.
+
+    Args:
+        volume: Volumen lazy (h5py.Dataset) o array
+    """
+    if isinstance(volume, h5py.Dataset) and volume.id.valid:
+        volume.file.close()
+
+
+def benchmark_read_throughput(mhd_path, h5_path, n_patches=200, patch_size=32, seed=0):
+    """
+    Compara el throughput de lectura del .raw original y del espejo HDF5
+
+    Args:
+        mhd_path (str): Ruta al .mhd original
+        h5_path (str): Ruta al .h5 convertido
+        n_patches (int): Número de patches aleatorios para el test de acceso aleatorio
+        patch_size (int): Tamaño de cada patch cúbico
+        seed (int): Semilla de las posiciones aleatorias
+
+    Returns:
+        dict: Tamaños en disco, MB/s de lectura completa y patches/s aleatorios
+
+    Notes:
+        Los resultados dependen de la caché de páginas del sistema operativo;
+        para medir lectura en frío, vaciarla antes de cada formato.
+    """
+    from .data_loader import LUNA16DataLoader, read_mhd_header
+    from .patches import extract_patches
+
+    loader = LUNA16DataLoader(os.path.dirname(mhd_path))
+    header = read_mhd_header(mhd_path)
+    shape = np.asarray(header['shape'])
+    rng = np.random.default_rng(seed)
+    centers = rng.integers(0, shape, size=(n_patches, 3))
+    volume_mb = np.prod(shape) * header['dtype'].itemsize / 1024**2
+
+    results = {
+        'raw_mb': os.path.getsize(header['data_file']) / 1024**2,
+        'h5_mb': os.path.getsize(h5_path) / 1024**2,
+    }
+
+    start = time.perf_counter()
+    loader.load_itk_image(mhd_path)
+    results['raw_full_mb_s'] = volume_mb / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    load_hdf5_image(h5_path)
+    results['h5_full_mb_s'] = volume_mb / (time.perf_counter() - start)
+
+    volume = loader.load_itk_image(mhd_path, lazy=True)[0]
+    start = time.perf_counter()
+    extract_patches(volume, centers, patch_size)
+    results['raw_patches_s'] = n_patches / (time.perf_counter() - start)
+
+    volume = load_hdf5_image(h5_path, lazy=True)[0]
+    start = time.perf_counter()
+    extract_patches(volume, centers, patch_size)
+    results['h5_patches_s'] = n_patches / (time.perf_counter() - start)
+    close_hdf5_volume(volume)
+
+    return results
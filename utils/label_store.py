@@ -0,0 +1,374 @@
+"""
+Almacén disperso de máscaras de nódulos para todo el dataset
+
+Este módulo proporciona:
+- export_nodule_labels: genera en paralelo las máscaras de nódulos de todos
+  los escaneos (esferas de annotations.csv y/o consenso LIDC) y las guarda
+  como bounding box + recorte empaquetado con np.packbits
+- NoduleLabelStore: índice en un único .npz con acceso O(1) por seriesuid y
+  densificación bajo demanda (un escaneo o un nódulo, sin tocar el resto)
+
+Los nódulos ocupan <0.01% de los voxels, así que guardar solo los recortes
+(1 bit por voxel) reduce el tamaño en varios órdenes frente a volúmenes uint8.
+"""
+
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .preprocessor import LungPreprocessor
+
+
+# Origen de cada máscara
+LABEL_SOURCES = {'annotations': 0, 'lidc': 1}
+
+# Cargador LIDC por proceso (pylidc es costoso de inicializar)
+_LIDC_LOADER = None
+
+
+def _bbox_to_slices(bbox):
+    """Array (3, 2) [start, stop) -> tupla de slices"""
+    return tuple(slice(int(start), int(stop)) for start, stop in bbox)
+
+
+def _slices_to_bbox(slices):
+    """Tupla de slices -> array (3, 2) [start, stop)"""
+    return np.array([[s.start, s.stop] for s in slices], dtype=np.int32)
+
+
+def _lidc_masks(seriesuid, origin, spacing, shape, threshold):
+    """Máscaras de consenso LIDC (mask, bbox) de un escaneo, una por cluster"""
+    global _LIDC_LOADER
+    if _LIDC_LOADER is None:
+        # Import local: pylidc es una dependencia opcional
+        from .lidc_loader import LIDCAnnotationLoader
+        _LIDC_LOADER = LIDCAnnotationLoader(verbose=False)
+
+    scan = _LIDC_LOADER.get_scan_by_seriesuid(seriesuid)
+    if scan is None:
+        return []
+
+    masks = []
+    for cluster in scan.cluster_annotations():
+        result = _LIDC_LOADER.get_aligned_mask_for_cluster(
+            cluster=cluster, origin=origin, spacing=spacing,
+            ct_shape=shape, threshold=threshold
+        )
+        if result is not None and result[0].any():
+            masks.append(result)
+    return masks
+
+
+def _export_job(job):
+    """
+    Genera los recortes empaquetados de un escaneo (se ejecuta en un proceso)
+
+    Returns:
+        dict: seriesuid, bbox (N, 3, 2), source (N,), bits (list de arrays uint8)
+              o 'error'
+    """
+    try:
+        bboxes, sources, bits = [], [], []
+
+        def add(mask, slices, source):
+            bboxes.append(_slices_to_bbox(slices))
+            sources.append(LABEL_SOURCES[source])
+            bits.append(np.packbits(np.ascontiguousarray(mask, dtype=bool).ravel()))
+
+        if 'annotations' in job['sources']:
+            for center, diameter in zip(job['centers'], job['diameters']):
+                mask, slices = LungPreprocessor.nodule_sphere(job['shape'], center, diameter, job['spacing'])
+                if mask.any():
+                    add(mask, slices, 'annotations')
+
+        if 'lidc' in job['sources']:
+            for mask, slices in _lidc_masks(job['seriesuid'], job['origin'], job['spacing'],
+                                            job['shape'], job['lidc_threshold']):
+                add(mask, slices, 'lidc')
+
+        return {
+            'seriesuid': job['seriesuid'],
+            'shape': job['shape'],
+            'bbox': np.array(bboxes, dtype=np.int32).reshape(-1, 3, 2),
+            'source': np.array(sources, dtype=np.int8),
+            'bits': bits,
+        }
+    except Exception as e:
+        return {'seriesuid': job['seriesuid'], 'error': str(e)}
+
+
+class NoduleLabelStore:
+    """
+    Máscaras de nódulos de muchos escaneos en formato disperso
+
+    Cada nódulo se guarda como su bounding box [start, stop) en voxels y el
+    recorte binario empaquetado (np.packbits). Las filas están agrupadas por
+    seriesuid como en AnnotationIndex, así que obtener los nódulos de un
+    escaneo es un lookup + slicing.
+
+    Columnas por nódulo:
+    - bbox (N, 3, 2): [start, stop) en (z, y, x)
+    - source (N,): 0 = annotations.csv, 1 = consenso LIDC (ver LABEL_SOURCES)
+    - bit_offsets (N + 1,): rango de cada recorte dentro de bits
+
+    Usage:
+        store = export_nodule_labels(loader, 'LUNA16/nodule_labels.npz', workers=8)
+        store = NoduleLabelStore.load('LUNA16/nodule_labels.npz')
+        labels = store.densify(seriesuid)                 # volumen de etiquetas
+        for mask, bbox in store.crops(seriesuid):         # sin volumen completo
+            ...
+    """
+
+    def __init__(self, seriesuids, offsets, shapes, bboxes, sources, bit_offsets, bits):
+        """
+        Args:
+            seriesuids (np.ndarray): seriesuids en orden
+            offsets (np.ndarray): Límites de los nódulos de cada escaneo, len(seriesuids) + 1
+            shapes (np.ndarray): Dimensiones (S, 3) de cada escaneo
+            bboxes (np.ndarray): Bounding boxes (N, 3, 2)
+            sources (np.ndarray): Origen de cada máscara (N,)
+            bit_offsets (np.ndarray): Límites de cada recorte en bits, N + 1
+            bits (np.ndarray): Recortes empaquetados concatenados (uint8)
+        """
+        self.seriesuids = seriesuids
+        self.offsets = offsets
+        self.shapes = shapes
+        self.bboxes = bboxes
+        self.sources = sources
+        self.bit_offsets = bit_offsets
+        self.bits = bits
+        self._rows = {uid: i for i, uid in enumerate(seriesuids.tolist())}
+
+    @classmethod
+    def from_results(cls, results):
+        """Construye el almacén a partir de los resultados de _export_job"""
+        results = sorted(results, key=lambda r: r['seriesuid'])
+        counts = [len(r['source']) for r in results]
+        bits = [b for r in results for b in r['bits']]
+
+        return cls(
+            seriesuids=np.array([r['seriesuid'] for r in results], dtype=str),
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            shapes=np.array([r['shape'] for r in results], dtype=np.int64).reshape(-1, 3),
+            bboxes=np.concatenate([r['bbox'] for r in results] or [np.empty((0, 3, 2), np.int32)]),
+            sources=np.concatenate([r['source'] for r in results] or [np.empty(0, np.int8)]),
+            bit_offsets=np.concatenate([[0], np.cumsum([len(b) for b in bits])]).astype(np.int64),
+            bits=np.concatenate(bits) if bits else np.empty(0, dtype=np.uint8),
+        )
+
+    def save(self, path):
+        """
+        Guarda el almacén como .npz sin comprimir (escritura atómica)
+
+        Args:
+            path (str): Ruta del archivo .npz
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, seriesuids=self.seriesuids, offsets=self.offsets, shapes=self.shapes,
+                         bboxes=self.bboxes, sources=self.sources,
+                         bit_offsets=self.bit_offsets, bits=self.bits)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Carga un almacén guardado con save()
+
+        Args:
+            path (str): Ruta del archivo .npz
+
+        Returns:
+            NoduleLabelStore
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['seriesuids'], data['offsets'], data['shapes'], data['bboxes'],
+                       data['sources'], data['bit_offsets'], data['bits'])
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, seriesuid):
+        return seriesuid in self._rows
+
+    def shape_for(self, seriesuid):
+        """
+        Args:
+            seriesuid (str): Identificador del escaneo
+
+        Returns:
+            tuple: Dimensiones (slices, height, width) del escaneo
+        """
+        return tuple(int(n) for n in self.shapes[self._rows[seriesuid]])
+
+    def _nodule_rows(self, seriesuid, sources=None):
+        """Índices de los nódulos de un escaneo, filtrados por origen"""
+        if seriesuid not in self._rows:
+            return np.empty(0, dtype=np.int64)
+        i = self._rows[seriesuid]
+        rows = np.arange(self.offsets[i], self.offsets[i + 1])
+        if sources is not None:
+            codes = [LABEL_SOURCES[s] for s in ([sources] if isinstance(sources, str) else sources)]
+            rows = rows[np.isin(self.sources[rows], codes)]
+        return rows
+
+    def _unpack(self, row):
+        """Desempaqueta el recorte de un nódulo -> (mask bool, bbox slices)"""
+        slices = _bbox_to_slices(self.bboxes[row])
+        shape = tuple(s.stop - s.start for s in slices)
+        packed = self.bits[self.bit_offsets[row]:self.bit_offsets[row + 1]]
+        mask = np.unpackbits(packed, count=int(np.prod(shape))).view(bool).reshape(shape)
+        return mask, slices
+
+    def count(self, seriesuid, sources=None):
+        """
+        Args:
+            seriesuid (str): Identificador del escaneo
+            sources (str | list, optional): 'annotations', 'lidc' o ambos (default)
+
+        Returns:
+            int: Número de nódulos del escaneo
+        """
+        return len(self._nodule_rows(seriesuid, sources))
+
+    def crops(self, seriesuid, sources=None):
+        """
+        Recortes de los nódulos de un escaneo sin reservar el volumen completo
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            sources (str | list, optional): 'annotations', 'lidc' o ambos (default)
+
+        Returns:
+            list: Pares (mask, bbox) con mask bool y bbox tupla de slices (z, y, x)
+        """
+        return [self._unpack(row) for row in self._nodule_rows(seriesuid, sources)]
+
+    def sparse(self, seriesuid, sources=None):
+        """
+        Máscaras de un escaneo como SparseMask (unión, métricas, centroides
+        sobre los recortes)
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            sources (str | list, optional): 'annotations', 'lidc' o ambos (default)
+
+        Returns:
+            SparseMask
+        """
+        from .sparse_mask import SparseMask
+        return SparseMask.from_label_store(self, seriesuid, sources)
+
+    def densify(self, seriesuid, mode='label', sources=None, out=None):
+        """
+        Reconstruye el volumen de máscaras de un escaneo
+
+        Args:
+            seriesuid (str): Identificador del escaneo
+            mode (str): 'label' (nódulo i -> i + 1, orden del almacén) o 'union'
+            sources (str | list, optional): 'annotations', 'lidc' o ambos (default)
+            out (np.ndarray, optional): Volumen donde escribir (se pone a cero)
+
+        Returns:
+            np.ndarray: Volumen (slices, height, width) uint8 (uint16 con más
+                        de 255 nódulos en modo 'label')
+        """
+        if mode not in ('label', 'union'):
+            raise ValueError("mode debe ser 'label' o 'union'")
+
+        rows = self._nodule_rows(seriesuid, sources)
+        shape = self.shape_for(seriesuid)
+        if out is None:
+            dtype = np.uint8 if mode == 'union' or len(rows) < 256 else np.uint16
+            out = np.zeros(shape, dtype=dtype)
+        elif out.shape != shape:
+            raise ValueError(f"out debe tener shape {shape}, recibido {out.shape}")
+        else:
+            out[...] = 0
+
+        for label, row in enumerate(rows, start=1):
+            mask, slices = self._unpack(row)
+            if mode == 'union':
+                out[slices] |= mask
+            else:
+                out[slices][mask] = label
+
+        return out
+
+    def nbytes(self):
+        """Tamaño en memoria (y aproximadamente en disco) del almacén"""
+        return sum(a.nbytes for a in (self.offsets, self.shapes, self.bboxes,
+                                      self.sources, self.bit_offsets, self.bits))
+
+
+def export_nodule_labels(loader, output_path, seriesuids=None, sources=('annotations',),
+                         workers=4, lidc_threshold=0.5):
+    """
+    Genera en paralelo las máscaras de nódulos de todos los escaneos
+
+    Args:
+        loader (LUNA16DataLoader): Cargador con annotations_path si se usa 'annotations'
+        output_path (str): Ruta del .npz de salida
+        seriesuids (list, optional): Escaneos a exportar (default: loader.list_scans())
+        sources (tuple): 'annotations' (esferas de annotations.csv) y/o 'lidc'
+                         (consenso de radiólogos vía pylidc)
+        workers (int): Procesos (default: 4)
+        lidc_threshold (float): Fracción mínima de radiólogos para el consenso LIDC
+
+    Returns:
+        NoduleLabelStore: Almacén ya guardado en output_path
+    """
+    sources = (sources,) if isinstance(sources, str) else tuple(sources)
+    unknown = set(sources) - set(LABEL_SOURCES)
+    if unknown:
+        raise ValueError(f"sources desconocidas: {sorted(unknown)} (usar {list(LABEL_SOURCES)})")
+
+    if seriesuids is None:
+        seriesuids = loader.list_scans()
+
+    # Cabeceras y coordenadas voxel en el proceso principal (solo metadatos)
+    jobs = []
+    for seriesuid in seriesuids:
+        header = loader.get_scan_header(seriesuid)
+        centers, diameters = np.empty((0, 3)), np.empty(0)
+        if 'annotations' in sources:
+            annotations = loader.get_voxel_annotations(seriesuid, header['origin'], header['spacing'],
+                                                       direction=header['direction'])
+            if annotations is not None:
+                centers, diameters = annotations
+
+        jobs.append({
+            'seriesuid': seriesuid,
+            'shape': tuple(int(n) for n in header['shape']),
+            'origin': header['origin'],
+            'spacing': header['spacing'],
+            'centers': centers,
+            'diameters': diameters,
+            'sources': sources,
+            'lidc_threshold': lidc_threshold,
+        })
+
+    print(f"[INFO] Exportando máscaras de {len(jobs)} escaneos ({', '.join(sources)})")
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(_export_job, jobs))
+
+    for r in results:
+        if 'error' in r:
+            print(f"[ERROR] {r['seriesuid']}: {r['error']}")
+
+    store = NoduleLabelStore.from_results([r for r in results if 'error' not in r])
+    store.save(output_path)
+
+    dense_bytes = int(store.shapes.prod(axis=1).sum())
+    print(f"[OK] {len(store)} nódulos en {len(store.seriesuids)} escaneos: "
+          f"{store.nbytes() / 1024**2:.2f} MB (vs {dense_bytes / 1024**3:.2f} GB en uint8)")
+    return store
@@ -26,6 +26,8 @@ np.bool = np.bool_
 import pylidc as pl
 from pylidc.Scan import Scan
 
+from .coordinates import VoxelTransform
+
 
 class LIDCAnnotationLoader:
     """
@@ -453,6 +455,22 @@ class LIDCAnnotationLoader:
             'num_nodules': len(scan.cluster_annotations())
         }
 
+    @staticmethod
+    def _contour_z_indices(contours: List, origin: np.ndarray, spacing: np.ndarray) -> List[int]:
+        """
+        Convierte las posiciones z (mm) de una lista de contornos a índices LUNA16
+
+        Args:
+            contours: Lista de objetos Contour (de pylidc)
+            origin: Origin del volumen LUNA16 (z, y, x) en mm
+            spacing: Spacing del volumen LUNA16 (z, y, x) en mm
+
+        Returns:
+            Lista de índices z (uno por contorno)
+        """
+        z_positions_mm = np.array([c.image_z_position for c in contours], dtype=np.float64)
+        return VoxelTransform(origin, spacing).z_to_index(z_positions_mm).tolist()
+
     def get_aligned_mask(self, seriesuid: str, annotation_idx: int,
                          origin: np.ndarray, spacing: np.ndarray,
                          ct_shape: Tuple[int, int, int]) -> Optional[Tuple[np.ndarray, Tuple]]:
@@ -489,13 +507,12 @@ class LIDCAnnotationLoader:
             if not contours:
                 return None
 
-            # Convertir z_positions de mm a índices LUNA16
-            z_positions_mm = [c.image_z_position for c in contours]
-            z_indices = [int(round((z_mm - origin[0]) / spacing[0])) for z_mm in z_positions_mm]
+            # Convertir z_positions de mm a índices LUNA16 (vectorizado)
+            z_indices = self._contour_z_indices(contours, origin, spacing)
 
             # Filtrar índices válidos
             valid_contours = []
-            for i, (contour, z_idx) in enumerate(zip(contours, z_indices)):
+            for contour, z_idx in zip(contours, z_indices):
                 if 0 <= z_idx < ct_shape[0]:
                     valid_contours.append((contour, z_idx))
 
@@ -587,11 +604,11 @@ class LIDCAnnotationLoader:
             # Recolectar todos los contornos de todas las anotaciones
             all_contour_data = []  # Lista de (z_idx, y_coords, x_coords)
 
-            for ann in cluster:
-                for contour in ann.contours:
-                    z_mm = contour.image_z_position
-                    z_idx = int(round((z_mm - origin[0]) / spacing[0]))
+            # Índices z de todos los contornos, una conversión por anotación
+            ann_z_indices = [self._contour_z_indices(ann.contours, origin, spacing) for ann in cluster]
 
+            for ann, z_indices in zip(cluster, ann_z_indices):
+                for contour, z_idx in zip(ann.contours, z_indices):
                     if 0 <= z_idx < ct_shape[0]:
                         coords = contour.to_matrix()
                         all_contour_data.append((z_idx, coords[:, 0], coords[:, 1]))
@@ -617,13 +634,10 @@ class LIDCAnnotationLoader:
             vote_volume = np.zeros(mask_shape, dtype=np.float32)
 
             # Contar votos por radiólogo (no por contorno)
-            for ann in cluster:
+            for ann, z_indices in zip(cluster, ann_z_indices):
                 ann_mask = np.zeros(mask_shape, dtype=bool)
 
-                for contour in ann.contours:
-                    z_mm = contour.image_z_position
-                    z_idx = int(round((z_mm - origin[0]) / spacing[0]))
-
+                for contour, z_idx in zip(ann.contours, z_indices):
                     if z_min <= z_idx <= z_max:
                         coords = contour.to_matrix()
                         rr, cc = polygon(coords[:, 0] - y_min, coords[:, 1] - x_min,
@@ -677,11 +691,11 @@ class LIDCAnnotationLoader:
             # Recolectar todos los contornos de todas las anotaciones
             all_contour_data = []  # Lista de (z_idx, y_coords, x_coords)
 
-            for ann in cluster:
-                for contour in ann.contours:
-                    z_mm = contour.image_z_position
-                    z_idx = int(round((z_mm - origin[0]) / spacing[0]))
+            # Índices z de todos los contornos, una conversión por anotación
+            ann_z_indices = [self._contour_z_indices(ann.contours, origin, spacing) for ann in cluster]
 
+            for ann, z_indices in zip(cluster, ann_z_indices):
+                for contour, z_idx in zip(ann.contours, z_indices):
                     if 0 <= z_idx < ct_shape[0]:
                         coords = contour.to_matrix()
                         all_contour_data.append((z_idx, coords[:, 0], coords[:, 1]))
@@ -707,13 +721,10 @@ class LIDCAnnotationLoader:
             vote_volume = np.zeros(mask_shape, dtype=np.float32)
 
             # Contar votos por radiólogo (no por contorno)
-            for ann in cluster:
+            for ann, z_indices in zip(cluster, ann_z_indices):
                 ann_mask = np.zeros(mask_shape, dtype=bool)
 
-                for contour in ann.contours:
-                    z_mm = contour.image_z_position
-                    z_idx = int(round((z_mm - origin[0]) / spacing[0]))
-
+                for contour, z_idx in zip(ann.contours, z_indices):
                     if z_min <= z_idx <= z_max:
                         coords = contour.to_matrix()
                         rr, cc = polygon(coords[:, 0] - y_min, coords[:, 1] - x_min,
@@ -2,13 +2,74 @@
 Módulo de métricas para evaluación de segmentación y detección
 
 Proporciona:
-- Métricas de segmentación (Dice, IoU, Sensitivity, Specificity)
-- Funciones de pérdida para entrenamiento (Dice Loss, Focal Loss)
+- Métricas de segmentación (Dice, IoU, Sensitivity, Specificity), todas
+  derivadas de una única pasada de conteo TP/FP/FN/TN
+- Métricas de superficie (HD95, ASSD) en mm, recortadas a la bounding box
+- MetricAccumulator: conteos acumulados por bloques, combinables entre procesos
+- Funciones de pérdida para entrenamiento (Dice Loss, Focal Loss, Dice + Focal)
+  fusionadas en un único logsigmoid, con reducción por muestra/clase y
+  máscaras de voxels ignorados; benchmark_losses las compara (CPU o CUDA)
 """
 
+import os
+import json
+import time
+import tempfile
+
 import numpy as np
 import torch
 import torch.nn as nn
+from torch.autograd.function import once_differentiable
+from scipy import ndimage
+
+
+# Voxels por bloque al contar (~4 slices de 512x512): memoria extra constante
+CHUNK_VOXELS = 1 << 20
+
+
+def _as_mask_chunk(chunk, buffer):
+    """Vista booleana de un bloque: sin copia si ya es bool, si no != 0 en buffer"""
+    if chunk.dtype == bool:
+        return chunk
+    return np.not_equal(chunk, 0, out=buffer[:len(chunk)])
+
+
+def _as_count(value):
+    """int para conteos enteros, float para conteos de máscaras suaves"""
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    return int(value)
+
+
+def _as_sparse(mask):
+    """
+    Normaliza una máscara a (recorte bool, start (3,))
+
+    Acepta un volumen completo o un par (mask, bbox) como los que devuelve
+    LIDCAnnotationLoader, con bbox tupla de slices o array (3, 2) [start, stop).
+    """
+    if isinstance(mask, tuple) and len(mask) == 2:
+        crop, bbox = mask
+        starts = [b.start for b in bbox] if isinstance(bbox[0], slice) else np.asarray(bbox)[:, 0]
+        return np.asarray(crop) != 0, np.asarray(starts, dtype=np.int64)
+
+    mask = np.asarray(mask)
+    starts = np.zeros(mask.ndim, dtype=np.int64)
+    stops = np.zeros(mask.ndim, dtype=np.int64)
+    for axis in range(mask.ndim):
+        other = tuple(a for a in range(mask.ndim) if a != axis)
+        present = np.flatnonzero(np.any(mask, axis=other))
+        if len(present) == 0:
+            return np.zeros((0,) * mask.ndim, dtype=bool), starts
+        starts[axis], stops[axis] = present[0], present[-1] + 1
+    bbox = tuple(slice(a, b) for a, b in zip(starts, stops))
+    return mask[bbox] != 0, starts
+
+
+def _surface(mask):
+    """Voxels del borde de una máscara (mask sin su erosión, conectividad 6)"""
+    structure = ndimage.generate_binary_structure(mask.ndim, 1)
+    return mask & ~ndimage.binary_erosion(mask, structure=structure, border_value=0)
 
 
 class SegmentationMetrics:
@@ -20,8 +81,120 @@ class SegmentationMetrics:
     - IoU (Intersection over Union / Jaccard Index)
     - Sensitivity (Recall / True Positive Rate)
     - Specificity (True Negative Rate)
+    - HD95 y ASSD (métricas de superficie en mm)
+
+    Las métricas de solapamiento se calculan a partir de confusion_counts
+    (TP, FP, FN, TN), que recorre los dos volúmenes una sola vez por bloques
+    del eje 0.
     """
 
+    @staticmethod
+    def confusion_counts(y_true, y_pred):
+        """
+        Cuenta TP, FP, FN y TN en una sola pasada
+
+        Args:
+            y_true (np.ndarray): Máscara ground truth (bool, 0/1 de cualquier
+                                 dtype o probabilidades float)
+            y_pred (np.ndarray): Máscara predicha con la misma forma
+
+        Returns:
+            dict: {'tp', 'fp', 'fn', 'tn'}: enteros, o float con máscaras suaves
+
+        Notes:
+            - Con máscaras bool/enteras cualquier valor distinto de 0 cuenta
+              como positivo
+            - Si alguna es float se usan productos, como las fórmulas
+              originales: tp = sum(t * p), fp = sum((1 - t) * p), ... Una
+              probabilidad 0.3 aporta 0.3 de TP, no 1. Para binarizar,
+              pasar por ejemplo y_pred >= 0.5
+            - Se procesa por bloques del eje 0 con buffers reutilizados: no se
+              aplana ni se copia el volumen (admite np.memmap)
+        """
+        y_true = np.atleast_1d(np.asarray(y_true))
+        y_pred = np.atleast_1d(np.asarray(y_pred))
+        if y_true.shape != y_pred.shape:
+            raise ValueError(f"Formas distintas: y_true {y_true.shape}, y_pred {y_pred.shape}")
+
+        rows = y_true.shape[0]
+        row_size = max(1, int(np.prod(y_true.shape[1:])))
+        step = max(1, CHUNK_VOXELS // row_size)
+        block_shape = (min(step, rows),) + y_true.shape[1:]
+
+        if np.issubdtype(y_true.dtype, np.floating) or np.issubdtype(y_pred.dtype, np.floating):
+            return SegmentationMetrics._soft_confusion_counts(y_true, y_pred, step, block_shape)
+
+        true_buffer = np.empty(block_shape, dtype=bool)
+        pred_buffer = np.empty(block_shape, dtype=bool)
+        both = np.empty(block_shape, dtype=bool)
+
+        tp = n_true = n_pred = 0
+        for start in range(0, rows, step):
+            t = _as_mask_chunk(y_true[start:start + step], true_buffer)
+            p = _as_mask_chunk(y_pred[start:start + step], pred_buffer)
+            tp += np.count_nonzero(np.logical_and(t, p, out=both[:len(t)]))
+            n_true += np.count_nonzero(t)
+            n_pred += np.count_nonzero(p)
+
+        total = y_true.size
+        return {
+            'tp': int(tp),
+            'fp': int(n_pred - tp),
+            'fn': int(n_true - tp),
+            'tn': int(total - n_true - n_pred + tp),
+        }
+
+    @staticmethod
+    def _soft_confusion_counts(y_true, y_pred, step, block_shape):
+        """Conteos como sumas de productos (máscaras float), por bloques del eje 0"""
+        product = np.empty(block_shape, dtype=np.float64)
+
+        tp = n_true = n_pred = 0.0
+        for start in range(0, y_true.shape[0], step):
+            t = y_true[start:start + step]
+            p = y_pred[start:start + step]
+            tp += float(np.multiply(t, p, out=product[:len(t)]).sum())
+            n_true += float(t.sum(dtype=np.float64))
+            n_pred += float(p.sum(dtype=np.float64))
+
+        total = y_true.size
+        return {
+            'tp': tp,
+            'fp': n_pred - tp,
+            'fn': n_true - tp,
+            'tn': total - n_true - n_pred + tp,
+        }
+
+    @staticmethod
+    def metrics_from_counts(counts, smooth=1e-7):
+        """
+        Calcula todas las métricas a partir de los conteos de confusion_counts
+
+        Args:
+            counts (dict): {'tp', 'fp', 'fn', 'tn'}
+            smooth (float): Factor de suavizado (mismo en todas las métricas)
+
+        Returns:
+            dict: dice, iou, sensitivity, specificity
+        """
+        tp, fp, fn, tn = counts['tp'], counts['fp'], counts['fn'], counts['tn']
+        return {
+            'dice': (2. * tp + smooth) / (2. * tp + fp + fn + smooth),
+            'iou': (tp + smooth) / (tp + fp + fn + smooth),
+            'sensitivity': (tp + smooth) / (tp + fn + smooth),
+            'specificity': (tn + smooth) / (tn + fp + smooth),
+        }
+
+    @staticmethod
+    def accumulator():
+        """
+        Acumulador de conteos para evaluar por bloques (ver MetricAccumulator)
+
+        Returns:
+            MetricAccumulator: Vacío, listo para update(y_true_chunk, y_pred_chunk)
+        """
+        return MetricAccumulator()
+
     @staticmethod
     def dice_coefficient(y_true, y_pred, smooth=1e-7):
         """
@@ -38,13 +211,8 @@ class SegmentationMetrics:
         Formula:
             Dice = 2 * |A ∩ B| / (|A| + |B|)
         """
-        y_true_f = y_true.flatten()
-        y_pred_f = y_pred.flatten()
-
-        intersection = np.sum(y_true_f * y_pred_f)
-        dice = (2. * intersection + smooth) / (np.sum(y_true_f) + np.sum(y_pred_f) + smooth)
-
-        return dice
+        counts = SegmentationMetrics.confusion_counts(y_true, y_pred)
+        return SegmentationMetrics.metrics_from_counts(counts, smooth)['dice']
 
     @staticmethod
     def iou_score(y_true, y_pred, smooth=1e-7):
@@ -62,15 +230,8 @@ class SegmentationMetrics:
         Formula:
             IoU = |A ∩ B| / |A ∪ B|
         """
-        y_true_f = y_true.flatten()
-        y_pred_f = y_pred.flatten()
-
-        intersection = np.sum(y_true_f * y_pred_f)
-        union = np.sum(y_true_f) + np.sum(y_pred_f) - intersection
-
-        iou = (intersection + smooth) / (union + smooth)
-
-        return iou
+        counts = SegmentationMetrics.confusion_counts(y_true, y_pred)
+        return SegmentationMetrics.metrics_from_counts(counts, smooth)['iou']
 
     @staticmethod
     def sensitivity(y_true, y_pred, smooth=1e-7):
@@ -91,13 +252,8 @@ class SegmentationMetrics:
         Notes:
             Importante para detectar todos los nódulos (minimizar falsos negativos)
         """
-        y_true_f = y_true.flatten()
-        y_pred_f = y_pred.flatten()
-
-        true_positives = np.sum(y_true_f * y_pred_f)
-        possible_positives = np.sum(y_true_f)
-
-        return (true_positives + smooth) / (possible_positives + smooth)
+        counts = SegmentationMetrics.confusion_counts(y_true, y_pred)
+        return SegmentationMetrics.metrics_from_counts(counts, smooth)['sensitivity']
 
     @staticmethod
     def specificity(y_true, y_pred, smooth=1e-7):
@@ -118,17 +274,8 @@ class SegmentationMetrics:
         Notes:
             Importante para minimizar falsos positivos
         """
-        y_true_f = y_true.flatten()
-        y_pred_f = y_pred.flatten()
-
-        # Invertir máscaras para calcular negativos
-        y_true_neg = 1 - y_true_f
-        y_pred_neg = 1 - y_pred_f
-
-        true_negatives = np.sum(y_true_neg * y_pred_neg)
-        possible_negatives = np.sum(y_true_neg)
-
-        return (true_negatives + smooth) / (possible_negatives + smooth)
+        counts = SegmentationMetrics.confusion_counts(y_true, y_pred)
+        return SegmentationMetrics.metrics_from_counts(counts, smooth)['specificity']
 
     @staticmethod
     def compute_all_metrics(y_true, y_pred):
@@ -140,15 +287,370 @@ class SegmentationMetrics:
             y_pred (np.ndarray): Máscara predicha
 
         Returns:
-            dict: Diccionario con todas las métricas
+            dict: Diccionario con todas las métricas (un único conteo TP/FP/FN/TN)
         """
+        counts = SegmentationMetrics.confusion_counts(y_true, y_pred)
+        return SegmentationMetrics.metrics_from_counts(counts)
+
+    @staticmethod
+    def surface_distances(y_true, y_pred, spacing=None, margin=1):
+        """
+        Distancias entre las superficies de dos máscaras
+
+        Ambas máscaras se recortan a la unión de sus bounding boxes más un
+        margen antes de extraer superficies y calcular la transformada de
+        distancia, así que el coste depende del tamaño del nódulo y no del
+        volumen completo.
+
+        Args:
+            y_true: Ground truth: volumen completo o par (mask, bbox)
+            y_pred: Predicción: volumen completo o par (mask, bbox), en el
+                    mismo sistema de coordenadas voxel que y_true
+            spacing (array-like, optional): Spacing (z, y, x) en mm (default: 1)
+            margin (int): Voxels de margen alrededor de la unión (default: 1)
+
+        Returns:
+            tuple: (true_to_pred, pred_to_true), distancias en mm desde cada
+                   voxel de superficie de una máscara a la superficie de la otra.
+                   None si alguna de las dos máscaras está vacía
+        """
+        true_crop, true_start = _as_sparse(y_true)
+        pred_crop, pred_start = _as_sparse(y_pred)
+        if not true_crop.any() or not pred_crop.any():
+            return None
+
+        starts = np.minimum(true_start, pred_start) - margin
+        stops = np.maximum(true_start + true_crop.shape, pred_start + pred_crop.shape) + margin
+        shape = tuple(stops - starts)
+        spacing = np.ones(len(shape)) if spacing is None else np.asarray(spacing, dtype=np.float64)
+
+        surfaces = []
+        for crop, start in ((true_crop, true_start), (pred_crop, pred_start)):
+            union = np.zeros(shape, dtype=bool)
+            offset = start - starts
+            union[tuple(slice(a, a + n) for a, n in zip(offset, crop.shape))] = crop
+            surfaces.append(_surface(union))
+
+        true_surface, pred_surface = surfaces
+        distance_to_pred = ndimage.distance_transform_edt(~pred_surface, sampling=spacing)
+        distance_to_true = ndimage.distance_transform_edt(~true_surface, sampling=spacing)
+        return distance_to_pred[true_surface], distance_to_true[pred_surface]
+
+    @staticmethod
+    def surface_metrics(y_true, y_pred, spacing=None, margin=1):
+        """
+        Hausdorff 95 y distancia superficial media simétrica (ASSD)
+
+        Args:
+            y_true: Ground truth: volumen completo o par (mask, bbox)
+            y_pred: Predicción: volumen completo o par (mask, bbox)
+            spacing (array-like, optional): Spacing (z, y, x) en mm (default: 1)
+            margin (int): Voxels de margen alrededor de la unión (default: 1)
+
+        Returns:
+            dict: {'hd95', 'assd'} en mm. 0 si ambas máscaras están vacías,
+                  NaN si solo una lo está
+
+        Formula:
+            HD95 = max(P95(d(A→B)), P95(d(B→A)))
+            ASSD = (Σ d(A→B) + Σ d(B→A)) / (|∂A| + |∂B|)
+        """
+        distances = SegmentationMetrics.surface_distances(y_true, y_pred, spacing, margin)
+        if distances is None:
+            empty_true = not _as_sparse(y_true)[0].any()
+            empty_pred = not _as_sparse(y_pred)[0].any()
+            value = 0.0 if empty_true and empty_pred else np.nan
+            return {'hd95': value, 'assd': value}
+
+        true_to_pred, pred_to_true = distances
         return {
-            'dice': SegmentationMetrics.dice_coefficient(y_true, y_pred),
-            'iou': SegmentationMetrics.iou_score(y_true, y_pred),
-            'sensitivity': SegmentationMetrics.sensitivity(y_true, y_pred),
-            'specificity': SegmentationMetrics.specificity(y_true, y_pred)
+            'hd95': float(max(np.percentile(true_to_pred, 95), np.percentile(pred_to_true, 95))),
+            'assd': float((true_to_pred.sum() + pred_to_true.sum()) / (len(true_to_pred) + len(pred_to_true))),
         }
 
+    @staticmethod
+    def hausdorff_95(y_true, y_pred, spacing=None, margin=1):
+        """
+        Distancia de Hausdorff al percentil 95 en mm (ver surface_metrics)
+
+        Args:
+            y_true: Ground truth: volumen completo o par (mask, bbox)
+            y_pred: Predicción: volumen completo o par (mask, bbox)
+            spacing (array-like, optional): Spacing (z, y, x) en mm
+            margin (int): Voxels de margen alrededor de la unión
+
+        Returns:
+            float: HD95 en mm
+        """
+        return SegmentationMetrics.surface_metrics(y_true, y_pred, spacing, margin)['hd95']
+
+    @staticmethod
+    def assd(y_true, y_pred, spacing=None, margin=1):
+        """
+        Distancia superficial media simétrica en mm (ver surface_metrics)
+
+        Args:
+            y_true: Ground truth: volumen completo o par (mask, bbox)
+            y_pred: Predicción: volumen completo o par (mask, bbox)
+            spacing (array-like, optional): Spacing (z, y, x) en mm
+            margin (int): Voxels de margen alrededor de la unión
+
+        Returns:
+            float: ASSD en mm
+        """
+        return SegmentationMetrics.surface_metrics(y_true, y_pred, spacing, margin)['assd']
+
+
+class MetricAccumulator:
+    """
+    Conteos TP/FP/FN/TN acumulados bloque a bloque
+
+    Permite evaluar predicciones que se generan por slabs (memmaps, inferencia
+    por bloques) sin tener el volumen completo en memoria: cada update cuenta
+    un par de bloques con confusion_counts y suma los enteros. La memoria es
+    la de un bloque, sea cual sea el tamaño del escaneo o del dataset.
+
+    Los conteos son sumas, así que acumuladores de distintos procesos se
+    combinan con merge y se serializan como un dict de enteros (JSON, npz).
+
+    Usage:
+        acc = SegmentationMetrics.accumulator()
+        for z in range(0, depth, 16):
+            acc.update(labels[z:z + 16], model_predict(volume[z:z + 16]))
+        print(acc.compute()['dice'])
+
+        # En paralelo: un acumulador por proceso y se combinan al final
+        total = MetricAccumulator.from_dict(results[0])
+        for r in results[1:]:
+            total.merge(MetricAccumulator.from_dict(r))
+
+    Attributes:
+        tp, fp, fn, tn (int | float): Conteos acumulados (float con máscaras suaves)
+        n_updates (int): Bloques acumulados (incluidos los combinados con merge)
+    """
+
+    FIELDS = ('tp', 'fp', 'fn', 'tn')
+
+    def __init__(self, tp=0, fp=0, fn=0, tn=0, n_updates=0):
+        self.tp = _as_count(tp)
+        self.fp = _as_count(fp)
+        self.fn = _as_count(fn)
+        self.tn = _as_count(tn)
+        self.n_updates = int(n_updates)
+
+    def update(self, y_true_chunk, y_pred_chunk):
+        """
+        Suma los conteos de un bloque
+
+        Args:
+            y_true_chunk (np.ndarray): Bloque de la máscara ground truth
+            y_pred_chunk (np.ndarray): Bloque predicho con la misma forma
+
+        Returns:
+            MetricAccumulator: self (permite encadenar)
+        """
+        return self.update_counts(SegmentationMetrics.confusion_counts(y_true_chunk, y_pred_chunk))
+
+    def update_counts(self, counts):
+        """
+        Suma conteos ya calculados (ej: una fila de evaluate_cases)
+
+        Args:
+            counts (dict): {'tp', 'fp', 'fn', 'tn'}
+
+        Returns:
+            MetricAccumulator: self
+        """
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + _as_count(counts[name]))
+        self.n_updates += 1
+        return self
+
+    def merge(self, other):
+        """
+        Combina los conteos de otro acumulador (ej: de otro proceso)
+
+        Args:
+            other (MetricAccumulator): Acumulador a sumar
+
+        Returns:
+            MetricAccumulator: self
+        """
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.n_updates += other.n_updates
+        return self
+
+    def counts(self):
+        """
+        Returns:
+            dict: {'tp', 'fp', 'fn', 'tn'} acumulados
+        """
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def compute(self, smooth=1e-7):
+        """
+        Métricas con los conteos acumulados hasta ahora
+
+        Args:
+            smooth (float): Factor de suavizado
+
+        Returns:
+            dict: dice, iou, sensitivity, specificity
+        """
+        return SegmentationMetrics.metrics_from_counts(self.counts(), smooth)
+
+    def reset(self):
+        """Vuelve a cero todos los conteos"""
+        self.tp = self.fp = self.fn = self.tn = self.n_updates = 0
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: Conteos y n_updates como int/float de Python (serializable a JSON)
+        """
+        return {**self.counts(), 'n_updates': self.n_updates}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Args:
+            data (dict): Salida de to_dict
+
+        Returns:
+            MetricAccumulator
+        """
+        return cls(**{name: data[name] for name in cls.FIELDS}, n_updates=data.get('n_updates', 0))
+
+    def __repr__(self):
+        return (f"MetricAccumulator(tp={self.tp}, fp={self.fp}, fn={self.fn}, "
+                f"tn={self.tn}, n_updates={self.n_updates})")
+
+
+def _reduce_dims(x, per_sample, per_class):
+    """Ejes a sumar: todos salvo batch (per_sample) y canal (per_class)"""
+    keep = {0} if per_sample else set()
+    if per_class and x.dim() > 1:
+        keep.add(1)
+    return tuple(d for d in range(x.dim()) if d not in keep)
+
+
+def _group_sum(x, dims):
+    """Suma por grupo conservando ejes (sum(dim=()) sumaría todo el tensor)"""
+    return x.sum(dim=dims, keepdim=True) if dims else x
+
+
+def _valid_mask(ignore_mask, reference):
+    """Peso 1 en voxels válidos y 0 en los ignorados (None si no hay máscara)"""
+    if ignore_mask is None:
+        return None
+    return (~ignore_mask.bool()).to(reference.dtype).expand_as(reference)
+
+
+class _FusedSegmentationLoss(torch.autograd.Function):
+    """
+    dice_weight * (1 - Dice) + focal_weight * Focal con un único logsigmoid
+
+    Con p = sigmoid(x) y log(1 - p) = log(p) - x:
+        bce = (1 - t) * x - log(p),  p_t = exp(-bce)
+        focal = alpha_t * (1 - p_t)^gamma * bce
+        d bce / dx = p - t
+        d focal / dx = alpha_t * (p - t) * (1 - p_t)^(gamma - 1) * (gamma * p_t * bce + 1 - p_t)
+        d Dice / dp = v * (2 * t * (S + s) - (2 * I + s)) / (S + s)^2
+
+    El backward recalcula estos términos a partir de logits y targets, así
+    que autograd solo guarda las entradas (que ya están en memoria) en lugar
+    de una docena de tensores intermedios del tamaño del volumen.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, targets, valid, dims, dice_weight, focal_weight, alpha, gamma, smooth):
+        log_p = nn.functional.logsigmoid(logits)
+        loss = logits.new_zeros(())
+        intersection = denominator = count = None
+        n_groups = 1
+
+        if dice_weight:
+            probabilities = torch.exp(log_p)
+            if valid is not None:
+                probabilities.mul_(valid)
+            masked_targets = targets if valid is None else targets * valid
+            intersection = _group_sum(probabilities * masked_targets, dims)
+            denominator = _group_sum(probabilities, dims) + _group_sum(masked_targets, dims)
+            del probabilities, masked_targets
+            dice = (2. * intersection + smooth) / (denominator + smooth)
+            loss = loss + dice_weight * (1 - dice.mean())
+
+        if focal_weight:
+            bce = torch.mul(1 - targets, logits).sub_(log_p)
+            modulating = torch.exp(-bce).neg_().add_(1).pow_(gamma)
+            focal = bce.mul_(modulating).mul_((2 * alpha - 1) * targets + (1 - alpha))
+            del modulating
+            if valid is not None:
+                focal.mul_(valid)
+            per_group = _group_sum(focal, dims)
+            n_groups = per_group.numel()
+            # Media por grupo: sobre los voxels válidos o sobre todos los del grupo
+            if valid is not None:
+                count = _group_sum(valid, dims).clamp_min(1)
+                loss = loss + focal_weight * (per_group / count).mean()
+            else:
+                loss = loss + focal_weight * (per_group / (focal.numel() // n_groups)).mean()
+
+        ctx.save_for_backward(logits, targets, valid, intersection, denominator, count)
+        ctx.params = (dice_weight, focal_weight, alpha, gamma, smooth, n_groups)
+        return loss
+
+    @staticmethod
+    @once_differentiable
+    def backward(ctx, grad_output):
+        # once_differentiable: el gradiente se calcula a mano, así que un
+        # doble backward (create_graph=True) lanza un error en lugar de
+        # devolver segundas derivadas incorrectas
+        logits, targets, valid, intersection, denominator, count = ctx.saved_tensors
+        dice_weight, focal_weight, alpha, gamma, smooth, n_groups = ctx.params
+
+        log_p = nn.functional.logsigmoid(logits)
+        probabilities = torch.exp(log_p)
+        grad = torch.zeros_like(logits)
+
+        if dice_weight:
+            total = denominator + smooth
+            # d(1 - Dice)/dp, promediado entre grupos, por dp/dx = p * (1 - p)
+            scale = -dice_weight / intersection.numel() / total ** 2
+            d_dice = (2 * total) * targets - (2. * intersection + smooth)
+            if valid is not None:
+                d_dice = d_dice * valid
+            grad.add_(d_dice.mul_(scale).mul_(probabilities * (1 - probabilities)))
+            del d_dice
+
+        if focal_weight:
+            bce = torch.mul(1 - targets, logits).sub_(log_p)
+            p_t = torch.exp(-bce)
+            one_minus = (1 - p_t).clamp_min_(torch.finfo(logits.dtype).tiny)
+            modulating = one_minus.pow(gamma - 1)
+            d_focal = p_t.mul_(bce).mul_(gamma).add_(one_minus).mul_(modulating)
+            del modulating, one_minus
+            d_focal.mul_(probabilities - targets).mul_((2 * alpha - 1) * targets + (1 - alpha))
+            if valid is not None:
+                d_focal.mul_(valid)
+            if count is None:
+                count = logits.numel() // n_groups
+            grad.add_(d_focal.div_(count).mul_(focal_weight / n_groups))
+            del d_focal, bce
+
+        return grad.mul_(grad_output), None, None, None, None, None, None, None, None
+
+
+def _fused_loss(predictions, targets, ignore_mask, per_sample, per_class,
+                dice_weight=0.0, focal_weight=0.0, alpha=0.25, gamma=2.0, smooth=1e-7):
+    """Prepara targets, máscara y ejes de reducción para _FusedSegmentationLoss"""
+    targets = targets.to(predictions.dtype).expand_as(predictions)
+    valid = _valid_mask(ignore_mask, predictions)
+    dims = _reduce_dims(predictions, per_sample, per_class)
+    return _FusedSegmentationLoss.apply(predictions, targets, valid, dims,
+                                        dice_weight, focal_weight, alpha, gamma, smooth)
+
 
 class DiceLoss(nn.Module):
     """
@@ -157,26 +659,39 @@ class DiceLoss(nn.Module):
     Útil para datasets desbalanceados (pocos píxeles positivos)
     Comúnmente usado en segmentación médica (U-Net, nnU-Net, etc.)
 
+    Admite [B, C, H, W] y [B, C, D, H, W]. Por defecto calcula un único
+    Dice global sobre todo el batch; con per_sample / per_class calcula un
+    Dice por muestra, por clase o por (muestra, clase) y promedia.
+
     Usage:
         criterion = DiceLoss()
         loss = criterion(predictions, targets)
+
+        criterion = DiceLoss(per_sample=True, per_class=True)
+        loss = criterion(logits, targets, ignore_mask=fuera_de_pulmon)
     """
 
-    def __init__(self, smooth=1e-7):
+    def __init__(self, smooth=1e-7, per_sample=False, per_class=False):
         """
         Args:
             smooth (float): Factor de suavizado para evitar división por cero
+            per_sample (bool): Un Dice por muestra del batch (default: False)
+            per_class (bool): Un Dice por canal/clase (default: False)
         """
         super(DiceLoss, self).__init__()
         self.smooth = smooth
+        self.per_sample = per_sample
+        self.per_class = per_class
 
-    def forward(self, predictions, targets):
+    def forward(self, predictions, targets, ignore_mask=None):
         """
         Calcula Dice Loss
 
         Args:
-            predictions (torch.Tensor): Predicciones del modelo [B, C, H, W]
-            targets (torch.Tensor): Ground truth [B, C, H, W]
+            predictions (torch.Tensor): Logits del modelo [B, C, (D,) H, W]
+            targets (torch.Tensor): Ground truth con la misma forma
+            ignore_mask (torch.Tensor, optional): True en voxels a ignorar
+                                                  (broadcastable a predictions)
 
         Returns:
             torch.Tensor: Dice loss (1 - Dice coefficient)
@@ -184,17 +699,10 @@ class DiceLoss(nn.Module):
         Notes:
             - Minimizar Dice Loss equivale a maximizar Dice Coefficient
             - Rango: [0, 1] donde 0 es predicción perfecta
+            - Se reduce con sum(dim=...), sin view(-1): no copia entradas no contiguas
         """
-        predictions = torch.sigmoid(predictions)
-
-        # Flatten
-        predictions = predictions.view(-1)
-        targets = targets.view(-1)
-
-        intersection = (predictions * targets).sum()
-        dice = (2. * intersection + self.smooth) / (predictions.sum() + targets.sum() + self.smooth)
-
-        return 1 - dice
+        return _fused_loss(predictions, targets, ignore_mask, self.per_sample, self.per_class,
+                           dice_weight=1.0, smooth=self.smooth)
 
 
 class FocalLoss(nn.Module):
@@ -203,41 +711,219 @@ class FocalLoss(nn.Module):
 
     Útil para detección de nódulos (muchos más negativos que positivos)
 
+    Calcula un único logsigmoid por forward (estable para logits grandes) y
+    deriva de él la BCE y p_t. Por defecto es la media sobre todos los
+    elementos; per_sample / per_class promedian primero dentro de cada grupo.
+
     Reference:
         Lin et al. "Focal Loss for Dense Object Detection" (2017)
     """
 
-    def __init__(self, alpha=0.25, gamma=2.0):
+    def __init__(self, alpha=0.25, gamma=2.0, per_sample=False, per_class=False):
         """
         Args:
             alpha (float): Peso para clase positiva (default: 0.25)
             gamma (float): Focusing parameter (default: 2.0)
+            per_sample (bool): Media por muestra y luego entre muestras
+            per_class (bool): Media por canal/clase y luego entre clases
         """
         super(FocalLoss, self).__init__()
         self.alpha = alpha
         self.gamma = gamma
+        self.per_sample = per_sample
+        self.per_class = per_class
 
-    def forward(self, predictions, targets):
+    def forward(self, predictions, targets, ignore_mask=None):
         """
         Calcula Focal Loss
 
         Args:
-            predictions (torch.Tensor): Predicciones crudas [B, C, H, W]
-            targets (torch.Tensor): Ground truth [B, C, H, W]
+            predictions (torch.Tensor): Predicciones crudas [B, C, (D,) H, W]
+            targets (torch.Tensor): Ground truth con la misma forma
+            ignore_mask (torch.Tensor, optional): True en voxels a ignorar
 
         Returns:
             torch.Tensor: Focal loss
+
+        Notes:
+            Para targets binarios coincide con BCE * alpha_t * (1 - p_t)^gamma
+            con p_t = p si t = 1, 1 - p si t = 0. Para targets suaves usa
+            p_t = exp(-BCE).
         """
-        bce_loss = nn.functional.binary_cross_entropy_with_logits(
-            predictions, targets, reduction='none'
-        )
+        return _fused_loss(predictions, targets, ignore_mask, self.per_sample, self.per_class,
+                           focal_weight=1.0, alpha=self.alpha, gamma=self.gamma)
+
 
-        predictions_prob = torch.sigmoid(predictions)
-        p_t = predictions_prob * targets + (1 - predictions_prob) * (1 - targets)
+class DiceFocalLoss(nn.Module):
+    """
+    Dice Loss + Focal Loss compartiendo un único logsigmoid
+
+    Las probabilidades del Dice se obtienen como exp(logsigmoid(x)) del mismo
+    tensor que usa la focal, en lugar de calcular sigmoid dos veces.
 
-        alpha_factor = targets * self.alpha + (1 - targets) * (1 - self.alpha)
-        modulating_factor = (1.0 - p_t) ** self.gamma
+    Usage:
+        criterion = DiceFocalLoss(per_sample=True)
+        loss = criterion(logits, targets, ignore_mask=ignorar)
+    """
 
-        loss = alpha_factor * modulating_factor * bce_loss
+    def __init__(self, dice_weight=1.0, focal_weight=1.0, alpha=0.25, gamma=2.0,
+                 smooth=1e-7, per_sample=False, per_class=False):
+        """
+        Args:
+            dice_weight (float): Peso del término Dice
+            focal_weight (float): Peso del término focal
+            alpha, gamma (float): Parámetros de FocalLoss
+            smooth (float): Suavizado de DiceLoss
+            per_sample, per_class (bool): Reducción de ambos términos
+        """
+        super(DiceFocalLoss, self).__init__()
+        self.dice_weight = dice_weight
+        self.focal_weight = focal_weight
+        self.alpha = alpha
+        self.gamma = gamma
+        self.smooth = smooth
+        self.per_sample = per_sample
+        self.per_class = per_class
+
+    def forward(self, predictions, targets, ignore_mask=None):
+        """
+        Args:
+            predictions (torch.Tensor): Logits [B, C, (D,) H, W]
+            targets (torch.Tensor): Ground truth con la misma forma
+            ignore_mask (torch.Tensor, optional): True en voxels a ignorar
+
+        Returns:
+            torch.Tensor: dice_weight * dice + focal_weight * focal
+        """
+        return _fused_loss(predictions, targets, ignore_mask, self.per_sample, self.per_class,
+                           dice_weight=self.dice_weight, focal_weight=self.focal_weight,
+                           alpha=self.alpha, gamma=self.gamma, smooth=self.smooth)
+
+
+def _reference_dice_focal(predictions, targets, alpha=0.25, gamma=2.0, smooth=1e-7):
+    """Implementación anterior (sigmoid dos veces + view(-1)), solo para el benchmark"""
+    probabilities = torch.sigmoid(predictions)
+    flat_p = probabilities.reshape(-1)
+    flat_t = targets.reshape(-1)
+    dice = 1 - (2. * (flat_p * flat_t).sum() + smooth) / (flat_p.sum() + flat_t.sum() + smooth)
+
+    bce = nn.functional.binary_cross_entropy_with_logits(predictions, targets, reduction='none')
+    probabilities = torch.sigmoid(predictions)
+    p_t = probabilities * targets + (1 - probabilities) * (1 - targets)
+    alpha_factor = targets * alpha + (1 - targets) * (1 - alpha)
+    focal = (alpha_factor * (1.0 - p_t) ** gamma * bce).mean()
+    return dice + focal
+
+
+def _saved_bytes(loss_fn):
+    """Bytes de los tensores que autograd guarda para backward durante loss_fn()"""
+    seen = {}
+
+    def pack(tensor):
+        seen[(tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))] = tensor.numel() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        loss = loss_fn()
+    return loss, sum(seen.values())
+
+
+def _peak_step_bytes(step, device):
+    """
+    Pico de memoria (bytes sobre lo ya reservado) durante step()
+
+    En CUDA usa las estadísticas del allocator (reset_peak_memory_stats /
+    max_memory_allocated). En CPU perfila step() con profile_memory=True y
+    lee los eventos '[memory]' de la traza exportada con export_chrome_trace:
+    cada uno lleva 'Total Allocated', los bytes vivos desde que empezó el
+    perfilado. Los totales por operador de key_averages() no sirven: las
+    liberaciones dentro de una autograd.Function se atribuyen a la Function.
+    """
+    device = torch.device(device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        baseline = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        step()
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - baseline
+
+    from torch.profiler import ProfilerActivity, profile
+
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        step()
+
+    fd, trace_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        prof.export_chrome_trace(trace_path)
+        with open(trace_path) as f:
+            events = json.load(f)['traceEvents']
+    finally:
+        os.remove(trace_path)
+
+    events = sorted((e for e in events if e.get('name') == '[memory]'), key=lambda e: e['ts'])
+    if not events:
+        return 0
+    # Total Allocated del primer evento ya incluye sus propios bytes
+    baseline = events[0]['args']['Total Allocated'] - events[0]['args']['Bytes']
+    return max(e['args']['Total Allocated'] for e in events) - baseline
+
+
+def benchmark_losses(shape=(2, 1, 64, 128, 128), n_steps=10, alpha=0.25, gamma=2.0, seed=0,
+                     device='cpu'):
+    """
+    Compara la pérdida Dice + Focal anterior con DiceFocalLoss
+
+    Args:
+        shape (tuple): Forma de logits/targets [B, C, D, H, W]
+        n_steps (int): Pasos forward + backward cronometrados (tras uno de calentamiento)
+        alpha, gamma (float): Parámetros de la focal
+        seed (int): Semilla de los tensores aleatorios
+        device (str): Dispositivo de los tensores (default: 'cpu')
+
+    Returns:
+        dict: Por implementación ('reference', 'fused'):
+            - ms_per_step: tiempo medio de forward + backward
+            - peak_mb: pico de memoria de un paso forward + backward (sin
+              contar logits y targets, ya reservados)
+            - saved_for_backward_mb: tensores que autograd retiene entre
+              forward y backward
+          más abs_diff, la diferencia absoluta entre ambas pérdidas
+    """
+    generator = torch.Generator().manual_seed(seed)
+    logits = (torch.randn(shape, generator=generator) * 3).to(device)
+    targets = (torch.rand(shape, generator=generator) > 0.9).float().to(device)
+    fused = DiceFocalLoss(alpha=alpha, gamma=gamma)
+
+    candidates = {
+        'reference': lambda x: _reference_dice_focal(x, targets, alpha, gamma),
+        'fused': lambda x: fused(x, targets),
+    }
+
+    results = {}
+    values = {}
+    for name, loss_fn in candidates.items():
+        x = logits.clone().requires_grad_(True)
+        loss, saved = _saved_bytes(lambda: loss_fn(x))
+        loss.backward()
+        values[name] = loss.item()
+        del loss
+
+        x.grad = None
+        peak = _peak_step_bytes(lambda: loss_fn(x).backward(), device)
+
+        start = time.perf_counter()
+        for _ in range(n_steps):
+            x.grad = None
+            loss_fn(x).backward()
+        if x.is_cuda:
+            torch.cuda.synchronize(x.device)
+        results[name] = {
+            'ms_per_step': (time.perf_counter() - start) / n_steps * 1000,
+            'peak_mb': peak / 1024**2,
+            'saved_for_backward_mb': saved / 1024**2,
+        }
 
-        return loss.mean()
+    results['abs_diff'] = abs(values['reference'] - values['fused'])
+    return results
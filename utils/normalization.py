@@ -0,0 +1,176 @@
+"""
+Normalización de Hounsfield Units sin copias intermedias
+
+Este módulo proporciona:
+- normalize_hu: una ventana HU -> [0, 1], con buffer de salida (out=) e in-place
+- normalize_hu_windows: varias ventanas apiladas como canales en una pasada
+- Tablas de consulta (LUT) precalculadas para entradas enteras de 8/16 bits (int16 en LUNA16)
+- Salidas compactas: float32, float16 o uint8 (0-255)
+
+El volumen se recorre por bloques a lo largo del eje 0, así que la memoria
+temporal está acotada por el tamaño de bloque y no por el del volumen.
+"""
+
+from functools import lru_cache
+import numpy as np
+
+
+# Ventanas HU habituales (min_hu, max_hu)
+HU_WINDOWS = {
+    'lung': (-1000, 400),         # Ventana pulmonar usada en todo el proyecto
+    'mediastinum': (-160, 240),   # Partes blandas (W=400, L=40)
+    'ggo': (-800, -300),          # Rango típico de opacidades en vidrio esmerilado
+}
+
+# Tipos de salida soportados y su escala
+OUTPUT_SCALES = {
+    np.dtype(np.float32): 1.0,
+    np.dtype(np.float16): 1.0,
+    np.dtype(np.uint8): 255.0,
+}
+
+# Voxels por bloque (~4 slices de 512x512)
+CHUNK_VOXELS = 1 << 20
+
+
+def _resolve_window(window):
+    """Acepta un nombre de HU_WINDOWS o una tupla (min_hu, max_hu)"""
+    if isinstance(window, str):
+        return HU_WINDOWS[window]
+    min_hu, max_hu = window
+    return min_hu, max_hu
+
+
+def _check_dtype(dtype):
+    dtype = np.dtype(dtype)
+    if dtype not in OUTPUT_SCALES:
+        raise ValueError(f"dtype de salida no soportado: {dtype} (usar float32, float16 o uint8)")
+    return dtype
+
+
+def _lut_supported(image):
+    """True si la entrada es entera de 8/16 bits y se puede usar una LUT"""
+    return image.dtype.kind in 'iu' and image.dtype.itemsize <= 2
+
+
+@lru_cache(maxsize=32)
+def _build_lut(input_dtype_str, min_hu, max_hu, output_dtype_str):
+    """
+    LUT con el valor normalizado para cada posible valor de entrada
+
+    La LUT se indexa con los bits de la entrada reinterpretados como enteros
+    sin signo, de modo que el índice es una vista (sin copia) de la imagen.
+    """
+    input_dtype = np.dtype(input_dtype_str).newbyteorder('=')
+    output_dtype = np.dtype(output_dtype_str)
+    unsigned = np.dtype(f'u{input_dtype.itemsize}')
+
+    values = np.arange(2 ** (8 * input_dtype.itemsize), dtype=unsigned).view(input_dtype)
+    lut = _scale(values.astype(np.float64), min_hu, max_hu, output_dtype)
+    lut.setflags(write=False)
+    return lut
+
+
+def _scale(values, min_hu, max_hu, output_dtype):
+    """Aplica la ventana a un array float (modifica values) y lo convierte a output_dtype"""
+    np.clip(values, min_hu, max_hu, out=values)
+    values -= min_hu
+    values *= OUTPUT_SCALES[output_dtype] / (max_hu - min_hu)
+    if output_dtype == np.uint8:
+        np.rint(values, out=values)
+    return values.astype(output_dtype, copy=False)
+
+
+def _index_view(chunk):
+    """Vista de un bloque entero como índice sin signo (respeta el byte order)"""
+    return chunk.view(np.dtype(f'{chunk.dtype.byteorder}u{chunk.dtype.itemsize}'))
+
+
+def _normalize_into(image, windows, outputs, dtype):
+    """
+    Núcleo común: normaliza image con cada ventana y escribe en outputs[c]
+
+    Recorre la entrada una sola vez por bloques del eje 0; cada bloque se
+    lee una vez y se emite en todos los canales mientras está en caché.
+    """
+    rows = image.shape[0]
+    row_size = max(1, int(np.prod(image.shape[1:])))
+    step = max(1, CHUNK_VOXELS // row_size)
+
+    use_lut = _lut_supported(image)
+    if use_lut:
+        luts = [_build_lut(image.dtype.str, min_hu, max_hu, dtype.str) for min_hu, max_hu in windows]
+    else:
+        scratch = np.empty((min(step, rows),) + image.shape[1:], dtype=np.float32)
+
+    for start in range(0, rows, step):
+        stop = min(start + step, rows)
+        chunk = image[start:stop]
+
+        if use_lut:
+            index = _index_view(np.ascontiguousarray(chunk))
+            for lut, out in zip(luts, outputs):
+                np.take(lut, index, out=out[start:stop], mode='clip')
+            continue
+
+        for (min_hu, max_hu), out in zip(windows, outputs):
+            buffer = scratch[:stop - start]
+            buffer[...] = chunk
+            out[start:stop] = _scale(buffer, min_hu, max_hu, dtype)
+
+
+def normalize_hu(image, min_hu=-1000, max_hu=400, out=None, dtype=np.float32):
+    """
+    Normaliza valores Hounsfield Units a [0, 1] (o [0, 255] en uint8)
+
+    Args:
+        image (np.ndarray): Imagen o volumen en HU (admite np.memmap)
+        min_hu (int): Valor HU mínimo (default: -1000)
+        max_hu (int): Valor HU máximo (default: 400)
+        out (np.ndarray, optional): Buffer de salida con la forma de image. Puede
+                                    ser la propia image (in-place) si es float
+        dtype (np.dtype): float32 (default), float16 o uint8. Se ignora si se pasa out
+
+    Returns:
+        np.ndarray: Imagen normalizada
+
+    Notes:
+        - Entradas int8/int16/uint8/uint16: cada bloque se resuelve con una LUT
+          precalculada (una lectura + una escritura por voxel, sin floats intermedios)
+        - Resto de entradas: aritmética float32 por bloques sobre un buffer reutilizado
+    """
+    result = normalize_hu_windows(image, windows=[(min_hu, max_hu)],
+                                  out=None if out is None else out[np.newaxis],
+                                  dtype=dtype)[0]
+    return result if out is None else out
+
+
+def normalize_hu_windows(image, windows=('lung', 'mediastinum', 'ggo'), out=None, dtype=np.float32):
+    """
+    Normaliza con varias ventanas HU a la vez, apiladas como canales
+
+    Args:
+        image (np.ndarray): Imagen o volumen en HU
+        windows (list): Nombres de HU_WINDOWS o tuplas (min_hu, max_hu)
+        out (np.ndarray, optional): Buffer (C, *image.shape) donde escribir
+        dtype (np.dtype): float32 (default), float16 o uint8. Se ignora si se pasa out
+
+    Returns:
+        np.ndarray: Array (C, *image.shape) con un canal por ventana
+
+    Ejemplo:
+        >>> channels = normalize_hu_windows(ct_scan, ['lung', 'ggo'], dtype=np.uint8)
+        >>> channels.shape  # (2, slices, height, width)
+    """
+    image = np.asarray(image)
+    if image.ndim == 0:
+        raise ValueError("image debe tener al menos una dimensión")
+    windows = [_resolve_window(w) for w in windows]
+
+    if out is None:
+        out = np.empty((len(windows),) + image.shape, dtype=_check_dtype(dtype))
+    elif out.shape != (len(windows),) + image.shape:
+        raise ValueError(f"out debe tener shape {(len(windows),) + image.shape}, recibido {out.shape}")
+
+    _normalize_into(image, windows, out, _check_dtype(out.dtype))
+    return out
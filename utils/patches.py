@@ -0,0 +1,74 @@
+"""
+Extracción de patches 3D alrededor de coordenadas voxel
+
+Este módulo proporciona:
+- extract_patches: N cubos (D, H, W) desde cualquier volumen indexable
+  (np.ndarray, np.memmap, dataset h5py) sin materializar el volumen completo
+- Relleno configurable para las regiones fuera del volumen
+- Lectura en orden de z creciente para maximizar el acceso secuencial al disco
+"""
+
+import numpy as np
+
+
+def _as_patch_size(patch_size):
+    """Acepta un entero (cubo) o una tupla (D, H, W)"""
+    if np.isscalar(patch_size):
+        return (int(patch_size),) * 3
+    patch_size = tuple(int(s) for s in patch_size)
+    if len(patch_size) != 3:
+        raise ValueError(f"patch_size debe tener 3 dimensiones, recibido {patch_size}")
+    return patch_size
+
+
+def extract_patches(volume, centers, patch_size=32, pad_value=-1000, out=None):
+    """
+    Extrae patches centrados en coordenadas voxel
+
+    Args:
+        volume (array-like): Volumen (slices, height, width) indexable por slices.
+                             Con np.memmap solo se leen las páginas del ROI
+        centers (array-like): Centros voxel (N, 3) en orden (z, y, x)
+        patch_size (int | tuple): Tamaño del patch, cubo o (D, H, W) (default: 32)
+        pad_value (float): Valor para voxels fuera del volumen (default: -1000 HU, aire)
+        out (np.ndarray, optional): Buffer (N, D, H, W) donde escribir
+
+    Returns:
+        np.ndarray: Patches (N, D, H, W) en el orden de centers
+
+    Notes:
+        - El patch i cubre [center - size // 2, center - size // 2 + size) en cada eje
+        - Las lecturas se hacen ordenadas por z para que el disco lea de forma
+          secuencial; el resultado se devuelve en el orden original
+    """
+    size = np.asarray(_as_patch_size(patch_size))
+    centers = np.rint(np.atleast_2d(np.asarray(centers, dtype=np.float64))).astype(int)
+    shape = np.asarray(volume.shape)
+
+    if out is None:
+        out = np.empty((len(centers),) + tuple(size), dtype=volume.dtype)
+    elif out.shape != (len(centers),) + tuple(size):
+        raise ValueError(f"out debe tener shape {(len(centers),) + tuple(size)}, recibido {out.shape}")
+
+    starts = centers - size // 2
+    stops = starts + size
+    src_starts = np.clip(starts, 0, shape)
+    src_stops = np.clip(stops, 0, shape)
+
+    for i in np.argsort(starts[:, 0], kind='stable'):
+        patch = out[i]
+        if np.any(src_stops[i] <= src_starts[i]):
+            # Patch completamente fuera del volumen
+            patch[...] = pad_value
+            continue
+
+        dst_start = src_starts[i] - starts[i]
+        dst_stop = dst_start + (src_stops[i] - src_starts[i])
+        dst = tuple(slice(a, b) for a, b in zip(dst_start, dst_stop))
+        src = tuple(slice(a, b) for a, b in zip(src_starts[i], src_stops[i]))
+
+        if np.any(dst_start > 0) or np.any(dst_stop < size):
+            patch[...] = pad_value
+        patch[dst] = volume[src]
+
+    return out
@@ -0,0 +1,315 @@
+"""
+Pipeline de preprocesamiento en streaming sobre muchos escaneos
+
+Este módulo proporciona:
+- Stage: una etapa (función item -> item) con su propio número de hilos
+- PreprocessingPipeline: encadena etapas con colas acotadas entre ellas
+  (backpressure: una etapa lenta frena a las anteriores y la memoria en
+  vuelo queda acotada por el tamaño de las colas)
+- Tiempos por etapa (tiempo ocupado, escaneos procesados, media por escaneo)
+- build_default_pipeline: load -> normalize_hu -> segment_lung_mask -> CLAHE
+  -> máscaras de nódulos, el flujo de 06_pipeline_completo
+
+Las funciones pesadas (SimpleITK, cv2, scikit-image, numpy) liberan el GIL,
+así que varios hilos por etapa mantienen ocupados todos los núcleos.
+"""
+
+import queue
+import threading
+import time
+
+from .normalization import normalize_hu
+from .preprocessor import LungPreprocessor
+
+
+# Marca de fin de flujo entre etapas
+_END = object()
+
+# Espera máxima en put/get antes de comprobar si el pipeline se ha cancelado
+_POLL_SECONDS = 0.1
+
+
+class Stage:
+    """
+    Etapa del pipeline
+
+    Attributes:
+        name (str): Nombre de la etapa (clave en los tiempos)
+        func (callable): Recibe el item (dict) y devuelve el item actualizado
+        workers (int): Hilos que ejecutan func en paralelo
+    """
+
+    def __init__(self, name, func, workers=1):
+        """
+        Args:
+            name (str): Nombre de la etapa
+            func (callable): Función item -> item
+            workers (int): Hilos de la etapa (default: 1)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class PreprocessingPipeline:
+    """
+    Encadena etapas como generadores sobre un flujo de escaneos
+
+    Cada item es un dict que empieza como {'seriesuid': uid} y que cada
+    etapa amplía (ej: 'ct', 'normalized', 'lung_mask', ...). Los errores de
+    un escaneo no detienen el resto: el item se descarta en las etapas
+    siguientes y se informa (o se lanza) al llegar a la salida.
+
+    Usage:
+        pipeline = build_default_pipeline(loader, workers={'load': 2, 'segment': 4})
+        for item in pipeline.run(loader.list_scans()):
+            guardar(item['seriesuid'], item['lung_mask'])
+        print(pipeline.report())
+
+    Attributes:
+        stages (list): Etapas en orden
+        queue_size (int): Capacidad de cada cola entre etapas
+        ordered (bool): Si True, la salida respeta el orden de entrada
+        skip_errors (bool): Si True, informa y salta escaneos que fallan
+        timings (dict): {etapa: {'items', 'busy_s', 'mean_s'}} de la última ejecución
+    """
+
+    def __init__(self, stages, queue_size=2, ordered=True, skip_errors=True):
+        """
+        Args:
+            stages (list): Lista de Stage (nombres únicos: son la clave de timings)
+            queue_size (int): Items máximos en cada cola (default: 2)
+            ordered (bool): Mantener el orden de entrada (default: True)
+            skip_errors (bool): Saltar escaneos con error en lugar de lanzar
+        """
+        if not stages:
+            raise ValueError("El pipeline necesita al menos una etapa")
+        names = [stage.name for stage in stages]
+        duplicated = sorted({name for name in names if names.count(name) > 1})
+        if duplicated:
+            raise ValueError(f"Nombres de etapa repetidos: {duplicated}")
+        self.stages = list(stages)
+        self.queue_size = max(1, queue_size)
+        self.ordered = ordered
+        self.skip_errors = skip_errors
+        self.timings = {}
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+
+    def _put(self, q, item, stop):
+        """put con backpressure que se interrumpe si el pipeline se cancela"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, stop):
+        """get que se interrumpe si el pipeline se cancela"""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _acquire(self, slots, stop):
+        """Reserva un hueco de item en vuelo; se interrumpe si el pipeline se cancela"""
+        while not stop.is_set():
+            if slots.acquire(timeout=_POLL_SECONDS):
+                return True
+        return False
+
+    def _feed(self, seriesuids, q, stop, n_consumers, slots):
+        for index, seriesuid in enumerate(seriesuids):
+            # Cada escaneo ocupa un hueco hasta que run() lo entrega o lo descarta
+            if not self._acquire(slots, stop):
+                return
+            if not self._put(q, (index, {'seriesuid': seriesuid}, None), stop):
+                return
+        for _ in range(n_consumers):
+            self._put(q, _END, stop)
+
+    def _work(self, position, stage, q_in, q_out, stop, remaining, n_consumers):
+        """Bucle de un hilo de la etapa; el último en terminar propaga el fin"""
+        timing = self.timings[stage.name]
+        while True:
+            entry = self._get(q_in, stop)
+            if entry is _END:
+                break
+
+            index, item, error = entry
+            if error is None:
+                start = time.perf_counter()
+                try:
+                    item = stage.func(item)
+                except Exception as e:
+                    error = (stage.name, e)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    timing['items'] += 1
+                    timing['busy_s'] += elapsed
+
+            if not self._put(q_out, (index, item, error), stop):
+                return
+
+        with self._lock:
+            remaining[position] -= 1
+            last = remaining[position] == 0
+        if last:
+            for _ in range(n_consumers):
+                self._put(q_out, _END, stop)
+
+    def run(self, seriesuids):
+        """
+        Procesa los escaneos y produce los items a medida que terminan
+
+        Args:
+            seriesuids (iterable): Escaneos a procesar (se consumen bajo demanda)
+
+        Yields:
+            dict: Item con 'seriesuid' y las salidas de cada etapa
+        """
+        self.timings = {stage.name: {'items': 0, 'busy_s': 0.0, 'mean_s': 0.0} for stage in self.stages}
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        # Hilos vivos por etapa (por posición): el último propaga el fin
+        remaining = [stage.workers for stage in self.stages]
+        # Items en vuelo: lo que cabe en las colas, más uno por hilo, más el
+        # buffer de reordenación. Sin este límite, un escaneo lento en modo
+        # ordered haría acumular en memoria todos los posteriores
+        slots = threading.Semaphore(self.max_in_flight())
+
+        threads = [threading.Thread(target=self._feed, daemon=True,
+                                    args=(seriesuids, queues[0], stop, self.stages[0].workers, slots))]
+        for i, stage in enumerate(self.stages):
+            n_consumers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, daemon=True,
+                    args=(i, stage, queues[i], queues[i + 1], stop, remaining, n_consumers),
+                ))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                entry = self._get(queues[-1], stop)
+                if entry is _END:
+                    break
+
+                if not self.ordered:
+                    ready = [entry]
+                else:
+                    # Buffer de reordenación: acotado por max_in_flight (semáforo del feeder)
+                    pending[entry[0]] = entry
+                    ready = []
+                    while next_index in pending:
+                        ready.append(pending.pop(next_index))
+                        next_index += 1
+
+                for _, item, error in ready:
+                    slots.release()
+                    if error is not None:
+                        stage_name, exception = error
+                        if not self.skip_errors:
+                            raise exception
+                        print(f"[ERROR] {item['seriesuid']} ({stage_name}): {exception}")
+                        continue
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall_time = time.perf_counter() - start
+            for timing in self.timings.values():
+                timing['mean_s'] = timing['busy_s'] / max(timing['items'], 1)
+
+    def max_in_flight(self):
+        """
+        Returns:
+            int: Escaneos que pueden estar a la vez entre la entrada y la salida
+                 (colas + hilos); acota la memoria y el buffer de reordenación
+        """
+        return self.queue_size * (len(self.stages) + 1) + sum(stage.workers for stage in self.stages)
+
+    def report(self):
+        """
+        Resumen de tiempos de la última ejecución
+
+        Returns:
+            str: Una línea por etapa con escaneos, tiempo ocupado y media por escaneo.
+                 La etapa con mayor busy_s / workers es el cuello de botella
+        """
+        lines = [f"Pipeline: {self.wall_time:.1f} s en total"]
+        for stage in self.stages:
+            timing = self.timings.get(stage.name, {'items': 0, 'busy_s': 0.0, 'mean_s': 0.0})
+            lines.append(
+                f"  - {stage.name:<12} {timing['items']:>5} escaneos  "
+                f"{timing['busy_s']:8.1f} s ocupados  {timing['mean_s']:6.2f} s/escaneo  "
+                f"({stage.workers} hilos)"
+            )
+        return '\n'.join(lines)
+
+
+def build_default_pipeline(loader, workers=None, min_hu=-1000, max_hu=400, threshold=-320,
+                           clip_limit=2.0, tile_size=(8, 8), queue_size=2,
+                           ordered=True, skip_errors=True):
+    """
+    Pipeline de 06_pipeline_completo: load -> normalize -> segment -> clahe -> nodules
+
+    Args:
+        loader (LUNA16DataLoader): Cargador (con annotations_path para la etapa nodules)
+        workers (dict, optional): Hilos por etapa, ej: {'load': 2, 'segment': 4}.
+                                  Las etapas no indicadas usan 1
+        min_hu, max_hu (int): Ventana HU de normalize_hu
+        threshold (int): Umbral HU de segment_lung_mask
+        clip_limit (float): Límite de contraste de CLAHE
+        tile_size (tuple): Tiles de CLAHE
+        queue_size (int): Capacidad de cada cola entre etapas
+        ordered (bool): Mantener el orden de entrada
+        skip_errors (bool): Saltar escaneos con error
+
+    Returns:
+        PreprocessingPipeline: Items con ct, origin, spacing, normalized,
+                               lung_mask, clahe y nodule_mask
+    """
+    workers = workers or {}
+
+    def load(item):
+        item['ct'], item['origin'], item['spacing'] = loader.load_scan(item['seriesuid'])
+        return item
+
+    def normalize(item):
+        item['normalized'] = normalize_hu(item['ct'], min_hu, max_hu)
+        return item
+
+    def segment(item):
+        item['lung_mask'] = LungPreprocessor.segment_lung_mask_batch(
+            item['ct'], threshold=threshold, workers=1
+        )
+        return item
+
+    def clahe(item):
+        item['clahe'] = LungPreprocessor.apply_clahe_volume(
+            item['normalized'], clip_limit=clip_limit, tile_size=tile_size, workers=1
+        )
+        return item
+
+    def nodules(item):
+        item['nodule_mask'] = loader.load_nodule_mask(item['seriesuid'])
+        return item
+
+    stages = [
+        Stage(name, func, workers.get(name, 1))
+        for name, func in [('load', load), ('normalize', normalize), ('segment', segment),
+                           ('clahe', clahe), ('nodules', nodules)]
+    ]
+    return PreprocessingPipeline(stages, queue_size=queue_size, ordered=ordered,
+                                 skip_errors=skip_errors)
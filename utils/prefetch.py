@@ -0,0 +1,143 @@
+"""
+Iterador de escaneos con lectura anticipada en segundo plano
+
+Este módulo proporciona:
+- ScanPrefetcher: lee los siguientes N escaneos en un pool de hilos
+  mientras el consumidor procesa el actual (solapa I/O y cómputo)
+- Cola acotada por número de escaneos y por presupuesto de memoria
+- Modo ordenado (mismo orden que seriesuids) o no ordenado (el primero listo)
+- Cancelación limpia con close() / bloque with / break
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ScanPrefetcher:
+    """
+    Iterador que produce (seriesuid, volume, origin, spacing) con read-ahead
+
+    La decodificación de .mhd (SimpleITK / np.fromfile) libera el GIL, por lo
+    que unos pocos hilos bastan para mantener el disco ocupado mientras el
+    hilo principal preprocesa.
+
+    Usage:
+        with ScanPrefetcher(loader, seriesuids, prefetch=4) as scans:
+            for seriesuid, ct_scan, origin, spacing in scans:
+                procesar(ct_scan)
+
+    Attributes:
+        loader (LUNA16DataLoader): Cargador usado para leer cada escaneo
+        seriesuids (list): Escaneos a recorrer
+        prefetch (int): Máximo de escaneos leídos por adelantado
+        max_bytes (int): Presupuesto de memoria de los escaneos en cola
+        ordered (bool): Si True, respeta el orden de seriesuids
+    """
+
+    def __init__(self, loader, seriesuids, prefetch=4, workers=2,
+                 max_bytes=2 * 1024**3, ordered=True, lazy=False, skip_errors=False):
+        """
+        Args:
+            loader (LUNA16DataLoader): Cargador (usa load_scan y get_scan_header)
+            seriesuids (list): Escaneos a recorrer
+            prefetch (int): Máximo de escaneos en vuelo (default: 4)
+            workers (int): Hilos de lectura (default: 2)
+            max_bytes (int): Presupuesto de memoria de la cola (default: 2 GB).
+                             Siempre se admite al menos un escaneo
+            ordered (bool): True = orden de entrada; False = orden de llegada
+            lazy (bool): Pasa lazy a load_scan (memmap o, con backend='hdf5', un
+                         h5py.Dataset abierto: cerrarlo con close_hdf5_volume)
+            skip_errors (bool): Si True, informa y salta escaneos que fallan
+        """
+        self.loader = loader
+        self.seriesuids = list(seriesuids)
+        self.prefetch = max(1, prefetch)
+        self.workers = max(1, workers)
+        self.max_bytes = max_bytes
+        self.ordered = ordered
+        self.lazy = lazy
+        self.skip_errors = skip_errors
+
+        self._executor = None
+        self._pending = deque()
+        self._closed = False
+
+    def _estimate_bytes(self, seriesuid):
+        """Tamaño decodificado del escaneo según su cabecera"""
+        try:
+            header = self.loader.get_scan_header(seriesuid)
+        except (OSError, ValueError):
+            return 0
+        n_voxels = header['shape'][0] * header['shape'][1] * header['shape'][2]
+        return n_voxels * header['dtype'].itemsize
+
+    def _load(self, seriesuid):
+        ct_scan, origin, spacing = self.loader.load_scan(seriesuid, lazy=self.lazy)
+        return seriesuid, ct_scan, origin, spacing
+
+    def __iter__(self):
+        if self._closed:
+            raise RuntimeError("ScanPrefetcher ya fue cerrado")
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        queue = deque(self.seriesuids)
+        bytes_in_flight = 0
+
+        try:
+            while queue or self._pending:
+                # Rellenar la cola respetando número de escaneos y presupuesto
+                while queue and len(self._pending) < self.prefetch:
+                    nbytes = 0 if self.lazy else self._estimate_bytes(queue[0])
+                    if self._pending and bytes_in_flight + nbytes > self.max_bytes:
+                        break
+                    seriesuid = queue.popleft()
+                    future = self._executor.submit(self._load, seriesuid)
+                    self._pending.append((future, seriesuid, nbytes))
+                    bytes_in_flight += nbytes
+
+                if self.ordered:
+                    future, seriesuid, nbytes = self._pending.popleft()
+                else:
+                    done, _ = wait([f for f, _, _ in self._pending], return_when=FIRST_COMPLETED)
+                    entry = next(e for e in self._pending if e[0] in done)
+                    self._pending.remove(entry)
+                    future, seriesuid, nbytes = entry
+
+                bytes_in_flight -= nbytes
+
+                try:
+                    item = future.result()
+                except Exception as e:
+                    if not self.skip_errors:
+                        raise
+                    print(f"[ERROR] {seriesuid}: {e}")
+                    continue
+
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Cancela las lecturas pendientes y libera el pool de hilos
+
+        Es seguro llamarlo varias veces; se invoca automáticamente al
+        terminar la iteración, al hacer break o al salir del bloque with.
+        """
+        self._closed = True
+        for future, _, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def __len__(self):
+        return len(self.seriesuids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
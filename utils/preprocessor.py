@@ -2,16 +2,143 @@
 Módulo de preprocesamiento para imágenes CT pulmonares
 
 Proporciona métodos para:
-- Segmentación pulmonar usando técnicas clásicas
-- CLAHE para realce de contraste
-- Creación de máscaras de nódulos
+- Segmentación pulmonar usando técnicas clásicas (por slice, volumétrica o
+  coarse-to-fine sobre una pirámide de resoluciones)
+- CLAHE para realce de contraste (2D por slice o 3D por tiles volumétricos)
+- Creación de máscaras de nódulos (una esfera, o muchas en un volumen de etiquetas)
+- Versiones por lotes de los operadores 2D (slices en paralelo, hilos o procesos)
 """
 
+import threading
+import time
 import numpy as np
 import cv2
-from skimage import measure, morphology
+from skimage import exposure, measure, morphology
 from skimage.segmentation import clear_border
+from scipy import ndimage
 from scipy.ndimage import binary_fill_holes
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+
+# Pools disponibles para los operadores por lotes
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+# Objetos CLAHE de cv2 reutilizados por hilo (no son seguros entre hilos)
+_CLAHE_LOCAL = threading.local()
+
+
+def _get_clahe(clip_limit, tile_size):
+    """Operador CLAHE del hilo actual para (clip_limit, tile_size), creado una vez"""
+    cache = getattr(_CLAHE_LOCAL, 'operators', None)
+    if cache is None:
+        cache = _CLAHE_LOCAL.operators = {}
+    key = (float(clip_limit), tuple(tile_size))
+    if key not in cache:
+        cache[key] = cv2.createCLAHE(clipLimit=key[0], tileGridSize=key[1])
+    return cache[key]
+
+
+def _clahe_slab(volume, out, k0, k1, clip_limit, tile_size):
+    """CLAHE 2D de los slices [k0, k1) con buffers de un slice reutilizados"""
+    clahe = _get_clahe(clip_limit, tile_size)
+    to_uint8 = volume.dtype != np.uint8
+    from_uint8 = out.dtype != np.uint8
+
+    if to_uint8:
+        scaled = np.empty(volume.shape[1:], dtype=np.result_type(volume.dtype, np.float32))
+        image_uint8 = np.empty(volume.shape[1:], dtype=np.uint8)
+    if from_uint8:
+        enhanced = np.empty(volume.shape[1:], dtype=np.uint8)
+
+    for z in range(k0, k1):
+        if to_uint8:
+            # (image * 255).astype(np.uint8) sin temporales
+            np.multiply(volume[z], 255, out=scaled)
+            np.copyto(image_uint8, scaled, casting='unsafe')
+        else:
+            image_uint8 = np.ascontiguousarray(volume[z])
+
+        if from_uint8:
+            clahe.apply(image_uint8, dst=enhanced)
+            np.divide(enhanced, np.float32(255.0), out=out[z], dtype=np.float32)
+        else:
+            out[z] = clahe.apply(image_uint8)
+
+
+def _apply_to_slab(func_name, slab, kwargs, out=None):
+    """Aplica un operador 2D de LungPreprocessor a cada slice de un bloque"""
+    func = getattr(LungPreprocessor, func_name)
+    if out is None:
+        return np.stack([func(image, **kwargs) for image in slab])
+    for i, image in enumerate(slab):
+        out[i] = func(image, **kwargs)
+    return None
+
+
+def _map_slices(func_name, volume, out, workers, executor, chunk_slices, kwargs):
+    """
+    Reparte los slices de volume en bloques y escribe cada resultado en out[z]
+
+    Con hilos cada bloque se escribe directamente en out; con procesos el
+    bloque vuelve serializado y se copia en su posición. En ambos casos el
+    orden de salida es el de entrada.
+    """
+    chunks = [(k, min(k + chunk_slices, len(volume))) for k in range(0, len(volume), chunk_slices)]
+
+    owns_executor = not isinstance(executor, Executor)
+    if owns_executor:
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor debe ser uno de {list(EXECUTORS)} o un Executor")
+        is_process = executor == 'process'
+        pool = EXECUTORS[executor](max_workers=max(1, workers))
+    else:
+        is_process = isinstance(executor, ProcessPoolExecutor)
+        pool = executor
+
+    try:
+        if is_process:
+            futures = [pool.submit(_apply_to_slab, func_name, np.asarray(volume[k0:k1]), kwargs)
+                       for k0, k1 in chunks]
+        else:
+            futures = [pool.submit(_apply_to_slab, func_name, volume[k0:k1], kwargs, out[k0:k1])
+                       for k0, k1 in chunks]
+
+        for (k0, k1), future in zip(chunks, futures):
+            result = future.result()
+            if result is not None:
+                out[k0:k1] = result
+    finally:
+        if owns_executor:
+            pool.shutdown()
+
+    return out
+
+
+def _downsample_inplane(volume, factor):
+    """Reducción factor x factor en (y, x) por media de área (cv2.INTER_AREA)"""
+    slices, height, width = volume.shape
+    size = (-(-width // factor), -(-height // factor))
+    out = np.empty((slices, size[1], size[0]), dtype=np.float32)
+    for z in range(slices):
+        image = np.asarray(volume[z], dtype=np.float32)
+        cv2.resize(image, size, dst=out[z], interpolation=cv2.INTER_AREA)
+    return out
+
+
+def _dice(a, b):
+    """Dice entre dos máscaras binarias (1.0 si ambas están vacías)"""
+    a, b = a.astype(bool, copy=False), b.astype(bool, copy=False)
+    total = np.count_nonzero(a) + np.count_nonzero(b)
+    return 1.0 if total == 0 else 2.0 * np.count_nonzero(a & b) / total
+
+
+def _check_out(out, shape, dtype):
+    """Reserva el buffer de salida o valida el recibido"""
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != tuple(shape):
+        raise ValueError(f"out debe tener shape {tuple(shape)}, recibido {out.shape}")
+    return out
 
 
 class LungPreprocessor:
@@ -76,6 +203,170 @@ class LungPreprocessor:
 
         return mask.astype(np.uint8)
 
+    @staticmethod
+    def segment_lung_mask_3d(volume, threshold=-320, n_regions=2, spacing=None):
+        """
+        Segmentación pulmonar volumétrica (todo el escaneo en una pasada)
+
+        Equivalente 3D de segment_lung_mask: las componentes conectadas se
+        etiquetan en 3D, así que la selección de pulmones es coherente entre
+        slices en lugar de decidirse slice a slice.
+
+        Args:
+            volume (np.ndarray): Volumen (slices, height, width) en HU (admite np.memmap)
+            threshold (int): Umbral HU para binarización (default: -320)
+            n_regions (int): Componentes 3D a conservar (default: 2, pulmón izq/der;
+                             si están unidos por la tráquea basta con la mayor)
+            spacing (array-like, optional): Spacing (z, y, x) en mm. Si se indica,
+                                            las áreas se devuelven en mm²
+
+        Returns:
+            tuple: (mask, areas)
+                - mask (np.ndarray): Máscara binaria 3D de pulmones (uint8)
+                - areas (np.ndarray): Área pulmonar por slice (Z,), en pixels
+                  (int64) o en mm² (float64) si se pasa spacing
+
+        Algorithm:
+            1. Binarización: voxels < threshold
+            2. Eliminación de componentes que tocan los bordes laterales (y, x)
+               del volumen (aire externo); los extremos en z no se limpian
+               porque los pulmones suelen llegar al primer/último slice
+            3. Etiquetado 3D (conectividad 6) y selección de las n_regions mayores
+            4. Morfología en el plano de cada slice (mismos pasos que la versión
+               2D): dilation disk(2) → fill_holes → erosion disk(2)
+        """
+        volume = np.asarray(volume)
+        binary = volume < threshold
+
+        # Etiquetado 3D y limpieza de componentes en contacto con los bordes y/x
+        labels, n_labels = ndimage.label(binary)
+        border = np.zeros(n_labels + 1, dtype=bool)
+        for face in (labels[:, 0, :], labels[:, -1, :], labels[:, :, 0], labels[:, :, -1]):
+            border[face] = True
+        border[0] = True
+
+        # Componentes más grandes no conectadas al borde
+        sizes = np.bincount(labels.ravel(), minlength=n_labels + 1)
+        sizes[border] = 0
+        keep = np.zeros(n_labels + 1, dtype=bool)
+        largest = np.argsort(sizes)[::-1][:n_regions]
+        keep[largest[sizes[largest] > 0]] = True
+        mask = keep[labels]
+        del labels
+
+        # Morfología slice a slice: cv2 con kernel disk(2) y relleno de huecos
+        # como fondo no conectado al borde de su slice (etiquetado sin conexión en z)
+        kernel = morphology.disk(2).astype(np.uint8)
+        mask = mask.view(np.uint8)
+        for z in range(len(mask)):
+            cv2.dilate(mask[z], kernel, dst=mask[z])
+
+        in_plane = np.zeros((3, 3, 3), dtype=bool)
+        in_plane[1] = ndimage.generate_binary_structure(2, 1)
+        background, n_background = ndimage.label(mask == 0, structure=in_plane)
+        outside = np.zeros(n_background + 1, dtype=bool)
+        for face in (background[:, 0, :], background[:, -1, :],
+                     background[:, :, 0], background[:, :, -1]):
+            outside[face] = True
+        outside[0] = True
+        mask[~outside[background]] = 1
+        del background
+
+        for z in range(len(mask)):
+            cv2.erode(mask[z], kernel, dst=mask[z])
+
+        areas = np.count_nonzero(mask.reshape(len(mask), -1), axis=1)
+        if spacing is not None:
+            areas = areas * float(spacing[1]) * float(spacing[2])
+
+        return mask, areas
+
+    @staticmethod
+    def segment_lung_mask_pyramid(volume, threshold=-320, factor=2, band=None, n_regions=2,
+                                  spacing=None, compare=False):
+        """
+        Segmentación pulmonar coarse-to-fine (pirámide en el plano y, x)
+
+        El etiquetado 3D, la selección de componentes y el relleno de huecos
+        se hacen sobre el volumen reducido factor x factor en cada slice; a
+        resolución completa solo se revisa una banda estrecha alrededor del
+        contorno.
+
+        Args:
+            volume (np.ndarray): Volumen (slices, height, width) en HU
+            threshold (int): Umbral HU para binarización (default: -320)
+            factor (int): Reducción en (y, x): 2 o 4 (default: 2). El eje z no
+                          se reduce porque su spacing ya suele ser el más grueso
+            band (int, optional): Semiancho de la banda de refinamiento en pixels
+                                  de resolución completa (default: factor)
+            n_regions (int): Componentes 3D a conservar (ver segment_lung_mask_3d)
+            spacing (array-like, optional): Spacing (z, y, x); áreas en mm²
+            compare (bool): Si True, calcula también segment_lung_mask_3d a
+                            resolución completa y devuelve un informe
+
+        Returns:
+            tuple: (mask, areas) como segment_lung_mask_3d, o (mask, areas, report)
+                   si compare=True, con report = {'dice', 'time_pyramid_s',
+                   'time_full_s', 'speedup'}
+
+        Algorithm:
+            1. Media de área factor x factor y segment_lung_mask_3d sobre
+               el volumen reducido
+            2. Upsampling de la máscara por vecino más cercano
+            3. Banda = dilatación XOR erosión del contorno (radio band)
+            4. Dentro de la banda se toma el umbral a resolución completa y se
+               suaviza con el mismo closing disk(2) de la versión 3D
+        """
+        if factor < 1:
+            raise ValueError("factor debe ser >= 1")
+        if band is None:
+            band = factor
+
+        start = time.perf_counter()
+        volume = np.asarray(volume)
+        slices, height, width = volume.shape
+
+        coarse, _ = LungPreprocessor.segment_lung_mask_3d(
+            _downsample_inplane(volume, factor), threshold=threshold, n_regions=n_regions
+        )
+        mask = np.ascontiguousarray(
+            coarse.repeat(factor, axis=1).repeat(factor, axis=2)[:, :height, :width]
+        )
+
+        ring = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1))
+        kernel = morphology.disk(2).astype(np.uint8)
+        outer = np.empty((height, width), dtype=np.uint8)
+        inner = np.empty((height, width), dtype=np.uint8)
+
+        for z in range(slices):
+            cv2.dilate(mask[z], ring, dst=outer)
+            cv2.erode(mask[z], ring, dst=inner)
+            in_band = outer != inner
+            mask[z][in_band] = volume[z][in_band] < threshold
+            cv2.dilate(mask[z], kernel, dst=outer)
+            cv2.erode(outer, kernel, dst=mask[z])
+
+        areas = np.count_nonzero(mask.reshape(slices, -1), axis=1)
+        if spacing is not None:
+            areas = areas * float(spacing[1]) * float(spacing[2])
+
+        if not compare:
+            return mask, areas
+
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        reference, _ = LungPreprocessor.segment_lung_mask_3d(volume, threshold=threshold,
+                                                             n_regions=n_regions)
+        elapsed_full = time.perf_counter() - start
+
+        report = {
+            'dice': float(_dice(mask, reference)),
+            'time_pyramid_s': elapsed,
+            'time_full_s': elapsed_full,
+            'speedup': elapsed_full / max(elapsed, 1e-9),
+        }
+        return mask, areas, report
+
     @staticmethod
     def apply_clahe(image, clip_limit=2.0, tile_size=(8, 8)):
         """
@@ -96,13 +387,164 @@ class LungPreprocessor:
         # Convertir a uint8 para CLAHE
         image_uint8 = (image * 255).astype(np.uint8)
 
-        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_size)
+        clahe = _get_clahe(clip_limit, tile_size)
         enhanced = clahe.apply(image_uint8)
 
         return enhanced.astype(np.float32) / 255.0
 
     @staticmethod
-    def create_nodule_mask(image_shape, center_coords, diameter, spacing):
+    def segment_lung_mask_batch(volume, threshold=-320, workers=4, executor='thread',
+                                out=None, chunk_slices=8):
+        """
+        Aplica segment_lung_mask a cada slice de un volumen en paralelo
+
+        Args:
+            volume (np.ndarray): Volumen (slices, height, width) en HU (admite np.memmap)
+            threshold (int): Umbral HU para binarización (default: -320)
+            workers (int): Hilos o procesos (default: 4)
+            executor (str | Executor): 'thread' (default), 'process', o un pool
+                                       ya creado para reutilizarlo entre escaneos
+            out (np.ndarray, optional): Buffer (slices, height, width) donde escribir
+            chunk_slices (int): Slices por tarea (default: 8)
+
+        Returns:
+            np.ndarray: Máscaras (slices, height, width) uint8, en el orden de entrada
+
+        Notes:
+            - Resultado idéntico a llamar segment_lung_mask slice a slice
+            - cv2/scikit-image liberan el GIL en buena parte del trabajo; con
+              'process' se evita el GIL por completo a cambio de copiar los slices
+        """
+        out = _check_out(out, volume.shape, np.uint8)
+        return _map_slices('segment_lung_mask', volume, out, workers, executor,
+                           chunk_slices, {'threshold': threshold})
+
+    @staticmethod
+    def apply_clahe_batch(volume, clip_limit=2.0, tile_size=(8, 8), workers=4,
+                          executor='thread', out=None, chunk_slices=8):
+        """
+        Aplica apply_clahe a cada slice de un volumen en paralelo
+
+        Args:
+            volume (np.ndarray): Volumen normalizado en [0, 1] (slices, height, width)
+            clip_limit (float): Límite de contraste (default: 2.0)
+            tile_size (tuple): Tamaño de tiles (default: (8, 8))
+            workers (int): Hilos o procesos (default: 4)
+            executor (str | Executor): 'thread' (default), 'process' o un pool existente
+            out (np.ndarray, optional): Buffer (slices, height, width) donde escribir
+            chunk_slices (int): Slices por tarea (default: 8)
+
+        Returns:
+            np.ndarray: Volumen realzado en [0, 1] (float32, o el dtype de out)
+        """
+        out = _check_out(out, volume.shape, np.float32)
+        return _map_slices('apply_clahe', volume, out, workers, executor, chunk_slices,
+                           {'clip_limit': clip_limit, 'tile_size': tile_size})
+
+    @staticmethod
+    def apply_clahe_volume(volume, clip_limit=2.0, tile_size=(8, 8), mode='2d', workers=4,
+                           out=None, chunk_slices=8, z_tiles=None):
+        """
+        CLAHE sobre un volumen completo
+
+        Args:
+            volume (np.ndarray): Volumen (slices, height, width) normalizado en
+                                 [0, 1] (float) o ya en uint8 [0, 255]
+            clip_limit (float): Límite de contraste en unidades de cv2 (default: 2.0)
+            tile_size (tuple): Tiles en (y, x), como tileGridSize de cv2 (default: (8, 8))
+            mode (str): '2d' (CLAHE de cv2 por slice, equivalente a apply_clahe)
+                        o '3d' (tiles volumétricos, realce coherente en z)
+            workers (int): Hilos para procesar bloques de slices en modo '2d'
+            out (np.ndarray, optional): Buffer (slices, height, width) float32 o
+                                        uint8; puede ser el propio volume (in-place)
+            chunk_slices (int): Slices por tarea en modo '2d' (default: 8)
+            z_tiles (int, optional): Tiles a lo largo de z en modo '3d'. Por
+                                     defecto, tiles de la misma extensión en
+                                     voxels que en el plano
+
+        Returns:
+            np.ndarray: Volumen realzado en [0, 1] float32 (o uint8 si out es uint8)
+
+        Notes:
+            - '2d': un objeto CLAHE por hilo (sin creación por slice) y conversión
+              de dtype sobre buffers de un slice reutilizados
+            - '3d': skimage.exposure.equalize_adapthist sobre el volumen, con
+              clip_limit / 256 (cv2 recorta a clip_limit * voxels_tile / 256,
+              skimage a clip_limit * voxels_tile)
+        """
+        if mode not in ('2d', '3d'):
+            raise ValueError("mode debe ser '2d' o '3d'")
+
+        out = _check_out(out, volume.shape, np.float32)
+
+        if mode == '3d':
+            image = np.asarray(volume)
+            if image.dtype == np.uint8:
+                image = image.astype(np.float32) / 255.0
+            tile_y = max(1, volume.shape[1] // tile_size[0])
+            tile_x = max(1, volume.shape[2] // tile_size[1])
+            if z_tiles is None:
+                tile_z = min(volume.shape[0], max(tile_y, tile_x))
+            else:
+                tile_z = max(1, volume.shape[0] // z_tiles)
+            enhanced = exposure.equalize_adapthist(
+                np.clip(image, 0, 1), kernel_size=(tile_z, tile_y, tile_x),
+                clip_limit=clip_limit / 256, nbins=256
+            )
+            if out.dtype == np.uint8:
+                np.multiply(enhanced, 255, out=enhanced)
+                np.rint(enhanced, out=enhanced)
+            out[...] = enhanced
+            return out
+
+        chunks = [(k, min(k + chunk_slices, len(volume))) for k in range(0, len(volume), chunk_slices)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(_clahe_slab, volume, out, k0, k1, clip_limit, tile_size)
+                       for k0, k1 in chunks]
+            for future in futures:
+                future.result()
+
+        return out
+
+    @staticmethod
+    def nodule_sphere(image_shape, center_coords, diameter, spacing):
+        """
+        Rasteriza la esfera de un nódulo solo dentro de su bounding box
+
+        Args:
+            image_shape (tuple): Dimensiones del volumen (slices, height, width)
+            center_coords (array-like): Centro (z, y, x) en voxel (admite decimales)
+            diameter (float): Diámetro en mm
+            spacing (array-like): Espaciado de voxels (z, y, x) en mm
+
+        Returns:
+            tuple: (mask, bbox)
+                - mask (np.ndarray): Esfera bool recortada a la bounding box
+                - bbox (tuple): Tupla de slices (z, y, x) tal que volume[bbox]
+                  corresponde a mask (convención de scipy.ndimage.find_objects).
+                  Si la esfera cae fuera del volumen, mask tiene tamaño 0
+        """
+        center = np.asarray(center_coords, dtype=np.float64)
+        radius_voxels = (diameter / 2) / np.asarray(spacing, dtype=np.float64)
+
+        # Bounding box recortada al volumen
+        starts = np.clip(np.floor(center - radius_voxels).astype(int), 0, image_shape)
+        stops = np.clip(np.floor(center + radius_voxels).astype(int) + 1, 0, image_shape)
+        stops = np.maximum(stops, starts)
+        bbox = tuple(slice(int(a), int(b)) for a, b in zip(starts, stops))
+
+        # Distancia normalizada al cuadrado por eje, combinada por broadcasting
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dz, dy, dx = (
+                ((np.arange(a, b) - c) / r) ** 2
+                for a, b, c, r in zip(starts, stops, center, radius_voxels)
+            )
+            mask = (dz[:, None, None] + dy[None, :, None] + dx[None, None, :]) <= 1.0
+
+        return mask, bbox
+
+    @staticmethod
+    def create_nodule_mask(image_shape, center_coords, diameter, spacing, return_bbox=False):
         """
         Crea máscara esférica para un nódulo
 
@@ -111,38 +553,59 @@ class LungPreprocessor:
             center_coords (array-like): Coordenadas del centro (z, y, x) en voxel
             diameter (float): Diámetro en mm
             spacing (array-like): Espaciado de voxels (z, y, x) en mm
+            return_bbox (bool): Si True, devuelve solo (mask, bbox) recortados
+                                sin reservar el volumen completo (ver nodule_sphere)
 
         Returns:
-            np.ndarray: Máscara binaria 3D del nódulo (uint8)
+            np.ndarray: Máscara binaria 3D del nódulo (uint8), o (mask, bbox)
 
         Algorithm:
-            Crea una esfera 3D usando distancia euclidiana normalizada
+            Crea una esfera 3D usando distancia euclidiana normalizada,
+            evaluada por broadcasting solo dentro de la bounding box
         """
+        sphere, bbox = LungPreprocessor.nodule_sphere(image_shape, center_coords, diameter, spacing)
+        if return_bbox:
+            return sphere.astype(np.uint8), bbox
+
         mask = np.zeros(image_shape, dtype=np.uint8)
+        mask[bbox] = sphere
+        return mask
 
-        # Radio en voxels
-        radius_voxels = (diameter / 2) / spacing
-
-        # Coordenadas
-        z, y, x = center_coords
-
-        # Crear esfera
-        for dz in range(-int(radius_voxels[0])-1, int(radius_voxels[0])+2):
-            for dy in range(-int(radius_voxels[1])-1, int(radius_voxels[1])+2):
-                for dx in range(-int(radius_voxels[2])-1, int(radius_voxels[2])+2):
-                    z_idx, y_idx, x_idx = z + dz, y + dy, x + dx
-
-                    # Verificar límites
-                    if (0 <= z_idx < image_shape[0] and
-                        0 <= y_idx < image_shape[1] and
-                        0 <= x_idx < image_shape[2]):
-                        # Calcular distancia euclidiana
-                        dist = np.sqrt(
-                            (dz/radius_voxels[0])**2 +
-                            (dy/radius_voxels[1])**2 +
-                            (dx/radius_voxels[2])**2
-                        )
-                        if dist <= 1.0:
-                            mask[z_idx, y_idx, x_idx] = 1
+    @staticmethod
+    def create_nodule_masks(image_shape, centers, diameters, spacing, mode='label', out=None):
+        """
+        Rasteriza varios nódulos en un único volumen
 
-        return mask
+        Args:
+            image_shape (tuple): Dimensiones del volumen (slices, height, width)
+            centers (array-like): Centros (N, 3) (z, y, x) en voxel
+            diameters (array-like): Diámetros (N,) en mm
+            spacing (array-like): Espaciado de voxels (z, y, x) en mm
+            mode (str): 'label' (nódulo i -> valor i + 1) o 'union' (máscara binaria)
+            out (np.ndarray, optional): Volumen donde escribir (se pone a cero)
+
+        Returns:
+            np.ndarray: Volumen de etiquetas (uint8, o uint16 con más de 255
+                        nódulos) o máscara binaria uint8
+
+        Notes:
+            Si dos nódulos se solapan, en modo 'label' prevalece el posterior
+        """
+        if mode not in ('label', 'union'):
+            raise ValueError("mode debe ser 'label' o 'union'")
+
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        diameters = np.broadcast_to(np.asarray(diameters, dtype=np.float64), (len(centers),))
+
+        dtype = np.uint8 if mode == 'union' or len(centers) < 256 else np.uint16
+        out = _check_out(out, tuple(image_shape), dtype)
+        out[...] = 0
+
+        for label, (center, diameter) in enumerate(zip(centers, diameters), start=1):
+            sphere, bbox = LungPreprocessor.nodule_sphere(image_shape, center, diameter, spacing)
+            if mode == 'union':
+                out[bbox] |= sphere
+            else:
+                out[bbox][sphere] = label
+
+        return out
@@ -0,0 +1,447 @@
+"""
+Máscaras dispersas ancladas a bounding boxes
+
+Este módulo proporciona:
+- SparseMask: una máscara binaria de un volumen guardada como recortes
+  (mask, bbox), como los que devuelven LIDCAnnotationLoader
+  (get_annotation_mask, get_consensus_mask, get_aligned_*) y
+  NoduleLabelStore.crops
+- Unión, intersección, número de voxels, centroides y métricas (Dice, IoU,
+  HD95, ...) calculados sobre los recortes, sin reservar el volumen completo
+- densify: volumen completo (unión o etiquetas) solo cuando se pide
+
+Cada recorte conserva su identidad (ej: un nódulo) aunque su bounding box se
+solape con la de otro; solo las operaciones de conjunto y los conteos
+fusionan los recortes que comparten voxels.
+
+Un escaneo con varios nódulos ocupa kilobytes en lugar de los cientos de MB
+de un volumen uint8 por nódulo.
+"""
+
+import numpy as np
+from scipy import ndimage
+from scipy.sparse.csgraph import connected_components
+
+from .metrics import SegmentationMetrics, _as_sparse
+
+
+class SparseMask:
+    """
+    Máscara binaria de un volumen como lista de recortes
+
+    Cada recorte es un array bool con su esquina (start) en el volumen y se
+    guarda tal cual se añade: centroids(), counts() y densify(mode='label')
+    dan un valor por recorte (ej: por nódulo), aunque dos nódulos cercanos
+    tengan bounding boxes solapadas. count(), union, intersection y las
+    métricas trabajan sobre la unión de los recortes: si alguno comparte
+    voxels con otro, se fusionan por bounding box en una copia interna.
+
+    Usage:
+        nodules = SparseMask(ct_scan.shape)
+        for idx in range(n_nodules):
+            result = lidc_loader.get_aligned_consensus_mask(seriesuid, idx, ...)
+            if result:
+                nodules.add(*result)
+
+        print(nodules.count(), nodules.centroids())
+        dice = nodules.metrics(prediction)['dice']
+        volume = nodules.densify()        # solo si se necesita el volumen
+
+    Attributes:
+        shape (tuple): Dimensiones del volumen completo (z, y, x)
+        masks (list): Recortes bool
+        starts (list): Esquina (z, y, x) de cada recorte en el volumen
+    """
+
+    # Sin parejas de recortes que compartan voxels: count() suma sin deduplicar
+    _disjoint = True
+    # Recortes fusionados por bounding box (caché de _disjoint_crops)
+    _merged = None
+
+    def __init__(self, shape, crops=None):
+        """
+        Args:
+            shape (tuple): Dimensiones del volumen completo (z, y, x)
+            crops (iterable, optional): Pares (mask, bbox) con bbox tupla de
+                                        slices o array (3, 2) [start, stop)
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.masks = []
+        self.starts = []
+        for mask, bbox in crops or ():
+            self.add(mask, bbox)
+
+    @classmethod
+    def from_dense(cls, volume, split=True):
+        """
+        Convierte un volumen completo en recortes
+
+        Args:
+            volume (np.ndarray): Máscara (cualquier valor != 0 es positivo)
+            split (bool): Si True, un recorte por componente conexa
+                          (conectividad 6); si False, uno solo
+
+        Returns:
+            SparseMask
+        """
+        volume = np.asarray(volume)
+        sparse = cls(volume.shape)
+        if not split:
+            crop, start = _as_sparse(volume)
+            sparse._append(crop, start)
+            return sparse
+
+        # Las componentes no comparten voxels: se añaden sin comprobar solapes
+        labels, _ = ndimage.label(volume != 0)
+        for label, slices in enumerate(ndimage.find_objects(labels), start=1):
+            if slices is not None:
+                sparse._append(labels[slices] == label, [s.start for s in slices])
+        return sparse
+
+    @classmethod
+    def from_label_store(cls, store, seriesuid, sources=None):
+        """
+        Máscaras de nódulos de un escaneo de un NoduleLabelStore
+
+        Args:
+            store (NoduleLabelStore): Almacén de máscaras
+            seriesuid (str): Identificador del escaneo
+            sources (str | list, optional): 'annotations', 'lidc' o ambos (default)
+
+        Returns:
+            SparseMask
+        """
+        return cls(store.shape_for(seriesuid), store.crops(seriesuid, sources))
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __iter__(self):
+        """Itera sobre pares (mask, slices)"""
+        for mask, start in zip(self.masks, self.starts):
+            yield mask, self._slices(mask, start)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __repr__(self):
+        return f"SparseMask(shape={self.shape}, crops={len(self)}, voxels={self.count()})"
+
+    @staticmethod
+    def _slices(mask, start):
+        return tuple(slice(int(a), int(a) + n) for a, n in zip(start, mask.shape))
+
+    def _bboxes(self):
+        """(N, 3, 2) [start, stop) de cada recorte"""
+        if not self.masks:
+            return np.empty((0, 3, 2), dtype=np.int64)
+        starts = np.asarray(self.starts, dtype=np.int64)
+        stops = starts + np.array([m.shape for m in self.masks], dtype=np.int64)
+        return np.stack([starts, stops], axis=-1)
+
+    def _append(self, crop, start):
+        if crop.size and crop.any():
+            self.masks.append(crop)
+            self.starts.append(np.asarray(start, dtype=np.int64))
+            self._merged = None
+
+    def _overlapping_pairs(self, other):
+        """
+        Pares de recortes (i de self, j de other) cuyas bounding boxes se solapan
+
+        Returns:
+            tuple: (i, j, low, high) con low/high (P, 3) la caja común [low, high)
+        """
+        a_boxes, b_boxes = self._bboxes(), other._bboxes()
+        lows = np.maximum(a_boxes[:, None, :, 0], b_boxes[None, :, :, 0])
+        highs = np.minimum(a_boxes[:, None, :, 1], b_boxes[None, :, :, 1])
+        i, j = np.nonzero(np.all(lows < highs, axis=-1))
+        return i, j, lows[i, j], highs[i, j]
+
+    def _window(self, i, low, high):
+        """Parte del recorte i dentro de la caja [low, high) del volumen"""
+        offset = low - self.starts[i]
+        return self.masks[i][tuple(slice(a, a + n) for a, n in zip(offset, high - low))]
+
+    def _shares_voxels(self, other):
+        """True si algún recorte de self comparte voxels con uno de other"""
+        for i, j, low, high in zip(*self._overlapping_pairs(other)):
+            if (self._window(i, low, high) & other._window(j, low, high)).any():
+                return True
+        return False
+
+    def add(self, mask, bbox):
+        """
+        Añade un recorte como un elemento más (ej: un nódulo)
+
+        Args:
+            mask (np.ndarray): Recorte (cualquier valor != 0 es positivo)
+            bbox: Tupla de slices o array (3, 2) [start, stop) en el volumen
+
+        Returns:
+            SparseMask: self
+        """
+        crop, offset = _as_sparse(np.asarray(mask))
+        if not crop.any():
+            return self
+        starts = [b.start for b in bbox] if isinstance(bbox[0], slice) else np.asarray(bbox)[:, 0]
+        start = np.asarray(starts, dtype=np.int64) + offset
+
+        # Recorta lo que quede fuera del volumen
+        low = np.maximum(-start, 0)
+        high = np.minimum(np.asarray(self.shape) - start, crop.shape)
+        if np.any(high <= low):
+            return self
+        crop = crop[tuple(slice(a, b) for a, b in zip(low, high))]
+
+        added = SparseMask(self.shape)
+        added._append(crop, start + low)
+        if self._disjoint:
+            self._disjoint = not self._shares_voxels(added)
+        self._append(crop, start + low)
+        return self
+
+    def _disjoint_crops(self):
+        """
+        Recortes sin voxels compartidos que cubren la misma unión
+
+        Si ya lo son, los propios recortes; si no, una copia en la que se
+        fusionan los grupos de bounding boxes solapadas (una matriz de
+        solapes y un connected_components por pasada).
+
+        Returns:
+            SparseMask
+        """
+        if self._disjoint:
+            return self
+        if self._merged is not None:
+            return self._merged
+
+        masks, starts = list(self.masks), list(self.starts)
+        while len(masks) > 1:
+            starts_array = np.asarray(starts, dtype=np.int64)
+            bboxes = np.stack([starts_array, starts_array + [m.shape for m in masks]], axis=-1)
+            overlap = np.all(
+                (bboxes[:, None, :, 0] < bboxes[None, :, :, 1])
+                & (bboxes[None, :, :, 0] < bboxes[:, None, :, 1]), axis=-1
+            )
+            n_groups, groups = connected_components(overlap, directed=False)
+            if n_groups == len(masks):
+                break
+
+            merged_masks, merged_starts = [], []
+            for group in range(n_groups):
+                members = np.flatnonzero(groups == group)
+                start = bboxes[members, :, 0].min(axis=0)
+                stop = bboxes[members, :, 1].max(axis=0)
+                merged = np.zeros(tuple(stop - start), dtype=bool)
+                for i in members:
+                    merged[self._slices(masks[i], starts[i] - start)] |= masks[i]
+                merged_masks.append(merged)
+                merged_starts.append(start)
+            masks, starts = merged_masks, merged_starts
+
+        self._merged = SparseMask(self.shape)
+        self._merged.masks, self._merged.starts = masks, starts
+        return self._merged
+
+    def copy(self):
+        """Copia independiente (los recortes se copian)"""
+        sparse = SparseMask(self.shape)
+        sparse.masks = [m.copy() for m in self.masks]
+        sparse.starts = [s.copy() for s in self.starts]
+        sparse._disjoint = self._disjoint
+        return sparse
+
+    def _check_shape(self, other):
+        if other.shape != self.shape:
+            raise ValueError(f"Formas distintas: {self.shape} y {other.shape}")
+
+    def union(self, other):
+        """
+        Args:
+            other (SparseMask): Máscara del mismo volumen
+
+        Returns:
+            SparseMask: Voxels presentes en cualquiera de las dos
+        """
+        self._check_shape(other)
+        result = self.copy()
+        result._disjoint = self._disjoint and other._disjoint and not self._shares_voxels(other)
+        for mask, start in zip(other.masks, other.starts):
+            result._append(mask.copy(), start.copy())
+        return result
+
+    def intersection(self, other):
+        """
+        Intersección recorte a recorte (solo los pares cuyas bbox se solapan)
+
+        Se calcula sobre las versiones sin voxels compartidos de cada máscara,
+        así que los recortes del resultado tampoco los comparten.
+
+        Args:
+            other (SparseMask): Máscara del mismo volumen
+
+        Returns:
+            SparseMask: Voxels presentes en las dos
+        """
+        self._check_shape(other)
+        a, b = self._disjoint_crops(), other._disjoint_crops()
+        result = SparseMask(self.shape)
+        for i, j, low, high in zip(*a._overlapping_pairs(b)):
+            crop, offset = _as_sparse(a._window(i, low, high) & b._window(j, low, high))
+            result._append(crop, low + offset)
+        return result
+
+    def count(self):
+        """
+        Returns:
+            int: Número de voxels positivos (de la unión de los recortes)
+        """
+        return int(sum(np.count_nonzero(m) for m in self._disjoint_crops().masks))
+
+    def counts(self):
+        """
+        Returns:
+            np.ndarray: Voxels positivos de cada recorte (N,); los voxels
+                        compartidos cuentan en cada recorte que los contiene
+        """
+        return np.array([np.count_nonzero(m) for m in self.masks], dtype=np.int64)
+
+    def centroids(self):
+        """
+        Centroide de cada recorte (ej: cada nódulo) en coordenadas voxel
+
+        Returns:
+            np.ndarray: (N, 3) en orden (z, y, x)
+        """
+        if not self.masks:
+            return np.empty((0, 3))
+        return np.array([
+            np.argwhere(mask).mean(axis=0) + start
+            for mask, start in zip(self.masks, self.starts)
+        ])
+
+    def centroid(self):
+        """
+        Centroide de todos los voxels positivos en coordenadas voxel
+
+        Returns:
+            np.ndarray: (3,) en orden (z, y, x), NaN si la máscara está vacía
+        """
+        disjoint = self._disjoint_crops()
+        counts = disjoint.counts()
+        if counts.sum() == 0:
+            return np.full(3, np.nan)
+        return (disjoint.centroids() * counts[:, None]).sum(axis=0) / counts.sum()
+
+    def bbox(self):
+        """
+        Returns:
+            np.ndarray: Bounding box (3, 2) [start, stop) de toda la máscara,
+                        None si está vacía
+        """
+        bboxes = self._bboxes()
+        if not len(bboxes):
+            return None
+        return np.stack([bboxes[:, :, 0].min(axis=0), bboxes[:, :, 1].max(axis=0)], axis=-1)
+
+    def to_pair(self):
+        """
+        Un único recorte que cubre toda la máscara
+
+        Returns:
+            tuple: (mask, slices), el formato de get_annotation_mask y de
+                   SegmentationMetrics.surface_metrics
+        """
+        bbox = self.bbox()
+        if bbox is None:
+            return np.zeros((0, 0, 0), dtype=bool), tuple(slice(0, 0) for _ in self.shape)
+        crop = np.zeros(tuple(bbox[:, 1] - bbox[:, 0]), dtype=bool)
+        for mask, start in zip(self.masks, self.starts):
+            crop[self._slices(mask, start - bbox[:, 0])] |= mask
+        return crop, tuple(slice(int(a), int(b)) for a, b in bbox)
+
+    def densify(self, mode='union', out=None):
+        """
+        Reconstruye el volumen completo
+
+        Args:
+            mode (str): 'union' (0/1) o 'label' (recorte i -> i + 1; en
+                        voxels compartidos queda el último recorte)
+            out (np.ndarray, optional): Volumen donde escribir (se pone a cero)
+
+        Returns:
+            np.ndarray: Volumen uint8 (uint16 con más de 255 recortes en 'label')
+        """
+        if mode not in ('label', 'union'):
+            raise ValueError("mode debe ser 'label' o 'union'")
+        if out is None:
+            dtype = np.uint8 if mode == 'union' or len(self) < 256 else np.uint16
+            out = np.zeros(self.shape, dtype=dtype)
+        elif out.shape != self.shape:
+            raise ValueError(f"out debe tener shape {self.shape}, recibido {out.shape}")
+        else:
+            out[...] = 0
+
+        for label, (mask, slices) in enumerate(self, start=1):
+            out[slices][mask] = 1 if mode == 'union' else label
+        return out
+
+    def confusion_counts(self, y_pred):
+        """
+        TP, FP, FN y TN con esta máscara como ground truth
+
+        Args:
+            y_pred (SparseMask): Predicción del mismo volumen
+
+        Returns:
+            dict: {'tp', 'fp', 'fn', 'tn'} como en SegmentationMetrics.confusion_counts
+        """
+        tp = self.intersection(y_pred).count()
+        n_true, n_pred = self.count(), y_pred.count()
+        return {
+            'tp': tp,
+            'fp': n_pred - tp,
+            'fn': n_true - tp,
+            'tn': int(np.prod(self.shape)) - n_true - n_pred + tp,
+        }
+
+    def metrics(self, y_pred, smooth=1e-7):
+        """
+        Dice, IoU, sensitivity y specificity sin densificar
+
+        Args:
+            y_pred (SparseMask | np.ndarray): Predicción (un volumen se convierte)
+            smooth (float): Factor de suavizado
+
+        Returns:
+            dict: Mismas claves que SegmentationMetrics.compute_all_metrics
+        """
+        if not isinstance(y_pred, SparseMask):
+            y_pred = SparseMask.from_dense(y_pred, split=False)
+        return SegmentationMetrics.metrics_from_counts(self.confusion_counts(y_pred), smooth)
+
+    def surface_metrics(self, y_pred, spacing=None, margin=1):
+        """
+        HD95 y ASSD en mm sobre la unión de las bounding boxes
+
+        Args:
+            y_pred (SparseMask | np.ndarray): Predicción (un volumen se convierte)
+            spacing (array-like, optional): Spacing (z, y, x) en mm
+            margin (int): Voxels de margen (ver SegmentationMetrics.surface_distances)
+
+        Returns:
+            dict: {'hd95', 'assd'}
+        """
+        if not isinstance(y_pred, SparseMask):
+            y_pred = SparseMask.from_dense(y_pred, split=False)
+        return SegmentationMetrics.surface_metrics(self.to_pair(), y_pred.to_pair(),
+                                                   spacing=spacing, margin=margin)
+
+    def nbytes(self):
+        """Memoria ocupada por los recortes"""
+        return sum(m.nbytes for m in self.masks) + 24 * len(self.starts)